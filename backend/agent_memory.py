@@ -1,42 +1,156 @@
+"""
+Long-term memory of self-corrections made by the agents.
+Stored in SQLite (WAL mode) so several uvicorn workers can append concurrently
+without lost updates or torn files. Reads are served from an in-process cache
+that is refreshed only when another writer bumps the store's version counter.
+"""
 import json
 import os
+import sqlite3
+import threading
 from datetime import datetime
+from vector_index import VectorIndex
 
-MEMORY_FILE = os.path.join(os.path.dirname(__file__), "agent_memory.json")
+BACKEND_DIR = os.path.dirname(os.path.abspath(__file__))
+MEMORY_DB = os.getenv("AGENT_MEMORY_DB", os.path.join(BACKEND_DIR, "agent_memory.db"))
+# Legacy store; imported once into MEMORY_DB
+MEMORY_FILE = os.path.join(BACKEND_DIR, "agent_memory.json")
+MEMORY_INDEX_PATH = os.path.join(BACKEND_DIR, "agent_memory_index")
+MEMORY_RETENTION = int(os.getenv("AGENT_MEMORY_RETENTION", "1000"))
+# Minimum cosine similarity for a past correction to be used as a few-shot example
+MEMORY_MIN_SIMILARITY = float(os.getenv("MEMORY_MIN_SIMILARITY", "0.35"))
 
-def load_memory():
-    if not os.path.exists(MEMORY_FILE):
-        return {"corrections": [], "successful_patterns": []}
+_local = threading.local()
+_init_lock = threading.Lock()
+_initialized = False
+
+_cache_lock = threading.Lock()
+_cache = {"version": None, "corrections": [], "by_id": {}}
+_index = None
+
+def _connect():
+    """One connection per thread; SQLite connections must not be shared across threads."""
+    conn = getattr(_local, "conn", None)
+    if conn is None:
+        conn = sqlite3.connect(MEMORY_DB, timeout=10, isolation_level=None)
+        conn.row_factory = sqlite3.Row
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute("PRAGMA synchronous=NORMAL")
+        _local.conn = conn
+    _ensure_schema(conn)
+    return conn
+
+def _ensure_schema(conn):
+    global _initialized
+    if _initialized:
+        return
+    with _init_lock:
+        if _initialized:
+            return
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            conn.execute("""
+                CREATE TABLE IF NOT EXISTS corrections (
+                    id INTEGER PRIMARY KEY AUTOINCREMENT,
+                    timestamp TEXT NOT NULL,
+                    query TEXT NOT NULL,
+                    failed_sql TEXT,
+                    error TEXT,
+                    corrected_sql TEXT,
+                    user_id INTEGER
+                )""")
+            # Stores created before corrections were scoped per user; their rows stay ownerless
+            if "user_id" not in {r["name"] for r in conn.execute("PRAGMA table_info(corrections)")}:
+                conn.execute("ALTER TABLE corrections ADD COLUMN user_id INTEGER")
+            conn.execute("CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value TEXT)")
+            conn.execute("INSERT OR IGNORE INTO meta (key, value) VALUES ('version', '0')")
+            _migrate_json(conn)
+            conn.execute("COMMIT")
+        except Exception:
+            conn.execute("ROLLBACK")
+            raise
+        _initialized = True
+
+def _migrate_json(conn):
+    """One-time import of the legacy agent_memory.json (runs inside the schema transaction)."""
+    done = conn.execute("SELECT value FROM meta WHERE key = 'json_migrated'").fetchone()
+    if done or not os.path.exists(MEMORY_FILE):
+        return
     try:
         with open(MEMORY_FILE, "r") as f:
-            return json.load(f)
-    except:
-        return {"corrections": [], "successful_patterns": []}
-
-def save_memory(memory):
-    with open(MEMORY_FILE, "w") as f:
-        json.dump(memory, f, indent=4)
-
-def add_correction(query, failed_sql, error, corrected_sql):
-    memory = load_memory()
-    memory["corrections"].append({
-        "timestamp": datetime.now().isoformat(),
-        "query": query,
-        "failed_sql": failed_sql,
-        "error": error,
-        "corrected_sql": corrected_sql
-    })
-    # Keep only last 50 corrections
-    memory["corrections"] = memory["corrections"][-50:]
-    save_memory(memory)
-
-def get_relevant_memory(query):
-    memory = load_memory()
-    # Simple semantic proxy: find past queries with similar keywords
-    keywords = set(query.lower().split())
-    relevant = []
-    for entry in memory["corrections"]:
-        entry_keywords = set(entry["query"].lower().split())
-        if len(keywords.intersection(entry_keywords)) > 2:
-            relevant.append(entry)
-    return relevant[:3]
+            legacy = json.load(f).get("corrections", [])
+    except Exception as e:
+        print(f"⚠️ Skipping agent_memory.json migration: {e}")
+        legacy = []
+    conn.executemany(
+        "INSERT INTO corrections (timestamp, query, failed_sql, error, corrected_sql) VALUES (?, ?, ?, ?, ?)",
+        [(c.get("timestamp", datetime.now().isoformat()), c.get("query", ""), c.get("failed_sql"),
+          c.get("error"), c.get("corrected_sql")) for c in legacy]
+    )
+    conn.execute("INSERT INTO meta (key, value) VALUES ('json_migrated', ?)", (datetime.now().isoformat(),))
+    conn.execute("UPDATE meta SET value = CAST(value AS INTEGER) + 1 WHERE key = 'version'")
+    print(f"🗄️ Migrated {len(legacy)} corrections from agent_memory.json into SQLite.")
+
+def _current_version(conn):
+    return conn.execute("SELECT value FROM meta WHERE key = 'version'").fetchone()[0]
+
+def _refresh():
+    """Reloads the read cache and vector index if another writer changed the store."""
+    global _index
+    conn = _connect()
+    version = _current_version(conn)
+    with _cache_lock:
+        if _cache["version"] == version:
+            return _cache
+        rows = conn.execute("SELECT * FROM corrections ORDER BY id").fetchall()
+        corrections = [dict(r) for r in rows]
+        if _index is None:
+            _index = VectorIndex(MEMORY_INDEX_PATH)
+        known = set(_index.ids)
+        wanted = {c["id"] for c in corrections}
+        if known != wanted:
+            _index.keep_only(wanted)
+            new = [c for c in corrections if c["id"] not in known]
+            _index.add([c["id"] for c in new], [c["query"] for c in new])
+            _index.save()
+        _cache.update({
+            "version": version,
+            "corrections": corrections,
+            "by_id": {c["id"]: c for c in corrections},
+        })
+        return _cache
+
+def load_memory():
+    return {"corrections": list(_refresh()["corrections"]), "successful_patterns": []}
+
+def add_correction(query, failed_sql, error, corrected_sql, user_id=None):
+    conn = _connect()
+    conn.execute("BEGIN IMMEDIATE")
+    try:
+        conn.execute(
+            "INSERT INTO corrections (timestamp, query, failed_sql, error, corrected_sql, user_id) VALUES (?, ?, ?, ?, ?, ?)",
+            (datetime.now().isoformat(), query, failed_sql, error, corrected_sql, user_id)
+        )
+        # Retention: keep only the newest MEMORY_RETENTION corrections
+        conn.execute(
+            "DELETE FROM corrections WHERE id <= (SELECT id FROM corrections ORDER BY id DESC LIMIT 1 OFFSET ?)",
+            (MEMORY_RETENTION,)
+        )
+        conn.execute("UPDATE meta SET value = CAST(value AS INTEGER) + 1 WHERE key = 'version'")
+        conn.execute("COMMIT")
+    except Exception:
+        conn.execute("ROLLBACK")
+        raise
+
+def get_relevant_memory(query, user_id, k=3):
+    """
+    Returns up to k of `user_id`'s past corrections whose question is most similar to `query`.
+    Only the user's own corrections: they quote questions, table names and filter values.
+    """
+    cache = _refresh()
+    if user_id is None or not cache["corrections"]:
+        return []
+    # Rank everything (at most MEMORY_RETENTION rows), then keep the user's best k
+    matches = _index.search(query, k=len(cache["corrections"]), min_score=MEMORY_MIN_SIMILARITY)
+    own = [cache["by_id"][i] for i, _ in matches if i in cache["by_id"] and cache["by_id"][i]["user_id"] == user_id]
+    return own[:k]
@@ -1,11 +1,4 @@
-import os
-from google import genai
-from dotenv import load_dotenv
-
-load_dotenv()
-
-# Initialize the new Google GenAI Client
-client = genai.Client(api_key=os.getenv("GEMINI_API_KEY"))
+import llm_gateway
 
 def generate_sql(user_prompt, schema_context):
     """
@@ -24,11 +17,7 @@ def generate_sql(user_prompt, schema_context):
     3. If the question cannot be answered by the schema, state that.
     """
     
-    response = client.models.generate_content(
-        model="gemini-2.0-flash",
-        contents=full_prompt
-    )
-    return response.text.strip()
+    return llm_gateway.generate_sync(full_prompt, "ai_engine").strip()
 
 def format_answer(user_prompt, results, columns):
     """
@@ -45,8 +34,4 @@ def format_answer(user_prompt, results, columns):
     Answer:
     """
     
-    response = client.models.generate_content(
-        model="gemini-2.0-flash",
-        contents=full_prompt
-    )
-    return response.text.strip()
+    return llm_gateway.generate_sync(full_prompt, "ai_engine").strip()
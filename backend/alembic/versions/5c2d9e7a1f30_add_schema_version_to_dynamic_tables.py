@@ -0,0 +1,28 @@
+"""Add schema_version to dynamic_tables
+
+Revision ID: 5c2d9e7a1f30
+Revises: 46ef1241b28e
+Create Date: 2026-10-17 09:12:41.204518
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = '5c2d9e7a1f30'
+down_revision: Union[str, Sequence[str], None] = '46ef1241b28e'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    op.add_column('dynamic_tables', sa.Column('schema_version', sa.Integer(), server_default='1', nullable=False, comment='Bumped on every re-upload; lets workers detect stale schema caches'))
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    op.drop_column('dynamic_tables', 'schema_version')
@@ -0,0 +1,28 @@
+"""Add index_info to dynamic_tables
+
+Revision ID: 8a41f0c3d6b2
+Revises: 5c2d9e7a1f30
+Create Date: 2026-10-17 14:03:27.611842
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = '8a41f0c3d6b2'
+down_revision: Union[str, Sequence[str], None] = '5c2d9e7a1f30'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    op.add_column('dynamic_tables', sa.Column('index_info', sa.Text(), nullable=True, comment='JSON record of ANALYZE, cardinality, indexes created and recommended by the index advisor'))
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    op.drop_column('dynamic_tables', 'index_info')
@@ -0,0 +1,28 @@
+"""Add column_stats to dynamic_tables
+
+Revision ID: b7e3c95d1a48
+Revises: 8a41f0c3d6b2
+Create Date: 2026-10-17 15:21:09.478310
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'b7e3c95d1a48'
+down_revision: Union[str, Sequence[str], None] = '8a41f0c3d6b2'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    op.add_column('dynamic_tables', sa.Column('column_stats', sa.Text(), nullable=True, comment='JSON per-column null ratio, min/max, distinct count and top values, computed at upload'))
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    op.drop_column('dynamic_tables', 'column_stats')
@@ -0,0 +1,36 @@
+"""Add scratch_tables registry
+
+Revision ID: c4f8a2d91e07
+Revises: b7e3c95d1a48
+Create Date: 2026-10-17 18:42:09.204518
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'c4f8a2d91e07'
+down_revision: Union[str, Sequence[str], None] = 'b7e3c95d1a48'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    op.create_table(
+        'scratch_tables',
+        sa.Column('name', sa.String(), nullable=False, comment='Name of the staging or retired table'),
+        sa.Column('kind', sa.String(), nullable=False, comment='staging: being loaded | retired: swapped out, awaiting drop'),
+        sa.Column('created_at', sa.DateTime(), nullable=False, comment='When the table was created or retired'),
+        sa.PrimaryKeyConstraint('name'),
+    )
+    op.create_index(op.f('ix_scratch_tables_created_at'), 'scratch_tables', ['created_at'], unique=False)
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    op.drop_index(op.f('ix_scratch_tables_created_at'), table_name='scratch_tables')
+    op.drop_table('scratch_tables')
@@ -0,0 +1,791 @@
+"""
+Performance benchmarks for the NL2SQL backend.
+
+Usage:
+    python benchmark.py chat --requests 50 --concurrency 10 --llm-latency 0.3
+    python benchmark.py ingest --rows 500000
+    python benchmark.py ingest-types
+    python benchmark.py reflection --requests 40 --bad-every 4
+    python benchmark.py generation --llm-latency 0.3
+    python benchmark.py validator --repeat 200
+    python benchmark.py speculative --llm-latency 0.3 --db-latency 0.1
+    python benchmark.py gateway --requests 200 --fail-rate 0.2
+    python benchmark.py retrieval --noise-tables 300
+    python benchmark.py router --thresholds 0.5 0.7 0.9
+
+Scenarios stub out Gemini (and the database where noted) so numbers reflect
+our own orchestration overhead rather than network conditions.
+"""
+import os
+import json
+import argparse
+import asyncio
+import statistics
+import time
+
+# ============================================================================
+# STUBS
+# ============================================================================
+FAKE_SQL = 'SELECT "region", SUM("amount") AS total FROM "sales" GROUP BY "region"'
+
+def fake_structured_reply(plan: str, sql: str) -> str:
+    return json.dumps({"plan": plan, "sql": sql, "self_check": {
+        "tables_and_columns_verified": True, "answers_question": True, "concerns": []}})
+
+def fake_llm_reply(prompt: str, json_output: bool = False) -> str:
+    """Canned replies shaped like each agent's expected Gemini output."""
+    if "SQL Architect Supervisor" in prompt:
+        return '{"target_tables": ["sales"], "query_type": "aggregation", "is_ambiguous": false, "confidence_score": 0.9, "reasoning": "stub"}'
+    if "Senior SQL Architect" in prompt:
+        if json_output:
+            return fake_structured_reply("Sum amount per region.", FAKE_SQL)
+        return f"LOGIC_PATH: Sum amount per region.\nSQL: {FAKE_SQL}"
+    if "Senior Database Auditor" in prompt:
+        return "STATUS: APPROVED\nCRITIQUE: none"
+    return "In response to your query, I analyzed the sales table. Revenue is led by the north region."
+
+FAKE_SCHEMA = "Your Knowledge Base (Uploaded Tables):\n\nTable: sales\n - region (text)\n - amount (double precision)\n"
+FAKE_CATALOG = {
+    "tables": {"sales": [("region", "text"), ("amount", "double precision")]},
+    "stats": {"sales": {"region": {"distinct": 2, "top": [["north", 6], ["south", 4]]}}},
+    "text": FAKE_SCHEMA,
+    "fingerprint": "bench",
+}
+
+def fake_execute_query(sql_query, user_id=None, db_latency=0.02):
+    time.sleep(db_latency)
+    return [{"columns": ["region", "total"], "rows": [("north", 10.0), ("south", 5.0)]}], ""
+
+def _summarize(label, latencies, wall):
+    latencies = sorted(latencies)
+    p95 = latencies[max(0, int(len(latencies) * 0.95) - 1)]
+    print(f"{label:<10} requests={len(latencies):<4} wall={wall:6.2f}s "
+          f"throughput={len(latencies) / wall:7.2f} req/s "
+          f"p50={statistics.median(latencies) * 1000:7.1f}ms p95={p95 * 1000:7.1f}ms")
+
+# ============================================================================
+# SCENARIO: concurrent /chat pipeline
+# ============================================================================
+def _stub_backend(args):
+    """No database, no query cache, no memory writes: every request runs the full pipeline offline."""
+    import database
+    import query_cache
+    import agent_memory
+
+    query_cache.QUERY_CACHE_ENABLED = False
+    database.execute_query = lambda sql, user_id=None, **kw: fake_execute_query(sql, user_id, args.db_latency)
+    database.get_schema_catalog = lambda user_id: FAKE_CATALOG
+    database.check_plan = lambda sql, user_id=None: ""
+    # Self-healed runs must not reach the real memory store (or the next question's prompt)
+    agent_memory.get_relevant_memory = lambda query, user_id: []
+    agent_memory.add_correction = lambda *a, **kw: None
+
+def bench_chat(args):
+    import multi_agent
+
+    _stub_backend(args)
+
+    async def async_llm(prompt, agent=None, response_schema=None):
+        await asyncio.sleep(args.llm_latency)
+        return fake_llm_reply(prompt, response_schema is not None)
+
+    async def blocking_llm(prompt, agent=None, response_schema=None):
+        # What the old synchronous client did: hold the event loop for the whole call
+        time.sleep(args.llm_latency)
+        return fake_llm_reply(prompt, response_schema is not None)
+
+    async def run(label, llm):
+        multi_agent._generate_content = llm
+        semaphore = asyncio.Semaphore(args.concurrency)
+        latencies = []
+
+        async def one(i):
+            async with semaphore:
+                start = time.perf_counter()
+                await multi_agent.run_multi_agent_query_async(f"total revenue by region #{i}", FAKE_SCHEMA, user_id=1)
+                latencies.append(time.perf_counter() - start)
+
+        start = time.perf_counter()
+        await asyncio.gather(*(one(i) for i in range(args.requests)))
+        _summarize(label, latencies, time.perf_counter() - start)
+
+    print(f"📊 /chat pipeline: {args.requests} requests, concurrency {args.concurrency}, "
+          f"LLM latency {args.llm_latency * 1000:.0f}ms, DB latency {args.db_latency * 1000:.0f}ms")
+    asyncio.run(run("blocking", blocking_llm))
+    asyncio.run(run("async", async_llm))
+
+# ============================================================================
+# SCENARIO: Gemini calls per question across reflection modes
+# ============================================================================
+# Hallucinated column the reflection step has to catch
+BAD_SQL = 'SELECT "region", SUM("revenue") AS total FROM "sales" GROUP BY "region"'
+# Valid, but filters on a value the column never holds: the validator passes it with a doubt
+DOUBT_SQL = 'SELECT SUM("amount") AS total FROM "sales" WHERE "region" = \'North\''
+
+def _flaky_llm(args):
+    """Gemini stub whose first draft for "[draft-bad]" questions references a column that does not exist."""
+    async def llm(prompt, agent=None, response_schema=None):
+        await asyncio.sleep(args.llm_latency)
+        if "Senior SQL Architect" in prompt and "[draft-bad]" in prompt and "PREVIOUS ATTEMPT FAILED" not in prompt:
+            if response_schema is not None:
+                return fake_structured_reply("Sum revenue per region.", BAD_SQL)
+            return f"LOGIC_PATH: Sum revenue per region.\nSQL: {BAD_SQL}"
+        if "Senior SQL Architect" in prompt and "[doubt]" in prompt:
+            if response_schema is not None:
+                return fake_structured_reply("Sum amount for the north region.", DOUBT_SQL)
+            return f"LOGIC_PATH: Sum amount for the north region.\nSQL: {DOUBT_SQL}"
+        if "Senior Database Auditor" in prompt and '"revenue"' in prompt:
+            return "STATUS: NEEDS_REVISION\nCRITIQUE: column revenue does not exist in sales."
+        return fake_llm_reply(prompt, response_schema is not None)
+
+    return llm
+
+def bench_reflection(args):
+    import multi_agent
+
+    _stub_backend(args)
+    multi_agent._generate_content = _flaky_llm(args)
+
+    async def run(mode):
+        multi_agent.REFLECTION_MODE = mode
+        semaphore = asyncio.Semaphore(args.concurrency)
+        latencies, calls = [], []
+
+        async def one(i):
+            bad = " [draft-bad]" if args.bad_every and i % args.bad_every == 0 else ""
+            async with semaphore:
+                start = time.perf_counter()
+                result = await multi_agent.run_multi_agent_query_async(f"total sales by region #{i}{bad}", FAKE_SCHEMA, user_id=1)
+                latencies.append(time.perf_counter() - start)
+                calls.append(result["llm_calls"])
+
+        start = time.perf_counter()
+        await asyncio.gather(*(one(i) for i in range(args.requests)))
+        _summarize(mode, latencies, time.perf_counter() - start)
+        print(f"{'':<10} gemini calls/question={sum(calls) / len(calls):.2f} (max {max(calls)})")
+
+    print(f"📊 Reflection modes: {args.requests} questions, every {args.bad_every}th draft hallucinates a column, "
+          f"LLM latency {args.llm_latency * 1000:.0f}ms")
+    for mode in args.modes:
+        asyncio.run(run(mode))
+
+# ============================================================================
+# SCENARIO: SQL validator verdicts and speed
+# ============================================================================
+# (sql, should pass) against FAKE_CATALOG; exits non-zero when a verdict changes
+VALIDATOR_CASES = [
+    (FAKE_SQL, True),
+    (BAD_SQL, False),
+    ('SELECT Region, SUM(Amount) FROM sales GROUP BY Region', True),
+    ('SELECT "Region" FROM sales', False),
+    # Mixed-case aliases of CTEs and derived tables fold like any other unquoted name
+    ('WITH t AS (SELECT region, SUM(amount) AS TotalSales FROM sales GROUP BY region) SELECT TotalSales FROM t', True),
+    ('SELECT s.Total FROM (SELECT SUM(amount) AS Total FROM sales) s', True),
+    ('SELECT s."Total" FROM (SELECT SUM(amount) AS "Total" FROM sales) s', True),
+    ('SELECT s.Total FROM (SELECT SUM(amount) AS "Total" FROM sales) s', False),
+    ('WITH t(Name, Total) AS (SELECT region, amount FROM sales) SELECT name, TOTAL FROM t', True),
+    ('SELECT s.sum FROM (SELECT SUM(amount) FROM sales) s', True),
+    ('SELECT region AS OrderRegion FROM sales ORDER BY OrderRegion', True),
+    ('SELECT SUM(region) FROM sales', False),
+]
+
+def bench_validator(args):
+    import sql_validator
+
+    failures = 0
+    start = time.perf_counter()
+    for round_ in range(args.repeat):
+        for sql, should_pass in VALIDATOR_CASES:
+            report = sql_validator.check(sql, FAKE_CATALOG)
+            if report.ok != should_pass and round_ == 0:
+                failures += 1
+                print(f"❌ expected {'pass' if should_pass else 'errors'}: {sql}\n   {report.errors}")
+    per_check = (time.perf_counter() - start) * 1e6 / (args.repeat * len(VALIDATOR_CASES))
+    print(f"📊 SQL validator: {len(VALIDATOR_CASES) - failures}/{len(VALIDATOR_CASES)} verdicts as expected, "
+          f"{per_check:.0f}µs per check (parses are memoized after the first round)")
+    if failures:
+        raise SystemExit(1)
+
+# ============================================================================
+# SCENARIO: structured single-call generation vs the reasoning -> reflection graph
+# ============================================================================
+GENERATION_CONFIGS = {
+    "graph-llm": ("graph", "llm"),
+    "graph-hybrid": ("graph", "hybrid"),
+    "structured": ("structured", "hybrid"),
+}
+
+def bench_generation(args):
+    import multi_agent
+
+    _stub_backend(args)
+    multi_agent._generate_content = _flaky_llm(args)
+
+    async def run(label):
+        multi_agent.GENERATION_MODE, multi_agent.REFLECTION_MODE = GENERATION_CONFIGS[label]
+        semaphore = asyncio.Semaphore(args.concurrency)
+        latencies, calls = [], []
+
+        async def one(i):
+            bad = " [draft-bad]" if args.bad_every and i % args.bad_every == 0 else ""
+            if args.doubt_every and i % args.doubt_every == 1:
+                bad += " [doubt]"
+            async with semaphore:
+                start = time.perf_counter()
+                result = await multi_agent.run_multi_agent_query_async(f"total revenue by region #{i}{bad}", FAKE_SCHEMA, user_id=1)
+                latencies.append(time.perf_counter() - start)
+                calls.append(result["llm_calls"])
+
+        start = time.perf_counter()
+        await asyncio.gather(*(one(i) for i in range(args.requests)))
+        _summarize(label, latencies, time.perf_counter() - start)
+        print(f"{'':<10} sequential gemini calls/question={statistics.mean(calls):.2f} (max {max(calls)})")
+
+    print(f"📊 Generation modes: {args.requests} questions, every {args.bad_every}th first draft hallucinates a column, "
+          f"every {args.doubt_every}th leaves the validator in doubt, LLM latency {args.llm_latency * 1000:.0f}ms")
+    for label in args.configs:
+        asyncio.run(run(label))
+
+# ============================================================================
+# SCENARIO: speculative local draft alongside Gemini refinement
+# ============================================================================
+SPECULATIVE_CONFIGS = {
+    "serial": (False, False),
+    "speculative": (True, False),
+    "trust-draft": (True, True),
+}
+
+def bench_speculative(args):
+    import multi_agent
+    import local_inference
+
+    _stub_backend(args)
+
+    async def draft(input_text):
+        await asyncio.sleep(args.t5_latency)
+        # T5 writes unquoted names; Gemini's quoted rewrite of it is the same query
+        return FAKE_SQL.replace('"', "")
+
+    async def llm(prompt, agent=None, response_schema=None):
+        await asyncio.sleep(args.llm_latency)
+        return fake_llm_reply(prompt, response_schema is not None)
+
+    local_inference.is_available = lambda: True
+    local_inference.generate_sql_draft = draft
+    multi_agent._generate_content = llm
+
+    async def run(label):
+        multi_agent.SPECULATIVE_DRAFT, multi_agent.SPECULATIVE_TRUST_DRAFT = SPECULATIVE_CONFIGS[label]
+        before = dict(multi_agent.get_stats())
+        semaphore = asyncio.Semaphore(args.concurrency)
+        latencies, calls = [], []
+
+        async def one(i):
+            async with semaphore:
+                start = time.perf_counter()
+                result = await multi_agent.run_multi_agent_query_async(f"total revenue by region #{i}", FAKE_SCHEMA, user_id=1)
+                latencies.append(time.perf_counter() - start)
+                calls.append(result["llm_calls"])
+
+        start = time.perf_counter()
+        await asyncio.gather(*(one(i) for i in range(args.requests)))
+        stats = multi_agent.get_stats()
+        _summarize(label, latencies, time.perf_counter() - start)
+        print(f"{'':<10} gemini calls/question={statistics.mean(calls):.2f} "
+              f"prefetched results used={stats['speculative_hits'] - before['speculative_hits']} "
+              f"answered by draft={stats['speculative_trusted'] - before['speculative_trusted']}")
+
+    print(f"📊 Speculative draft: {args.requests} questions, T5 {args.t5_latency * 1000:.0f}ms, "
+          f"LLM {args.llm_latency * 1000:.0f}ms, DB {args.db_latency * 1000:.0f}ms per query")
+    for label in args.configs:
+        asyncio.run(run(label))
+
+# ============================================================================
+# SCENARIO: LLM gateway against the fake Gemini server
+# ============================================================================
+def bench_gateway(args):
+    import fake_llm_server
+    import llm_gateway
+
+    server, url = fake_llm_server.start(latency=args.llm_latency, fail_rate=args.fail_rate, fail_status=args.fail_status)
+    llm_gateway.GEMINI_BASE_URL = url
+    os.environ.setdefault("GEMINI_API_KEY", "fake")
+    prompt = "You are a SQL Architect Supervisor. Analyze this request: total revenue by region"
+
+    async def bare(prompt, agent):
+        # What the agents did before: one attempt, no limiter, no breaker
+        response = await llm_gateway.get_client().aio.models.generate_content(model=llm_gateway.MODEL_ID, contents=prompt)
+        return response.text
+
+    async def run(label, call, agent):
+        semaphore = asyncio.Semaphore(args.concurrency)
+        latencies, failures = [], []
+
+        async def one():
+            async with semaphore:
+                start = time.perf_counter()
+                try:
+                    await call(prompt, agent)
+                except Exception as e:
+                    failures.append(type(e).__name__)
+                latencies.append(time.perf_counter() - start)
+
+        start = time.perf_counter()
+        await asyncio.gather(*(one() for _ in range(args.requests)))
+        _summarize(label, latencies, time.perf_counter() - start)
+        stats = llm_gateway.get_stats()
+        counters = stats["agents"].get(agent, {})
+        print(f"{'':<10} failed={len(failures)}/{args.requests} retries={counters.get('retries', 0)} "
+              f"rejected={counters.get('rejected', 0)} breaker={stats['breaker']} trips={stats['breaker_trips']}")
+
+    print(f"📊 LLM gateway: {args.requests} calls, concurrency {args.concurrency}, fake server latency "
+          f"{args.llm_latency * 1000:.0f}ms, {args.fail_rate:.0%} answered {args.fail_status}")
+
+    async def phases():
+        # One event loop throughout: the shared client's async connections belong to it
+        await run("bare", bare, "bench-bare")
+        await run("gateway", llm_gateway.generate, "bench-gateway")
+        # Full outage: the breaker should open and later calls fail fast instead of retrying
+        server.fail_rate = 1.0
+        await run("outage", llm_gateway.generate, "bench-outage")
+
+    asyncio.run(phases())
+    server.shutdown()
+
+# ============================================================================
+# SCENARIO: supervisor table retrieval (recall / prompt size)
+# ============================================================================
+# (table base name, columns, categorical values, questions); each domain is uploaded once per year
+RETRIEVAL_DOMAINS = [
+    ("patient_admissions", ["patient_id", "diagnosis", "ward", "admitted_on"],
+     {"diagnosis": ["Coronary Artery Disease", "Asthma", "Diabetes"], "ward": ["cardiology", "oncology", "pediatrics"]},
+     ["how many patients with asthma were admitted in {year}", "admissions per ward in {year}"]),
+    ("sales_orders", ["order_id", "customer_id", "region", "amount", "order_date"],
+     {"region": ["north", "south", "east", "west"]},
+     ["total order amount by region for {year}", "which region had the most orders in {year}"]),
+    ("employee_payroll", ["employee_id", "department", "salary", "bonus", "pay_date"],
+     {"department": ["engineering", "finance", "marketing"]},
+     ["average salary per department in {year}", "total bonus paid to engineering in {year}"]),
+    ("web_sessions", ["session_id", "browser", "device", "duration_seconds", "started_at"],
+     {"browser": ["chrome", "firefox", "safari"], "device": ["mobile", "desktop", "tablet"]},
+     ["average session duration on mobile in {year}", "sessions per browser in {year}"]),
+    ("inventory_stock", ["sku", "warehouse", "quantity_on_hand", "reorder_level"],
+     {"warehouse": ["rotterdam", "memphis", "singapore"]},
+     ["which skus are below their reorder level in {year}", "stock quantity per warehouse in {year}"]),
+    ("support_tickets", ["ticket_id", "priority", "channel", "resolution_hours", "opened_at"],
+     {"priority": ["low", "medium", "urgent"], "channel": ["email", "phone", "chat"]},
+     ["median resolution hours for urgent tickets in {year}", "tickets per channel in {year}"]),
+    ("flight_delays", ["flight_number", "carrier", "origin_airport", "delay_minutes", "flight_date"],
+     {"carrier": ["lufthansa", "delta", "qantas"], "origin_airport": ["JFK", "FRA", "SYD"]},
+     ["average delay minutes per carrier in {year}", "which airport had the longest delays in {year}"]),
+    ("energy_meter_readings", ["meter_id", "building", "kwh", "reading_time"],
+     {"building": ["headquarters", "lab", "depot"]},
+     ["total kwh used by the lab building in {year}", "energy consumption per building in {year}"]),
+    ("student_grades", ["student_id", "course", "grade", "semester"],
+     {"course": ["calculus", "biology", "history"], "semester": ["spring", "fall"]},
+     ["average grade in calculus for {year}", "grades per course in the spring semester of {year}"]),
+    ("marketing_campaigns", ["campaign_id", "channel", "spend", "clicks", "conversions", "launched_on"],
+     {"channel": ["search", "social", "newsletter"]},
+     ["cost per conversion by campaign channel in {year}", "total clicks from social campaigns in {year}"]),
+]
+RETRIEVAL_YEARS = [2019, 2020, 2021, 2022, 2023, 2024]
+_NOISE_WORDS = ["alpha", "beta", "ledger", "archive", "backup", "misc", "temp", "import", "legacy", "export",
+                "survey", "vendor", "asset", "contract", "audit", "shipment", "invoice", "forecast", "quota", "log"]
+_NOISE_COLUMNS = ["id", "name", "status", "notes", "category", "value", "created_at", "updated_at", "owner", "amount"]
+
+def _retrieval_catalog(noise_tables, seed=7):
+    import random
+    rng = random.Random(seed)
+    tables, stats, questions = {}, {}, []
+    for base, columns, values, templates in RETRIEVAL_DOMAINS:
+        for year in RETRIEVAL_YEARS:
+            name = f"{base}_{year}"
+            tables[name] = [(c, "text") for c in columns]
+            stats[name] = {c: {"distinct": len(v), "top": [[x, 1] for x in v]} for c, v in values.items()}
+        for template in templates:
+            for year in rng.sample(RETRIEVAL_YEARS, 2):
+                questions.append((template.format(year=year), f"{base}_{year}"))
+    for i in range(noise_tables):
+        name = f"{rng.choice(_NOISE_WORDS)}_{rng.choice(_NOISE_WORDS)}_{i}"
+        tables[name] = [(c, "text") for c in rng.sample(_NOISE_COLUMNS, 5)]
+        stats[name] = {"category": {"distinct": 3, "top": [[w, 1] for w in rng.sample(_NOISE_WORDS, 3)]}}
+    return {"tables": tables, "stats": stats, "fingerprint": f"bench-{noise_tables}-{seed}"}, questions
+
+def bench_retrieval(args):
+    import database
+    import table_retriever
+
+    catalog, questions = _retrieval_catalog(args.noise_tables)
+    full_schema = database.render_schema(catalog["tables"], stats=catalog["stats"])
+    start = time.perf_counter()
+    index = table_retriever.get_index(catalog)
+    build_ms = (time.perf_counter() - start) * 1000
+
+    print(f"📊 Table retrieval: {len(catalog['tables'])} tables, {len(questions)} questions "
+          f"(index built in {build_ms:.1f}ms); tokens estimated as chars/4")
+    print(f"full       prompt schema ~{len(full_schema) // 4:,} tokens")
+    for k in args.k:
+        hits, sizes, latencies = 0, [], []
+        for question, expected in questions:
+            start = time.perf_counter()
+            ranked = [t for t, _ in index.rank(question)[:k]]
+            latencies.append(time.perf_counter() - start)
+            hits += expected in ranked
+            sizes.append(len(database.render_schema(catalog["tables"], names=ranked, stats=catalog["stats"])) // 4)
+        print(f"top-{k:<6} recall={hits / len(questions):6.1%} prompt schema ~{statistics.mean(sizes):,.0f} tokens "
+              f"({1 - statistics.mean(sizes) / (len(full_schema) / 4):.1%} smaller) "
+              f"rank p50={statistics.median(latencies) * 1000:.2f}ms")
+
+# ============================================================================
+# SCENARIO: supervisor fast path (skip rate vs accuracy per threshold)
+# ============================================================================
+def bench_router(args):
+    import query_router
+
+    catalog, questions = _retrieval_catalog(args.noise_tables)
+    # Questions that name their table, as users with a handful of uploads tend to ask
+    named = [(f"show the latest rows of {base}_{year}", f"{base}_{year}")
+             for base, *_ in RETRIEVAL_DOMAINS for year in RETRIEVAL_YEARS[:2]]
+    cases = [(q, t, catalog) for q, t in questions + named]
+    single = {"tables": {"sales": FAKE_CATALOG["tables"]["sales"]}, "stats": {}, "fingerprint": "bench-single"}
+    cases += [(f"total revenue by region #{i}", "sales", single) for i in range(10)]
+
+    start = time.perf_counter()
+    decisions = [(query_router.route(q, c), t) for q, t, c in cases]
+    route_ms = (time.perf_counter() - start) * 1000 / len(cases)
+
+    print(f"📊 Router: {len(cases)} questions ({len(named)} naming a table, 10 on a one-table catalog), "
+          f"{len(catalog['tables'])} tables, {route_ms:.2f}ms per decision")
+    for threshold in args.thresholds:
+        skipped = [(d, t) for d, t in decisions if d.tables and d.confidence >= threshold]
+        correct = sum(d.tables == [t] for d, t in skipped)
+        accuracy = f"{correct / len(skipped):6.1%}" if skipped else "   n/a"
+        print(f"threshold={threshold:<5} skipped={len(skipped) / len(cases):6.1%} of supervisor calls, "
+              f"correct when skipped={accuracy} ({len(skipped) - correct} wrong)")
+
+# ============================================================================
+# SCENARIO: local T5 inference, per-request vs batched
+# ============================================================================
+SAMPLE_QUESTIONS = [
+    "total revenue by region",
+    "how many orders were cancelled last month",
+    "average price per product category",
+    "top 10 customers by total spend",
+    "count patients with coronary artery disease",
+    "list products with stock below 5",
+    "monthly order count in 2024",
+    "which city has the most users",
+]
+
+def bench_t5_batch(args):
+    from concurrent.futures import ThreadPoolExecutor
+    import local_inference
+
+    if not local_inference.ensure_loaded():
+        print("⚠️ Local model not found; nothing to benchmark.")
+        return
+
+    prompts = [f"translate English to SQL: {SAMPLE_QUESTIONS[i % len(SAMPLE_QUESTIONS)]} \n Context: {FAKE_SCHEMA}"
+               for i in range(args.requests)]
+    local_inference.generate_batch(prompts[:1])  # warm-up
+
+    def timed(fn, prompt):
+        start = time.perf_counter()
+        fn(prompt)
+        return time.perf_counter() - start
+
+    print(f"📊 Local T5: {args.requests} requests, concurrency {args.concurrency}, "
+          f"batch size {local_inference.LOCAL_BATCH_MAX_SIZE}, window {local_inference.LOCAL_BATCH_MAX_WAIT_MS:.0f}ms")
+
+    # Old path: each request runs its own generate in its own thread
+    with ThreadPoolExecutor(max_workers=args.concurrency) as pool:
+        start = time.perf_counter()
+        latencies = list(pool.map(lambda p: timed(lambda x: local_inference.generate_batch([x]), p), prompts))
+        _summarize("per-req", latencies, time.perf_counter() - start)
+
+    with ThreadPoolExecutor(max_workers=args.concurrency) as pool:
+        start = time.perf_counter()
+        latencies = list(pool.map(lambda p: timed(lambda x: local_inference.scheduler.submit(x).result(), p), prompts))
+        _summarize("batched", latencies, time.perf_counter() - start)
+    print(f"   scheduler: {local_inference.scheduler.stats()}")
+
+# ============================================================================
+# SCENARIO: local T5 backends (latency / memory)
+# ============================================================================
+def _rss_mb():
+    import resource
+    # ru_maxrss is KiB on Linux
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+def bench_t5_backend_once(args):
+    """Loads one backend in this (fresh) process and reports load time, latency and peak RSS."""
+    import local_inference
+    import export_model
+
+    model_path = local_inference.find_model_path()
+    baseline_rss = _rss_mb()
+    start = time.perf_counter()
+    tokenizer, model = local_inference.load_model(args.backend, model_path)
+    load_s = time.perf_counter() - start
+
+    prompts = export_model.parity_prompts()
+    local_inference.generate_batch(prompts[:1], tokenizer, model)  # warm-up
+    latencies = []
+    for _ in range(args.rounds):
+        for prompt in prompts:
+            start = time.perf_counter()
+            local_inference.generate_batch([prompt], tokenizer, model)
+            latencies.append(time.perf_counter() - start)
+    latencies.sort()
+    p95 = latencies[max(0, int(len(latencies) * 0.95) - 1)]
+    print(f"{args.backend:<6} load={load_s:5.1f}s p50={statistics.median(latencies) * 1000:7.1f}ms "
+          f"p95={p95 * 1000:7.1f}ms peak_rss={_rss_mb():7.0f}MB (+{_rss_mb() - baseline_rss:.0f}MB for model)")
+
+def bench_t5_backends(args):
+    import subprocess
+    import sys
+    import local_inference
+
+    if not local_inference.find_model_path():
+        print("⚠️ Local model not found; nothing to benchmark.")
+        return
+    print(f"📊 Local T5 backends: {args.rounds} rounds over the parity question set (one process per backend)")
+    for backend in args.backends:
+        subprocess.run([sys.executable, __file__, "t5-backend-once", "--backend", backend, "--rounds", str(args.rounds)])
+
+# ============================================================================
+# SCENARIO: upload ingestion (needs DATABASE_URL)
+# ============================================================================
+def _write_synthetic_csv(path, rows):
+    import random
+    regions = ["north", "south", "east", "west"]
+    with open(path, "w") as f:
+        f.write("order_id,region,amount,quantity,order_date,note\n")
+        for i in range(rows):
+            f.write(f"{i},{random.choice(regions)},{random.uniform(1, 1000):.2f},{random.randint(1, 20)},"
+                    f"2024-{random.randint(1, 12):02d}-{random.randint(1, 28):02d},customer note {i % 97}\n")
+
+def bench_ingest_once(args):
+    """Loads the CSV with one strategy in this (fresh) process and reports rows/s and peak RSS."""
+    import database
+
+    start = time.perf_counter()
+    if args.strategy == "to_sql":
+        # Old path: whole file in memory, row-batched INSERTs
+        import pandas as pd
+        df = pd.read_csv(args.path)
+        df.to_sql(args.table, database.get_sqlalchemy_engine(), if_exists="replace", index=False)
+        rows = len(df)
+    else:
+        rows, _ = database.bulk_load_chunks(database.iter_file_chunks(args.path, args.path, args.chunk_rows), args.table)
+    elapsed = time.perf_counter() - start
+    print(f"{args.strategy:<7} rows={rows:<9} time={elapsed:6.2f}s throughput={rows / elapsed:9.0f} rows/s peak_rss={_rss_mb():6.0f}MB")
+
+def bench_ingest(args):
+    import subprocess
+    import sys
+    import tempfile
+
+    if not os.getenv("DATABASE_URL"):
+        print("⚠️ DATABASE_URL is not set; nothing to benchmark.")
+        return
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, "bench.csv")
+        _write_synthetic_csv(path, args.rows)
+        print(f"📊 Ingestion: {args.rows} rows ({os.path.getsize(path) / 1e6:.1f}MB CSV), chunk size {args.chunk_rows} "
+              f"(one process per strategy)")
+        table = "bench_ingest_tmp"
+        try:
+            for strategy in ("to_sql", "copy"):
+                subprocess.run([sys.executable, __file__, "ingest-once", "--strategy", strategy, "--path", path,
+                                "--table", table, "--chunk-rows", str(args.chunk_rows)])
+        finally:
+            import database
+            conn = database.get_db_connection()
+            if conn:
+                with conn.cursor() as cur:
+                    cur.execute(f"DROP TABLE IF EXISTS {database.quote_ident(table)}")
+                conn.commit()
+                conn.close()
+
+# (column, first chunk values, later chunk values, dtype expected once every chunk has been seen)
+INGEST_TYPE_CASES = [
+    ("empty_then_text", "", "pending", "text"),
+    ("int_then_text", "7", "seven", "text"),
+    ("int_then_float", "7", "7.5", "float64"),
+    ("int_then_missing", "7", "", "int64"),
+    ("float_then_text", "1.5", "x", "text"),
+    ("bool_then_text", "true", "maybe", "text"),
+    ("text_then_int", "x", "7", "text"),
+]
+
+def bench_ingest_types(args):
+    """Feeds CSV chunks whose later rows do not fit the sample's types through the chunk conformer; no database needed."""
+    import tempfile
+    import pandas as pd
+    import database
+
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, "types.csv")
+        with open(path, "w") as f:
+            f.write(",".join(c[0] for c in INGEST_TYPE_CASES) + "\n")
+            for i in range(args.chunk_rows * 2):
+                f.write(",".join(c[1] if i < args.chunk_rows else c[2] for c in INGEST_TYPE_CASES) + "\n")
+        chunks = list(database.iter_file_chunks(path, path, args.chunk_rows))
+    dtypes = chunks[0].dtypes.to_dict()
+    widened = {}
+    for chunk in chunks:
+        widened.update(database._conform_chunk(chunk, dtypes)[1])
+
+    failures = 0
+    for col, _, _, expected in INGEST_TYPE_CASES:
+        got = "text" if pd.api.types.is_string_dtype(dtypes[col]) else str(dtypes[col])
+        if got != expected:
+            failures += 1
+            print(f"❌ {col}: expected {expected}, got {got} (widened: {widened.get(col)})")
+    print(f"📊 Ingest type widening: {len(INGEST_TYPE_CASES) - failures}/{len(INGEST_TYPE_CASES)} columns as expected, "
+          f"widened {widened or 'nothing'}")
+    if failures:
+        raise SystemExit(1)
+
+# ============================================================================
+# SCENARIO: cold start import budget
+# ============================================================================
+# Modules that must not be imported just to serve /login and /signup
+HEAVY_MODULES = ["torch", "transformers", "langgraph", "google.genai", "optimum"]
+
+def bench_startup(args):
+    """Times `import main` in a fresh interpreter; exits non-zero if over budget or heavy modules load eagerly."""
+    import json
+    import subprocess
+    import sys
+
+    probe = (
+        "import json, sys, time; t = time.perf_counter(); import main; "
+        "elapsed = time.perf_counter() - t; "
+        f"print(json.dumps({{'seconds': elapsed, 'loaded': [m for m in {HEAVY_MODULES!r} if m in sys.modules]}}))"
+    )
+    runs = []
+    for _ in range(args.runs):
+        out = subprocess.run([sys.executable, "-c", probe], capture_output=True, text=True, env={**os.environ, "WARMUP_ON_STARTUP": "false"})
+        if out.returncode != 0:
+            print(out.stderr)
+            sys.exit(1)
+        runs.append(json.loads(out.stdout.strip().splitlines()[-1]))
+
+    best = min(r["seconds"] for r in runs)
+    eager = sorted({m for r in runs for m in r["loaded"]})
+    print(f"📊 Cold import of main: best of {args.runs} = {best:.2f}s (budget {args.budget:.2f}s)")
+    if eager:
+        print(f"❌ Heavy modules imported eagerly: {', '.join(eager)}")
+    if best > args.budget:
+        print("❌ Over the cold-start budget.")
+    if eager or best > args.budget:
+        sys.exit(1)
+    print("✅ Within budget.")
+
+# ============================================================================
+# CLI
+# ============================================================================
+def main():
+    parser = argparse.ArgumentParser(description="NL2SQL backend benchmarks")
+    sub = parser.add_subparsers(dest="scenario", required=True)
+
+    chat = sub.add_parser("chat", help="Concurrent multi-agent pipeline against a stubbed LLM")
+    chat.add_argument("--requests", type=int, default=40)
+    chat.add_argument("--concurrency", type=int, default=10)
+    chat.add_argument("--llm-latency", type=float, default=0.3, help="Seconds per stubbed Gemini call")
+    chat.add_argument("--db-latency", type=float, default=0.02, help="Seconds per stubbed query")
+    chat.set_defaults(func=bench_chat)
+
+    reflection = sub.add_parser("reflection", help="Gemini calls per question: LLM reflection vs local SQL validator")
+    reflection.add_argument("--requests", type=int, default=40)
+    reflection.add_argument("--concurrency", type=int, default=10)
+    reflection.add_argument("--bad-every", type=int, default=4, help="Every Nth question gets a draft with a bad column (0: never)")
+    reflection.add_argument("--modes", nargs="+", default=["llm", "hybrid", "local"])
+    reflection.add_argument("--llm-latency", type=float, default=0.05)
+    reflection.add_argument("--db-latency", type=float, default=0.01)
+    reflection.set_defaults(func=bench_reflection)
+
+    validator = sub.add_parser("validator", help="SQL validator: expected verdicts on known cases and time per check")
+    validator.add_argument("--repeat", type=int, default=100)
+    validator.set_defaults(func=bench_validator)
+
+    generation = sub.add_parser("generation", help="Structured single-call generation vs reasoning -> reflection graph")
+    generation.add_argument("--requests", type=int, default=40)
+    generation.add_argument("--concurrency", type=int, default=10)
+    generation.add_argument("--bad-every", type=int, default=4, help="Every Nth question gets a draft with a bad column (0: never)")
+    generation.add_argument("--doubt-every", type=int, default=4, help="Every Nth question gets SQL the validator passes with a doubt")
+    generation.add_argument("--configs", nargs="+", default=list(GENERATION_CONFIGS), choices=list(GENERATION_CONFIGS))
+    generation.add_argument("--llm-latency", type=float, default=0.3)
+    generation.add_argument("--db-latency", type=float, default=0.01)
+    generation.set_defaults(func=bench_generation)
+
+    speculative = sub.add_parser("speculative", help="Local draft validated and run alongside Gemini refinement vs serial")
+    speculative.add_argument("--requests", type=int, default=40)
+    speculative.add_argument("--concurrency", type=int, default=10)
+    speculative.add_argument("--configs", nargs="+", default=list(SPECULATIVE_CONFIGS), choices=list(SPECULATIVE_CONFIGS))
+    speculative.add_argument("--t5-latency", type=float, default=0.05)
+    speculative.add_argument("--llm-latency", type=float, default=0.3)
+    speculative.add_argument("--db-latency", type=float, default=0.1)
+    speculative.set_defaults(func=bench_speculative)
+
+    gateway = sub.add_parser("gateway", help="LLM gateway retries/breaker vs bare client against fake_llm_server")
+    gateway.add_argument("--requests", type=int, default=200)
+    gateway.add_argument("--concurrency", type=int, default=20)
+    gateway.add_argument("--fail-rate", type=float, default=0.2)
+    gateway.add_argument("--fail-status", type=int, default=429)
+    gateway.add_argument("--llm-latency", type=float, default=0.05)
+    gateway.set_defaults(func=bench_gateway)
+
+    retrieval = sub.add_parser("retrieval", help="Supervisor table retrieval: recall@k and prompt size on synthetic uploads")
+    retrieval.add_argument("--noise-tables", type=int, default=300, help="Unrelated tables added to the 60 domain tables")
+    retrieval.add_argument("--k", type=int, nargs="+", default=[3, 5, 8])
+    retrieval.set_defaults(func=bench_retrieval)
+
+    router = sub.add_parser("router", help="Supervisor fast path: share of Gemini routing calls skipped per threshold")
+    router.add_argument("--noise-tables", type=int, default=300)
+    router.add_argument("--thresholds", type=float, nargs="+", default=[0.3, 0.5, 0.7, 0.85, 0.9, 0.95])
+    router.set_defaults(func=bench_router)
+
+    t5 = sub.add_parser("t5-batch", help="Local T5 throughput: per-request generate vs batch scheduler")
+    t5.add_argument("--requests", type=int, default=32)
+    t5.add_argument("--concurrency", type=int, default=8)
+    t5.set_defaults(func=bench_t5_batch)
+
+    backends = sub.add_parser("t5-backends", help="Local T5 latency and memory across torch/int8/onnx backends")
+    backends.add_argument("--backends", nargs="+", default=["torch", "int8", "onnx"])
+    backends.add_argument("--rounds", type=int, default=3)
+    backends.set_defaults(func=bench_t5_backends)
+
+    once = sub.add_parser("t5-backend-once")
+    once.add_argument("--backend", required=True)
+    once.add_argument("--rounds", type=int, default=3)
+    once.set_defaults(func=bench_t5_backend_once)
+
+    ingest = sub.add_parser("ingest", help="Upload ingestion: read_csv + to_sql vs chunked COPY (needs DATABASE_URL)")
+    ingest.add_argument("--rows", type=int, default=500000)
+    ingest.add_argument("--chunk-rows", type=int, default=50000)
+    ingest.set_defaults(func=bench_ingest)
+
+    ingest_types = sub.add_parser("ingest-types", help="Upload ingestion: columns widened when later chunks outgrow the sample's types")
+    ingest_types.add_argument("--chunk-rows", type=int, default=100)
+    ingest_types.set_defaults(func=bench_ingest_types)
+
+    ingest_once = sub.add_parser("ingest-once")
+    ingest_once.add_argument("--strategy", choices=["to_sql", "copy"], required=True)
+    ingest_once.add_argument("--path", required=True)
+    ingest_once.add_argument("--table", required=True)
+    ingest_once.add_argument("--chunk-rows", type=int, default=50000)
+    ingest_once.set_defaults(func=bench_ingest_once)
+
+    startup = sub.add_parser("startup", help="Cold-start import budget for the API (fails if exceeded)")
+    startup.add_argument("--budget", type=float, default=3.0, help="Max seconds for `import main`")
+    startup.add_argument("--runs", type=int, default=3)
+    startup.set_defaults(func=bench_startup)
+
+    args = parser.parse_args()
+    args.func(args)
+
+if __name__ == "__main__":
+    main()
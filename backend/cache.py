@@ -0,0 +1,94 @@
+"""
+Small in-process caches shared by the backend modules.
+Thread-safe so they can be used from request handlers and worker threads alike.
+"""
+import time
+import threading
+from collections import OrderedDict
+
+_MISSING = object()
+
+class LRUCache:
+    """
+    Bounded LRU cache with an optional per-entry TTL.
+    `ttl` of None (or 0) means entries only leave through LRU eviction or invalidation.
+    `on_evict(key, value)` is called (outside the lock) for entries dropped by LRU eviction or expiry.
+    """
+
+    def __init__(self, max_entries=256, ttl=None, on_evict=None):
+        self.max_entries = max_entries
+        self.ttl = ttl or None
+        self.on_evict = on_evict
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def get(self, key, default=None):
+        with self._lock:
+            item = self._data.get(key, _MISSING)
+            if item is _MISSING:
+                self.misses += 1
+                return default
+            value, expires_at = item
+            expired = expires_at is not None and expires_at < time.monotonic()
+            if expired:
+                del self._data[key]
+                self.misses += 1
+            else:
+                self._data.move_to_end(key)
+                self.hits += 1
+        if expired:
+            self._evicted([(key, value)])
+            return default
+        return value
+
+    def set(self, key, value, ttl=None):
+        ttl = ttl or self.ttl
+        expires_at = time.monotonic() + ttl if ttl else None
+        evicted = []
+        with self._lock:
+            self._data[key] = (value, expires_at)
+            self._data.move_to_end(key)
+            while len(self._data) > self.max_entries:
+                old_key, (old_value, _) = self._data.popitem(last=False)
+                evicted.append((old_key, old_value))
+                self.evictions += 1
+        self._evicted(evicted)
+
+    def _evicted(self, items):
+        if self.on_evict is not None:
+            for key, value in items:
+                self.on_evict(key, value)
+
+    def pop(self, key, default=None):
+        with self._lock:
+            item = self._data.pop(key, _MISSING)
+        return default if item is _MISSING else item[0]
+
+    def invalidate_where(self, predicate):
+        """Removes every entry whose key satisfies `predicate`. Returns the number removed."""
+        with self._lock:
+            doomed = [k for k in self._data if predicate(k)]
+            for k in doomed:
+                del self._data[k]
+        return len(doomed)
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+
+    def __len__(self):
+        return len(self._data)
+
+    def stats(self):
+        total = self.hits + self.misses
+        return {
+            "entries": len(self._data),
+            "max_entries": self.max_entries,
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+            "hit_rate": round(self.hits / total, 4) if total else 0.0,
+        }
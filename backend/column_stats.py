@@ -0,0 +1,117 @@
+"""
+Per-column statistics gathered while an upload streams through ingestion:
+null ratio, min/max, distinct count and the most frequent values. Stored in
+DynamicTable.column_stats and rendered next to each column in the schema
+text, so the agents see real categorical values without querying the table.
+"""
+import os
+import json
+import pandas as pd
+
+COLUMN_STATS_TOP_K = int(os.getenv("COLUMN_STATS_TOP_K", "10"))
+# Value counts kept per column while streaming; beyond this, distinct counts become a lower bound
+COLUMN_STATS_MAX_TRACKED = int(os.getenv("COLUMN_STATS_MAX_TRACKED", "5000"))
+# Columns with at most this many distinct values get their full value list in the schema text
+COLUMN_STATS_DICT_MAX_DISTINCT = int(os.getenv("COLUMN_STATS_DICT_MAX_DISTINCT", "25"))
+MAX_VALUE_CHARS = 60
+
+class ColumnStatsAccumulator:
+    """Merges vectorized per-chunk aggregates; memory is bounded by COLUMN_STATS_MAX_TRACKED per column."""
+
+    def __init__(self, top_k=COLUMN_STATS_TOP_K, max_tracked=COLUMN_STATS_MAX_TRACKED):
+        self.top_k = top_k
+        self.max_tracked = max_tracked
+        self.rows = 0
+        self._columns = {}
+
+    def track(self, chunks):
+        """Passes chunks through unchanged while accumulating their stats."""
+        for chunk in chunks:
+            self.add(chunk)
+            yield chunk
+
+    def add(self, chunk):
+        self.rows += len(chunk)
+        for column in chunk.columns:
+            series = chunk[column]
+            acc = self._columns.setdefault(column, {"nulls": 0, "min": None, "max": None, "counts": None,
+                                                    "truncated": False, "frozen": False})
+            acc["nulls"] += int(series.isna().sum())
+            values = series.dropna()
+            if values.empty:
+                continue
+            if pd.api.types.is_numeric_dtype(values) or pd.api.types.is_datetime64_any_dtype(values):
+                lo, hi = values.min(), values.max()
+                acc["min"] = lo if acc["min"] is None else min(acc["min"], lo)
+                acc["max"] = hi if acc["max"] is None else max(acc["max"], hi)
+
+            if acc["frozen"]:
+                continue
+            counts = values.value_counts(sort=False)
+            merged = counts if acc["counts"] is None else acc["counts"].add(counts, fill_value=0)
+            if len(merged) > self.max_tracked:
+                # Keep the heaviest values; rarer ones seen later may be missed, so counts become approximate
+                merged = merged.nlargest(self.max_tracked)
+                acc["truncated"] = True
+                # Even the heaviest values are unique (ids, free text): stop counting, nothing useful to learn
+                acc["frozen"] = merged.iloc[0] <= 1
+            acc["counts"] = merged
+
+    def result(self):
+        """{column: {"null_ratio", "distinct", "distinct_is_lower_bound", "min", "max", "top"}}"""
+        stats = {}
+        for column, acc in self._columns.items():
+            counts = acc["counts"]
+            entry = {
+                "null_ratio": round(acc["nulls"] / self.rows, 4) if self.rows else 0.0,
+                "distinct": int(len(counts)) if counts is not None else 0,
+            }
+            if acc["truncated"]:
+                entry["distinct_is_lower_bound"] = True
+            if acc["min"] is not None:
+                entry["min"], entry["max"] = _plain(acc["min"]), _plain(acc["max"])
+            if counts is not None and not pd.api.types.is_float_dtype(counts.index):
+                # Small dictionaries are kept whole so the schema text can list every value
+                k = len(counts) if len(counts) <= COLUMN_STATS_DICT_MAX_DISTINCT else self.top_k
+                entry["top"] = [[_plain(v), int(n)] for v, n in counts.nlargest(k).items()]
+            stats[column] = entry
+        return stats
+
+def _plain(value):
+    """numpy / pandas scalars -> JSON-friendly Python values."""
+    if isinstance(value, pd.Timestamp):
+        return value.isoformat()
+    if hasattr(value, "item"):
+        value = value.item()
+    if isinstance(value, float):
+        return float(f"{value:.6g}")
+    if isinstance(value, str) and len(value) > MAX_VALUE_CHARS:
+        return value[:MAX_VALUE_CHARS] + "…"
+    return value
+
+def load(raw):
+    try:
+        return json.loads(raw) if raw else {}
+    except ValueError:
+        return {}
+
+def describe(entry):
+    """One-line summary appended to a column in the schema text, e.g. `4 values: 'north', 'south', ...`."""
+    if not entry:
+        return ""
+    parts = []
+    distinct = entry.get("distinct", 0)
+    top = entry.get("top") or []
+    if "min" in entry:
+        parts.append(f"range {entry['min']} .. {entry['max']}")
+    if top and distinct <= COLUMN_STATS_DICT_MAX_DISTINCT and not entry.get("distinct_is_lower_bound"):
+        parts.append(f"{distinct} values: " + ", ".join(repr(v) for v, _ in top))
+        if distinct > len(top):
+            parts[-1] += ", ..."
+    else:
+        parts.append(f"{distinct}{'+' if entry.get('distinct_is_lower_bound') else ''} distinct")
+        if top and "min" not in entry:
+            parts.append("e.g. " + ", ".join(repr(v) for v, _ in top[:3]))
+    if entry.get("null_ratio"):
+        parts.append(f"{entry['null_ratio']:.0%} null")
+    return "; ".join(parts)
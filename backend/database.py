@@ -1,119 +1,591 @@
 import os
+import io
 import re
+import itertools
+import time
+import threading
+import uuid
 import psycopg2
+import psycopg2.errors
+import numpy as np
 import pandas as pd
 import json
-from sqlalchemy import create_engine
+import hashlib
+from datetime import datetime
+from urllib.parse import urlsplit, urlunsplit, parse_qsl, urlencode
+from sqlalchemy import create_engine, event, func
+from sqlalchemy.exc import OperationalError
 from sqlalchemy.orm import sessionmaker
+from sqlalchemy.pool import QueuePool
 from dotenv import load_dotenv
-from models import DynamicTable, Base
+from models import DynamicTable, ScratchTable, Base
+from cache import LRUCache
+import query_cache
+import index_advisor
+import column_stats
+import sql_analyzer
 
 load_dotenv()
 
+# ============================================================================
+# CONNECTION POOL (one engine per process, shared by ORM and raw cursors)
+# ============================================================================
+DB_POOL_SIZE = int(os.getenv("DB_POOL_SIZE", "5"))
+DB_MAX_OVERFLOW = int(os.getenv("DB_MAX_OVERFLOW", "10"))
+DB_POOL_TIMEOUT = float(os.getenv("DB_POOL_TIMEOUT", "30"))
+DB_POOL_RECYCLE = int(os.getenv("DB_POOL_RECYCLE", "1800"))
+DB_POOL_PRE_PING = os.getenv("DB_POOL_PRE_PING", "true").lower() == "true"
+
+_engine = None
+_session_factory = None
+_engine_lock = threading.Lock()
+
+_pool_stats_lock = threading.Lock()
+_pool_stats = {
+    "checkouts": 0,
+    "checkout_errors": 0,
+    "wait_seconds_total": 0.0,
+    "wait_seconds_max": 0.0,
+    "connections_opened": 0,
+}
+
+class InstrumentedQueuePool(QueuePool):
+    """QueuePool that records how long callers wait for a connection."""
+
+    def _do_get(self):
+        start = time.perf_counter()
+        try:
+            conn = super()._do_get()
+        except Exception:
+            with _pool_stats_lock:
+                _pool_stats["checkout_errors"] += 1
+            raise
+        waited = time.perf_counter() - start
+        with _pool_stats_lock:
+            _pool_stats["checkouts"] += 1
+            _pool_stats["wait_seconds_total"] += waited
+            _pool_stats["wait_seconds_max"] = max(_pool_stats["wait_seconds_max"], waited)
+        return conn
+
+def get_database_url():
+    """
+    Returns DATABASE_URL without the `pgbouncer` query param.
+    psycopg2 rejects unknown URI params, but everything else (sslmode etc.) is kept.
+    The driver is pinned to psycopg2: raw connections rely on its cursor API (copy_expert, named cursors).
+    """
+    url = os.getenv("DATABASE_URL")
+    if not url:
+        return url
+    parts = urlsplit(url)
+    params = [(k, v) for k, v in parse_qsl(parts.query, keep_blank_values=True) if k != "pgbouncer"]
+    scheme = "postgresql+psycopg2" if parts.scheme in ("postgres", "postgresql") else parts.scheme
+    return urlunsplit(parts._replace(scheme=scheme, query=urlencode(params)))
+
+def is_pgbouncer():
+    url = os.getenv("DATABASE_URL") or ""
+    return "pgbouncer=true" in url
+
+def get_sqlalchemy_engine():
+    """Returns the process-wide engine, creating it on first use."""
+    global _engine, _session_factory
+    if _engine is None:
+        with _engine_lock:
+            if _engine is None:
+                engine = create_engine(
+                    get_database_url(),
+                    poolclass=InstrumentedQueuePool,
+                    pool_size=DB_POOL_SIZE,
+                    max_overflow=DB_MAX_OVERFLOW,
+                    pool_timeout=DB_POOL_TIMEOUT,
+                    pool_recycle=DB_POOL_RECYCLE,
+                    pool_pre_ping=DB_POOL_PRE_PING,
+                    # LIFO keeps the hot connections busy so idle ones can be recycled by pgbouncer/Postgres
+                    pool_use_lifo=True,
+                )
+                event.listen(engine, "connect", _on_connect)
+                _session_factory = sessionmaker(autocommit=False, autoflush=False, bind=engine)
+                _engine = engine
+    return _engine
+
+def _on_connect(dbapi_conn, connection_record):
+    with _pool_stats_lock:
+        _pool_stats["connections_opened"] += 1
+
 def get_db_session():
-    engine = get_sqlalchemy_engine()
-    SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
-    return SessionLocal()
+    get_sqlalchemy_engine()
+    return _session_factory()
 
 def get_db_connection():
+    """
+    Checks out a raw psycopg2 connection from the shared pool.
+    Calling .close() on it returns it to the pool (uncommitted work is rolled back).
+    """
     try:
-        url = os.getenv("DATABASE_URL")
-        # psycopg2 doesn't always support the pgbouncer=true query param in the URI
-        if url and "pgbouncer=true" in url:
-            url = url.replace("?pgbouncer=true", "")
-        conn = psycopg2.connect(url)
-        return conn
+        return get_sqlalchemy_engine().raw_connection()
     except Exception as e:
         print(f"Error connecting to database: {e}")
         return None
 
-def get_sqlalchemy_engine():
-    url = os.getenv("DATABASE_URL")
-    if url and "pgbouncer=true" in url:
-        url = url.replace("?pgbouncer=true", "")
-    return create_engine(url)
+def get_pool_stats():
+    """Snapshot of pool occupancy and checkout wait times, for sizing under load."""
+    with _pool_stats_lock:
+        stats = dict(_pool_stats)
+    stats["avg_wait_ms"] = (stats["wait_seconds_total"] / stats["checkouts"] * 1000) if stats["checkouts"] else 0.0
+    stats["max_wait_ms"] = stats.pop("wait_seconds_max") * 1000
+    stats["wait_seconds_total"] = round(stats["wait_seconds_total"], 6)
+    stats.update({
+        "pool_size": DB_POOL_SIZE,
+        "max_overflow": DB_MAX_OVERFLOW,
+        "pgbouncer": is_pgbouncer(),
+    })
+    if _engine is not None:
+        pool = _engine.pool
+        stats.update({
+            "checked_out": pool.checkedout(),
+            "idle": pool.checkedin(),
+            "overflow": pool.overflow(),
+        })
+    return stats
 
-def ingest_dataframe(df, table_name, user_id, original_filename=None):
+# ============================================================================
+# STREAMING INGESTION (chunked parse + COPY FROM STDIN)
+# ============================================================================
+INGEST_CHUNK_ROWS = int(os.getenv("INGEST_CHUNK_ROWS", "50000"))
+
+def quote_ident(name):
+    """Quotes a Postgres identifier (table/column names come straight from user files)."""
+    return '"' + str(name).replace('"', '""') + '"'
+
+class IngestCancelled(Exception):
+    """Raised between chunks when an ingestion job was cancelled; the load is rolled back."""
+
+def iter_file_chunks(path, filename, chunk_rows=INGEST_CHUNK_ROWS, on_bytes=None):
     """
-    Ingests a pandas DataFrame into Supabase and records metadata.
+    Yields DataFrames of at most `chunk_rows` rows from a CSV/Excel file on disk,
+    so peak memory depends on the chunk size rather than the file size.
+    `on_bytes(n)` is called with the number of bytes parsed so far (CSV only reports it per chunk).
     """
-    engine = get_sqlalchemy_engine()
-    session = get_db_session()
-    try:
-        # 1. Upload the raw data
-        df.to_sql(table_name, engine, if_exists='replace', index=False)
-        
-        # 2. Record/Update metadata in dynamic_tables
-        columns_info = json.dumps(df.dtypes.apply(lambda x: str(x)).to_dict())
-        row_count = len(df)
-        
-        existing = session.query(DynamicTable).filter(DynamicTable.table_name == table_name).first()
-        if existing:
-            existing.user_id = user_id
-            existing.original_filename = original_filename or existing.original_filename
-            existing.columns_info = columns_info
-            existing.row_count = row_count
+    lower = filename.lower()
+    if lower.endswith('.csv'):
+        with open(path, 'rb') as f:
+            for chunk in pd.read_csv(f, chunksize=chunk_rows):
+                if on_bytes:
+                    on_bytes(f.tell())
+                yield chunk
+    elif lower.endswith('.xlsx'):
+        from openpyxl import load_workbook
+        workbook = load_workbook(path, read_only=True, data_only=True)
+        try:
+            rows = workbook.active.iter_rows(values_only=True)
+            header = next(rows, None)
+            if header is None:
+                return
+            columns = [str(c) if c is not None else f"Unnamed: {i}" for i, c in enumerate(header)]
+            batch = []
+            for row in rows:
+                batch.append(row)
+                if len(batch) >= chunk_rows:
+                    yield pd.DataFrame.from_records(batch, columns=columns)
+                    batch = []
+            if batch:
+                yield pd.DataFrame.from_records(batch, columns=columns)
+        finally:
+            workbook.close()
+        if on_bytes:
+            on_bytes(os.path.getsize(path))
+    elif lower.endswith('.xls'):
+        # Legacy binary Excel cannot be read incrementally
+        df = pd.read_excel(path)
+        if on_bytes:
+            on_bytes(os.path.getsize(path))
+        yield df
+    else:
+        raise ValueError("Invalid file type")
+
+# What pandas infers for a column of strings ("object", or "str" on pandas 3)
+_TEXT_DTYPE = pd.Series([""]).dtype
+
+def _conform_chunk(chunk, sample_dtypes):
+    """
+    Keeps later chunks COPY-compatible with the column types inferred from the first one.
+    Returns the chunk and {column: SQL type} for columns that must be widened before the COPY
+    (e.g. all-NaN floats in the sample but strings later); `sample_dtypes` is updated to match.
+    """
+    widen = {}
+    for col, dtype in sample_dtypes.items():
+        values = chunk[col]
+        if pd.api.types.is_string_dtype(dtype) or values.isna().all():
+            continue
+        if pd.api.types.is_integer_dtype(dtype) and pd.api.types.is_float_dtype(values.dtype):
+            try:
+                # NaNs turn ints into floats ("3.0"), which a BIGINT column rejects
+                chunk[col] = values.astype("Int64")
+                continue
+            except (TypeError, ValueError):
+                pass
+        elif _fits(values, dtype):
+            continue
+        if pd.api.types.is_integer_dtype(dtype) and _is_number(values):
+            widen[col], sample_dtypes[col] = "DOUBLE PRECISION", values.dtype
         else:
-            new_meta = DynamicTable(
-                user_id=user_id,
-                table_name=table_name,
-                original_filename=original_filename,
-                columns_info=columns_info,
-                row_count=row_count
+            widen[col], sample_dtypes[col] = "TEXT", _TEXT_DTYPE
+    return chunk, widen
+
+def _is_number(values):
+    return pd.api.types.is_numeric_dtype(values.dtype) and not pd.api.types.is_bool_dtype(values.dtype)
+
+def _fits(values, dtype):
+    """Whether a chunk's values COPY into the column created for the sample's `dtype`."""
+    if pd.api.types.is_bool_dtype(dtype):
+        return values.dropna().map(lambda v: isinstance(v, (bool, np.bool_))).all()
+    if pd.api.types.is_numeric_dtype(dtype):
+        return _is_number(values)
+    if pd.api.types.is_datetime64_any_dtype(dtype):
+        return pd.api.types.is_datetime64_any_dtype(values.dtype)
+    return True
+
+def _copy_chunk(cur, table_name, chunk):
+    buf = io.StringIO()
+    chunk.to_csv(buf, index=False, header=False)
+    buf.seek(0)
+    columns = ", ".join(quote_ident(c) for c in chunk.columns)
+    cur.copy_expert(f"COPY {quote_ident(table_name)} ({columns}) FROM STDIN WITH (FORMAT csv)", buf)
+    return len(chunk)
+
+def bulk_load_chunks(chunks, table_name, on_rows=None, cancel_event=None):
+    """
+    Creates `table_name` from the first chunk's inferred schema (replacing any existing table)
+    and bulk-loads every chunk with COPY, widening columns later chunks do not fit.
+    Returns (row_count, column dtypes, widened where needed).
+    `on_rows(n)` reports rows loaded so far; setting `cancel_event` aborts and rolls back.
+    """
+    chunks = iter(chunks)
+    sample = next(chunks, None)
+    if sample is None:
+        raise ValueError("The uploaded file contains no header or rows.")
+    sample_dtypes = sample.dtypes.to_dict()
+    create_sql = pd.io.sql.get_schema(sample, table_name, con=get_sqlalchemy_engine())
+
+    conn = get_db_connection()
+    if not conn:
+        raise ConnectionError("Database connection failed.")
+    try:
+        row_count = 0
+        with conn.cursor() as cur:
+            cur.execute(f"DROP TABLE IF EXISTS {quote_ident(table_name)}")
+            cur.execute(create_sql)
+            for chunk in itertools.chain([sample], chunks):
+                if cancel_event is not None and cancel_event.is_set():
+                    raise IngestCancelled(f"Ingestion of '{table_name}' was cancelled.")
+                chunk, widen = _conform_chunk(chunk, sample_dtypes)
+                for col, sql_type in widen.items():
+                    print(f"⚠️ Column '{col}' of '{table_name}' does not fit the type inferred from the first "
+                          f"{INGEST_CHUNK_ROWS} rows; widening it to {sql_type}.")
+                    cur.execute(f"ALTER TABLE {quote_ident(table_name)} ALTER COLUMN {quote_ident(col)} "
+                                f"TYPE {sql_type} USING {quote_ident(col)}::{sql_type}")
+                row_count += _copy_chunk(cur, table_name, chunk)
+                if on_rows:
+                    on_rows(row_count)
+        conn.commit()
+        return row_count, sample_dtypes
+    except Exception:
+        conn.rollback()
+        raise
+    finally:
+        conn.close()
+
+# Re-uploads load into a staging table and are swapped in by rename, so readers
+# only ever wait for the (brief) rename, never for the load itself.
+INGEST_SWAP_LOCK_TIMEOUT_MS = int(os.getenv("INGEST_SWAP_LOCK_TIMEOUT_MS", "2000"))
+# How long to keep retrying the rename before giving up on the load; 0 waits out the longest
+# statement_timeout a reader of the live table can have (queries, per-user overrides, exports)
+INGEST_SWAP_MAX_WAIT_MS = int(os.getenv("INGEST_SWAP_MAX_WAIT_MS", "0"))
+# Staging tables older than this belong to loads whose worker died; the sweep drops them
+INGEST_STAGING_MAX_AGE_SECONDS = float(os.getenv("INGEST_STAGING_MAX_AGE_SECONDS", "86400"))
+
+def _scratch_table_name(kind):
+    # Fixed length keeps it under Postgres' 63-byte identifier limit whatever the user's table is called
+    return f"_{kind}_{uuid.uuid4().hex}"
+
+def _register_scratch_table(session, name, kind):
+    """Records a staging/retired table in scratch_tables (committed by the caller)."""
+    session.add(ScratchTable(name=name, kind=kind, created_at=datetime.utcnow()))
+
+def _drop_tables(names):
+    """Drops scratch tables and their registry rows."""
+    conn = get_db_connection()
+    if not conn:
+        return
+    try:
+        with conn.cursor() as cur:
+            for name in names:
+                try:
+                    cur.execute(f"DROP TABLE IF EXISTS {quote_ident(name)}")
+                    cur.execute("DELETE FROM scratch_tables WHERE name = %s", (name,))
+                    conn.commit()
+                except Exception as e:
+                    conn.rollback()
+                    print(f"⚠️ Could not drop table {name}: {e}")
+    finally:
+        conn.close()
+
+def _sweep_scratch_tables():
+    """
+    Drops every registered retired table, and staging tables older than INGEST_STAGING_MAX_AGE_SECONDS
+    (left behind if a worker died mid-load). Only tables listed in scratch_tables are ever touched.
+    """
+    conn = get_db_connection()
+    if not conn:
+        return
+    try:
+        with conn.cursor() as cur:
+            cur.execute(
+                "SELECT name FROM scratch_tables WHERE kind = 'retired' "
+                "OR (kind = 'staging' AND created_at < (now() AT TIME ZONE 'utc') - %s * interval '1 second')",
+                (INGEST_STAGING_MAX_AGE_SECONDS,)
             )
-            session.add(new_meta)
-        
+            names = [row[0] for row in cur.fetchall()]
+        conn.rollback()
+    finally:
+        conn.close()
+    _drop_tables(names)
+
+def _sweep_scratch_in_background():
+    """Retired tables may still be read by queries that started before the swap; drop them off the request path."""
+    threading.Thread(target=_sweep_scratch_tables, name="sweep-scratch-tables", daemon=True).start()
+
+def _swap_max_wait_seconds():
+    if INGEST_SWAP_MAX_WAIT_MS > 0:
+        return INGEST_SWAP_MAX_WAIT_MS / 1000
+    longest = max([QUERY_STATEMENT_TIMEOUT_MS, EXPORT_STATEMENT_TIMEOUT_MS, *QUERY_STATEMENT_TIMEOUT_OVERRIDES.values()])
+    return (longest + INGEST_SWAP_LOCK_TIMEOUT_MS) / 1000
+
+def _swap_in(session, staging_name, table_name, user_id, original_filename, **metadata):
+    """
+    In one transaction: renames the live table away, renames staging into its place and
+    updates its dynamic_tables row with `metadata` (columns_info, row_count, ...).
+    Returns (previous_owner, retired_table_name or None).
+    """
+    conn = session.connection()
+    conn.exec_driver_sql(f"SET LOCAL lock_timeout = {INGEST_SWAP_LOCK_TIMEOUT_MS}")
+    retired_name = None
+    if conn.exec_driver_sql("SELECT to_regclass(%s)", (quote_ident(table_name),)).scalar() is not None:
+        retired_name = _scratch_table_name("retired")
+        conn.exec_driver_sql(f"ALTER TABLE {quote_ident(table_name)} RENAME TO {quote_ident(retired_name)}")
+        _register_scratch_table(session, retired_name, "retired")
+    conn.exec_driver_sql(f"ALTER TABLE {quote_ident(staging_name)} RENAME TO {quote_ident(table_name)}")
+    # Staging is live now: take it off the registry in the same transaction as the rename
+    session.query(ScratchTable).filter(ScratchTable.name == staging_name).delete()
+
+    existing = session.query(DynamicTable).filter(DynamicTable.table_name == table_name).with_for_update().first()
+    previous_owner = existing.user_id if existing else None
+    if existing:
+        existing.user_id = user_id
+        existing.schema_version = (existing.schema_version or 0) + 1
+        existing.original_filename = original_filename or existing.original_filename
+        for field, value in metadata.items():
+            setattr(existing, field, value)
+    else:
+        new_meta = DynamicTable(
+            user_id=user_id,
+            table_name=table_name,
+            original_filename=original_filename,
+            schema_version=1,
+            **metadata
+        )
+        session.add(new_meta)
+    session.commit()
+    return previous_owner, retired_name
+
+def ingest_chunks(chunks, table_name, user_id, original_filename=None, on_rows=None, cancel_event=None):
+    """
+    Ingests an iterable of DataFrame chunks into Supabase and records metadata.
+    """
+    staging_name = _scratch_table_name("staging")
+    session = get_db_session()
+    try:
+        # Registered before it exists, so a crash at any point leaves something the sweep can find
+        _register_scratch_table(session, staging_name, "staging")
         session.commit()
+        # 1. Upload the raw data into a staging table (the live table stays readable meanwhile),
+        #    profiling each chunk on the way through
+        stats = column_stats.ColumnStatsAccumulator()
+        row_count, sample_dtypes = bulk_load_chunks(stats.track(chunks), staging_name, on_rows, cancel_event)
+
+        # 2. ANALYZE and index it while nobody can see it, keeping indexes learned on the previous version
+        previous = session.query(DynamicTable.index_info).filter(DynamicTable.table_name == table_name).scalar()
+        session.rollback()
+        carry = index_advisor.learned_columns(index_advisor.load_index_info(previous))
+        index_info = json.dumps(index_advisor.prepare_table(staging_name, row_count, carry))
+
+        # 3. Swap it in and record/update metadata in dynamic_tables, atomically
+        columns_info = json.dumps({col: str(dtype) for col, dtype in sample_dtypes.items()})
+        stats_json = json.dumps(stats.result(), default=str)
+        # Each attempt waits only INGEST_SWAP_LOCK_TIMEOUT_MS, so readers queued behind the rename
+        # are not held up for long; the loaded table is kept until a reader lets go
+        deadline = time.monotonic() + _swap_max_wait_seconds()
+        attempt = 0
+        while True:
+            attempt += 1
+            try:
+                previous_owner, _ = _swap_in(
+                    session, staging_name, table_name, user_id, original_filename,
+                    columns_info=columns_info, row_count=row_count, index_info=index_info,
+                    column_stats=stats_json
+                )
+                break
+            except OperationalError as e:
+                session.rollback()
+                if not isinstance(e.orig, psycopg2.errors.LockNotAvailable) or time.monotonic() >= deadline:
+                    raise
+                if cancel_event is not None and cancel_event.is_set():
+                    raise IngestCancelled(f"Ingestion of '{table_name}' was cancelled.")
+                print(f"⏳ '{table_name}' is busy; retrying swap (attempt {attempt})...")
+                time.sleep(min(0.2 * attempt, 1.0))
+
+        _sweep_scratch_in_background()
+        index_advisor.reset_usage(table_name)
+        invalidate_schema_cache(user_id)
+        query_cache.invalidate_user(user_id)
+        if previous_owner is not None and previous_owner != user_id:
+            invalidate_schema_cache(previous_owner)
+            query_cache.invalidate_user(previous_owner)
         return True, f"Table '{table_name}' ingested and mapped to NLP2SQL knowledge base."
     except Exception as e:
         session.rollback()
+        _drop_tables([staging_name])
         return False, str(e)
     finally:
         session.close()
 
-def fetch_db_schema(user_id=None):
+def ingest_file(path, table_name, user_id, original_filename=None, on_bytes=None, on_rows=None, cancel_event=None):
+    """Streams a CSV/Excel file from disk into `table_name` chunk by chunk."""
+    chunks = iter_file_chunks(path, original_filename or path, on_bytes=on_bytes)
+    return ingest_chunks(chunks, table_name, user_id, original_filename, on_rows, cancel_event)
+
+def ingest_dataframe(df, table_name, user_id, original_filename=None):
     """
-    Fetches the database schema filtered by user ownership.
+    Ingests a pandas DataFrame into Supabase and records metadata.
     """
-    conn = get_db_connection()
-    if not conn:
-        return "Could not connect to database."
-    
-    # Only get tables that are either in DynamicTable for this user OR standard public symbols
-    # However, for NL2SQL on user data, we primarily care about their dynamic tables.
-    session = get_db_session()
-    try:
-        user_tables = session.query(DynamicTable.table_name).filter(DynamicTable.user_id == user_id).all()
-        user_table_list = [t[0] for t in user_tables]
-        
-        if not user_table_list:
-            return "No user-uploaded tables found. Please upload data to begin."
+    return ingest_chunks([df], table_name, user_id, original_filename)
+
+# ============================================================================
+# SCHEMA CACHE (per user, invalidated on upload)
+# ============================================================================
+SCHEMA_CACHE_TTL = float(os.getenv("SCHEMA_CACHE_TTL", "300"))
+SCHEMA_CACHE_MAX_USERS = int(os.getenv("SCHEMA_CACHE_MAX_USERS", "1024"))
+# Append null ratio, range and the common values of each column (from upload-time stats) to the schema text
+SCHEMA_INCLUDE_COLUMN_STATS = os.getenv("SCHEMA_INCLUDE_COLUMN_STATS", "true").lower() == "true"
+# When several uvicorn workers run, each has its own cache. Checking the per-user
+# version counter in dynamic_tables lets a worker notice uploads handled by another one.
+SCHEMA_CACHE_CROSS_WORKER = os.getenv("SCHEMA_CACHE_CROSS_WORKER", "false").lower() == "true"
+
+_schema_cache = LRUCache(max_entries=SCHEMA_CACHE_MAX_USERS, ttl=SCHEMA_CACHE_TTL)
 
+def _schema_version_token(session, user_id):
+    """Cheap fingerprint of a user's uploads: (table count, sum of per-table schema versions)."""
+    count, total = session.query(
+        func.count(DynamicTable.id),
+        func.coalesce(func.sum(DynamicTable.schema_version), 0)
+    ).filter(DynamicTable.user_id == user_id).one()
+    return (int(count), int(total))
+
+def _load_schema_catalog(session, user_id):
+    user_tables = session.query(
+        DynamicTable.table_name, DynamicTable.schema_version, DynamicTable.column_stats
+    ).filter(DynamicTable.user_id == user_id).all()
+    user_table_list = [t[0] for t in user_tables]
+    versions = sorted((name, version or 0) for name, version, _ in user_tables)
+    stats = {name: column_stats.load(raw) for name, _, raw in user_tables} if SCHEMA_INCLUDE_COLUMN_STATS else {}
+
+    tables = {name: [] for name in sorted(user_table_list)}
+    if user_table_list:
         # Filter information_schema by these specific tables
         placeholders = ', '.join(["%s"] * len(user_table_list))
         query = f"""
         SELECT table_name, column_name, data_type 
         FROM information_schema.columns 
         WHERE table_schema = 'public' AND table_name IN ({placeholders})
-        ORDER BY table_name;
+        ORDER BY table_name, ordinal_position;
         """
-        
-        with conn.cursor() as cur:
-            cur.execute(query, user_table_list)
-            rows = cur.fetchall()
+        conn = get_db_connection()
+        if not conn:
+            return None
+        try:
+            with conn.cursor() as cur:
+                cur.execute(query, user_table_list)
+                for table, col, dtype in cur.fetchall():
+                    tables.setdefault(table, []).append((col, dtype))
+        finally:
+            conn.close()
+
+    text = render_schema(tables, stats=stats)
+    # Changes whenever a column changes or any table is re-uploaded; used as a cache key downstream
+    fingerprint = hashlib.sha1((text + json.dumps(versions)).encode("utf-8")).hexdigest()
+    return {"tables": tables, "stats": stats, "text": text, "fingerprint": fingerprint}
+
+def render_schema(tables, names=None, header="Your Knowledge Base (Uploaded Tables):", stats=None):
+    """
+    Renders {table: [(column, type), ...]} as the schema text the agents expect.
+    `stats` ({table: {column: column_stats entry}}) adds a one-line value summary per column.
+    """
+    stats = stats or {}
+    if not tables:
+        return "No user-uploaded tables found. Please upload data to begin."
+    parts = [header + "\n"]
+    for table in (names if names is not None else tables):
+        if table not in tables:
+            continue
+        parts.append(f"\nTable: {table}\n")
+        table_stats = stats.get(table, {})
+        for col, dtype in tables[table]:
+            summary = column_stats.describe(table_stats.get(col))
+            parts.append(f" - {col} ({dtype}) [{summary}]\n" if summary else f" - {col} ({dtype})\n")
+    return "".join(parts)
+
+def get_schema_catalog(user_id):
+    """
+    Returns the cached schema snapshot for a user:
+    {"tables": {table: [(column, type), ...]}, "text": <rendered schema>, "fingerprint": ..., "version": ...}
+    Returns None if the database is unreachable.
+    """
+    cached = _schema_cache.get(user_id)
+    if cached is not None and not SCHEMA_CACHE_CROSS_WORKER:
+        return cached
+
+    session = get_db_session()
+    try:
+        version = _schema_version_token(session, user_id) if SCHEMA_CACHE_CROSS_WORKER else None
+        if cached is not None and cached["version"] == version:
+            return cached
+        catalog = _load_schema_catalog(session, user_id)
     finally:
         session.close()
-        conn.close()
-    
-    schema_text = "Your Knowledge Base (Uploaded Tables):\n"
-    current_table = ""
-    for table, col, dtype in rows:
-        if table != current_table:
-            schema_text += f"\nTable: {table}\n"
-            current_table = table
-        schema_text += f" - {col} ({dtype})\n"
-    
-    return schema_text
+
+    if catalog is None:
+        return None
+    catalog["version"] = version
+    _schema_cache.set(user_id, catalog)
+    return catalog
+
+def invalidate_schema_cache(user_id=None):
+    """Drops the cached schema for one user (or everyone)."""
+    if user_id is None:
+        _schema_cache.clear()
+    else:
+        _schema_cache.pop(user_id)
+
+def get_schema_cache_stats():
+    return _schema_cache.stats()
+
+def fetch_db_schema(user_id=None):
+    """
+    Fetches the database schema filtered by user ownership.
+    """
+    catalog = get_schema_catalog(user_id)
+    if catalog is None:
+        return "Could not connect to database."
+    return catalog["text"]
 
 def get_table_profile(table_name):
     """Returns the first 3 rows of a table as a dictionary string for semantic understanding."""
@@ -132,52 +604,314 @@ def get_table_profile(table_name):
     finally:
         conn.close()
 
-def execute_query(sql_query, user_id=None):
+def _observe_for_indexing(sql_query, user_id, used_tables):
+    """Feeds a successful query to the index advisor (columns come from the cached schema catalog)."""
+    try:
+        catalog = get_schema_catalog(user_id)
+        if not catalog:
+            return
+        used = {t.lower() for t in used_tables}
+        tables = {t: [c for c, _ in cols] for t, cols in catalog["tables"].items() if t.lower() in used}
+        if tables:
+            index_advisor.observe(sql_query, tables)
+    except Exception as e:
+        print(f"⚠️ Index advisor could not observe query: {e}")
+
+# ============================================================================
+# QUERY EXECUTION (server-side cursors, row cap)
+# ============================================================================
+# Rows returned per result set; anything beyond stays in Postgres
+QUERY_ROW_CAP = int(os.getenv("QUERY_ROW_CAP", "1000"))
+QUERY_FETCH_BATCH = int(os.getenv("QUERY_FETCH_BATCH", "500"))
+# Count the rows past the cap (MOVE FORWARD ALL) so truncated results report a total.
+# Costs a full scan of the result on the server, but no memory in the API.
+QUERY_COUNT_TRUNCATED = os.getenv("QUERY_COUNT_TRUNCATED", "true").lower() == "true"
+# The count gets its own, shorter statement_timeout; when it runs out the fetched rows are still returned
+QUERY_COUNT_TIMEOUT_MS = int(os.getenv("QUERY_COUNT_TIMEOUT_MS", "2000"))
+
+# Guard rails for generated SQL: read-only transaction, statement_timeout, and an EXPLAIN cost ceiling
+QUERY_STATEMENT_TIMEOUT_MS = int(os.getenv("QUERY_STATEMENT_TIMEOUT_MS", "30000"))
+# Per-user overrides, e.g. "12:120000,40:5000" (user_id:milliseconds)
+QUERY_STATEMENT_TIMEOUT_OVERRIDES = {
+    int(user): int(ms)
+    for user, ms in (item.split(":") for item in os.getenv("QUERY_STATEMENT_TIMEOUT_OVERRIDES", "").split(",") if ":" in item)
+}
+# Planner cost units; 0 disables the EXPLAIN guard
+QUERY_MAX_COST = float(os.getenv("QUERY_MAX_COST", "10000000"))
+EXPORT_STATEMENT_TIMEOUT_MS = int(os.getenv("EXPORT_STATEMENT_TIMEOUT_MS", "300000"))
+
+class QueryTooExpensive(Exception):
+    def __init__(self, rejection):
+        super().__init__(rejection)
+        self.rejection = rejection
+
+class CostGuardRejection(str):
+    """An execute_query error message (a plain str for existing callers) that also carries the EXPLAIN report."""
+
+    def __new__(cls, message, report):
+        obj = super().__new__(cls, message)
+        obj.report = report
+        return obj
+
+QUERY_CANCELLED = "Query cancelled."
+
+class QueryCancel:
+    """Lets another thread stop an execute_query call: psycopg2's connection.cancel() on whatever it is running."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._conn = None
+        self.cancelled = False
+
+    def cancel(self):
+        with self._lock:
+            self.cancelled = True
+            if self._conn is not None:
+                self._conn.cancel()
+
+    def _attach(self, conn):
+        """Returns False if cancel() already ran."""
+        with self._lock:
+            self._conn = conn
+            return not self.cancelled
+
+    def _detach(self):
+        # Before the connection goes back to the pool, so a late cancel() cannot reach another request
+        with self._lock:
+            self._conn = None
+
+def statement_timeout_ms(user_id):
+    return QUERY_STATEMENT_TIMEOUT_OVERRIDES.get(user_id, QUERY_STATEMENT_TIMEOUT_MS)
+
+def begin_read_only(cur, timeout_ms):
+    """Opens the transaction as READ ONLY with a statement_timeout that ends with it."""
+    cur.execute("SET TRANSACTION READ ONLY")
+    cur.execute(f"SET LOCAL statement_timeout = {int(timeout_ms)}")
+
+def _plan_hotspots(plan, found=None):
+    """Flattens a JSON plan into the costliest nodes, flagging joins with no join condition."""
+    found = [] if found is None else found
+    node = plan["Node Type"]
+    target = plan.get("Relation Name") or plan.get("Alias")
+    entry = {
+        "node": f"{node} on {target}" if target else node,
+        "total_cost": plan.get("Total Cost"),
+        "rows": int(plan.get("Plan Rows") or 0),
+    }
+    if node == "Nested Loop" and not plan.get("Join Filter") and not any(
+            "Index Cond" in child or "Filter" in child for child in plan.get("Plans", [])):
+        entry["warning"] = "join without a join condition (cartesian product)"
+    found.append(entry)
+    for child in plan.get("Plans", []):
+        _plan_hotspots(child, found)
+    return found
+
+def explain_statement(cur, statement, row_cap):
     """
-    Executes the generated SQL query and returns the results.
-    Supports multiple statements.
-    Returns: List of {"rows": [], "columns": []} or (None, error_msg)
+    EXPLAINs (without ANALYZE) a row-returning statement. Because results are read through a
+    cursor and capped at `row_cap`, a pipelined plan only pays for the rows actually fetched,
+    so the estimate that matters is startup + the fetched fraction of the run cost.
+    """
+    cur.execute(f"EXPLAIN (FORMAT JSON) {statement}")
+    plan = cur.fetchone()[0][0]["Plan"]
+    startup, total = plan["Startup Cost"], plan["Total Cost"]
+    rows = plan["Plan Rows"]
+    fraction = min(1.0, (row_cap + 1) / max(rows, 1))
+    hotspots = sorted(_plan_hotspots(plan), key=lambda n: n["total_cost"] or 0, reverse=True)
+    return {
+        "estimated_cost": round(startup + (total - startup) * fraction, 2),
+        "estimated_full_cost": total,
+        "estimated_rows": int(rows),
+        "max_cost": QUERY_MAX_COST,
+        "hotspots": [n for n in hotspots if "warning" in n] + [n for n in hotspots if "warning" not in n][:4],
+    }
+
+def _cost_rejection(statement, report):
+    warnings = [n["warning"] for n in report["hotspots"] if "warning" in n]
+    message = (f"Cost Guard: query rejected before execution. Estimated cost {report['estimated_cost']:,.0f} "
+               f"exceeds the limit of {report['max_cost']:,.0f} (about {report['estimated_rows']:,} rows).")
+    if warnings:
+        message += " Plan contains a " + "; ".join(sorted(set(warnings))) + "."
+    return CostGuardRejection(message, {**report, "statement": statement})
+
+# Statements that can be declared as a server-side cursor
+_ROW_RETURNING = re.compile(r"^(\s|--[^\n]*\n|/\*.*?\*/|\()*(SELECT|WITH|VALUES|TABLE)\b", re.IGNORECASE | re.DOTALL)
+
+def _fetch_capped(cur, row_cap):
+    rows = []
+    while len(rows) < row_cap:
+        batch = cur.fetchmany(min(QUERY_FETCH_BATCH, row_cap - len(rows)))
+        if not batch:
+            break
+        rows.extend(batch)
+    truncated = len(rows) >= row_cap and cur.fetchone() is not None
+    return rows, truncated
+
+def _run_statement(conn, statement, row_cap):
+    """
+    Runs one (read-only, see check_read_only) statement and returns {"columns", "rows",
+    "truncated", "total_count"}. It goes through a named (server-side) cursor so only
+    `row_cap` rows ever reach the API process. Raises QueryTooExpensive if EXPLAIN puts
+    the statement over QUERY_MAX_COST.
+    """
+    count_rest = QUERY_COUNT_TRUNCATED
+    if QUERY_MAX_COST > 0:
+        with conn.cursor() as cur:
+            report = explain_statement(cur, statement, row_cap)
+        if report["estimated_cost"] > QUERY_MAX_COST:
+            raise QueryTooExpensive(_cost_rejection(statement, report))
+        # Affordable when capped, but counting every row would run it in full
+        count_rest = count_rest and report["estimated_full_cost"] <= QUERY_MAX_COST
+    name = f"q_{uuid.uuid4().hex}"
+    with conn.cursor(name=name) as cur:
+        cur.itersize = QUERY_FETCH_BATCH
+        cur.execute(statement)
+        rows, truncated = _fetch_capped(cur, row_cap)
+        columns = [desc[0] for desc in cur.description]
+        total_count = len(rows)
+        if truncated:
+            total_count = None
+            if count_rest:
+                total_count = _count_rest(conn, name, len(rows) + 1)  # +1 for the row fetched to detect truncation
+    return {"columns": columns, "rows": rows, "truncated": truncated, "total_count": total_count}
+
+def _count_rest(conn, cursor_name, fetched):
+    """
+    Counts the rows left in the cursor inside a savepoint with QUERY_COUNT_TIMEOUT_MS, so a
+    slow count costs only itself. Returns the total, or None when the count timed out.
+    """
+    with conn.cursor() as counter:
+        counter.execute("SAVEPOINT count_rest")
+        counter.execute(f"SET LOCAL statement_timeout = {int(QUERY_COUNT_TIMEOUT_MS)}")
+        try:
+            counter.execute(f"MOVE FORWARD ALL IN {quote_ident(cursor_name)}")
+            total = fetched + counter.rowcount
+        except psycopg2.errors.QueryCanceled:
+            total = None
+        # Rolling back (also on success) restores the query's statement_timeout
+        counter.execute("ROLLBACK TO SAVEPOINT count_rest")
+        counter.execute("RELEASE SAVEPOINT count_rest")
+    return total
+
+# Tables every user may read besides their own uploads
+SHARED_TABLES = ("users", "products", "orders")
+
+def check_table_access(sql_query, user_id):
+    """
+    Returns (tables referenced by the query, error message or "") for the user's uploads.
+    Relations come from the parsed query (CTEs, subqueries, comma joins, schema-qualified
+    names); the allowed set from the cached schema catalog, so no extra round-trip.
+    """
+    analysis = sql_analyzer.analyze(sql_query)
+    catalog = get_schema_catalog(user_id)
+    if catalog is None:
+        return [], "Database connection failed."
+    allowed = {t.lower() for t in catalog["tables"]} | set(SHARED_TABLES)
+
+    flat_used = [table for _, table in analysis.tables]
+    for schema, table in analysis.tables:
+        if schema and schema.lower() != "public":
+            return flat_used, f"Security Violation: Access denied to table '{schema}.{table}'."
+        if table.lower() not in allowed:
+            return flat_used, f"Security Violation: Access denied to table '{table}'."
+    return flat_used, ""
+
+def split_statements(sql_query):
+    """Statements of `sql_query`; semicolons inside literals, quoted names and comments don't split."""
+    return sql_analyzer.analyze(sql_query).statements
+
+def is_row_returning(statement):
+    return _ROW_RETURNING.match(statement) is not None
+
+def check_read_only(sql_query):
+    """
+    Returns an error message unless every statement is a plain query (sql_analyzer.is_plain_select).
+    A COMMIT would end the READ ONLY transaction and let the next statement write, SET/RESET would
+    outlive the request on a pooled connection, and EXPLAIN ANALYZE runs its statement past the
+    cost guard. Statements sqlglot cannot parse must at least start like a query.
     """
+    analysis = sql_analyzer.analyze(sql_query)
+    for statement, expression in zip(analysis.statements, analysis.expressions):
+        plain = sql_analyzer.is_plain_select(expression) if expression is not None else is_row_returning(statement)
+        if not plain:
+            return f"Security Violation: only SELECT queries may run (rejected: '{' '.join(statement.split())[:80]}')."
+    return ""
+
+def check_plan(sql_query, user_id=None):
+    """
+    EXPLAINs every statement without executing it; planning alone reports
+    unknown tables/columns, bad casts and operator mismatches. Returns an error message or "".
+    """
+    err = check_read_only(sql_query)
+    if not err and user_id:
+        _, err = check_table_access(sql_query, user_id)
+    if err:
+        return err
     conn = get_db_connection()
     if not conn:
-        return None, "Database connection failed."
-    
+        return ""  # Nothing to learn without a database; the executor reports the outage
+    try:
+        with conn.cursor() as cur:
+            begin_read_only(cur, statement_timeout_ms(user_id))
+            for statement in split_statements(sql_query):
+                cur.execute(f"EXPLAIN {statement}")
+        return ""
+    except Exception as e:
+        return str(e).strip()
+    finally:
+        conn.close()
+
+def execute_query(sql_query, user_id=None, row_cap=None, cancel=None):
+    """
+    Executes the generated SQL query and returns the results.
+    Supports multiple statements, all plain queries (check_read_only). Each result set holds at most `row_cap` rows (QUERY_ROW_CAP).
+    Runs in a READ ONLY transaction under the user's statement_timeout; SELECTs whose
+    EXPLAIN estimate exceeds QUERY_MAX_COST are rejected with a CostGuardRejection.
+    `cancel` (a QueryCancel) lets another thread stop the query.
+    Returns: List of {"rows": [], "columns": [], "truncated": bool, "total_count": int|None} or (None, error_msg)
+    """
+    # SECURITY: only plain queries, so nothing can leave the READ ONLY transaction
+    err = check_read_only(sql_query)
+    if err:
+        return None, err
     # SECURITY: Parse query for tables and check against DynamicTable
     if user_id:
-        session = get_db_session()
-        user_tables = session.query(DynamicTable.table_name).filter(DynamicTable.user_id == user_id).all()
-        user_table_list = [t[0].lower() for t in user_tables]
-        session.close()
+        flat_used, err = check_table_access(sql_query, user_id)
+        if err:
+            return None, err
 
-        used_tables = re.findall(r'FROM\s+"?(\w+)"?|JOIN\s+"?(\w+)"?', sql_query, re.IGNORECASE)
-        flat_used = [t for tup in used_tables for t in tup if t]
-        
-        for ut in flat_used:
-            if ut.lower() not in user_table_list and ut.lower() not in ['users', 'products', 'orders']:
-                 return None, f"Security Violation: Access denied to table '{ut}'."
+    conn = get_db_connection()
+    if not conn:
+        return None, "Database connection failed."
 
     try:
+        if cancel is not None and not cancel._attach(conn):
+            return None, QUERY_CANCELLED
         all_results = []
         with conn.cursor() as cur:
-            # 1. Clean and split the query by semicolon (basic splitting)
-            # This handles most AI-generated multi-statement queries
-            statements = [s.strip() for s in sql_query.split(';') if s.strip()]
-            
-            for statement in statements:
-                cur.execute(statement)
-                if cur.description:
-                    colnames = [desc[0] for desc in cur.description]
-                    rows = cur.fetchall()
-                    all_results.append({
-                        "columns": colnames,
-                        "rows": rows
-                    })
+            begin_read_only(cur, statement_timeout_ms(user_id))
+        for statement in split_statements(sql_query):
+            all_results.append(_run_statement(conn, statement, row_cap or QUERY_ROW_CAP))
+            if cancel is not None and cancel.cancelled:
+                return None, QUERY_CANCELLED
+
+        if user_id:
+            _observe_for_indexing(sql_query, user_id, flat_used)
+
+        if not all_results:
+            return [], "" # No rows returned but successful
             
-            if not all_results:
-                return [], "" # No rows returned but successful
-                
-            return all_results, ""
+        return all_results, ""
+    except QueryTooExpensive as e:
+        return None, e.rejection
+    except psycopg2.errors.QueryCanceled:
+        if cancel is not None and cancel.cancelled:
+            return None, QUERY_CANCELLED
+        return None, (f"Statement Timeout: the query ran longer than {statement_timeout_ms(user_id) / 1000:.0f}s and was cancelled. "
+                      f"Filter or aggregate earlier so less data is scanned.")
     except Exception as e:
         return None, str(e)
     finally:
+        if cancel is not None:
+            cancel._detach()
         conn.close()
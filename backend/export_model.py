@@ -0,0 +1,76 @@
+import sys
+import argparse
+import local_inference
+
+# Fixed question set used to check that optimized backends produce the same SQL as fp32.
+PARITY_SCHEMA = """Table: sales
+ - region (text)
+ - amount (double precision)
+ - order_date (timestamp without time zone)
+Table: customers
+ - customer_id (bigint)
+ - name (text)
+ - city (text)"""
+
+PARITY_QUESTIONS = [
+    "total revenue by region",
+    "how many customers live in each city",
+    "average sale amount in 2024",
+    "top 5 regions by total amount",
+    "list customers whose name starts with A",
+    "monthly revenue for the north region",
+    "count of sales above 1000",
+    "which city has the most customers",
+]
+
+def parity_prompts():
+    return [f"translate English to SQL: {q} \n Context: {PARITY_SCHEMA}" for q in PARITY_QUESTIONS]
+
+def export_onnx(model_path, output_dir):
+    # Optional dependency: pip install optimum[onnxruntime]
+    from optimum.onnxruntime import ORTModelForSeq2SeqLM
+
+    print(f"📦 Exporting {model_path} to ONNX (encoder + decoder + decoder-with-past)...")
+    model = ORTModelForSeq2SeqLM.from_pretrained(model_path, export=True, use_cache=True)
+    model.save_pretrained(output_dir)
+    from transformers import T5Tokenizer
+    T5Tokenizer.from_pretrained(model_path).save_pretrained(output_dir)
+    print(f"✅ ONNX model saved to folder: {output_dir}")
+
+def check_parity(model_path, backends):
+    """Generates SQL for the fixed question set with fp32 and each backend. Returns True if all match."""
+    prompts = parity_prompts()
+    tokenizer, model = local_inference.load_model("torch", model_path)
+    reference = local_inference.generate_batch(prompts, tokenizer, model)
+
+    all_match = True
+    for backend in backends:
+        tokenizer, model = local_inference.load_model(backend, model_path)
+        outputs = local_inference.generate_batch(prompts, tokenizer, model)
+        mismatches = [(q, ref, out) for q, ref, out in zip(PARITY_QUESTIONS, reference, outputs) if ref.strip() != out.strip()]
+        print(f"{'✅' if not mismatches else '❌'} {backend}: {len(prompts) - len(mismatches)}/{len(prompts)} match fp32")
+        for question, ref, out in mismatches:
+            print(f"   Q: {question}\n      fp32: {ref}\n      {backend}: {out}")
+        all_match = all_match and not mismatches
+    return all_match
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Export and verify optimized backends for the local T5 SQL model")
+    sub = parser.add_subparsers(dest="command", required=True)
+
+    onnx = sub.add_parser("onnx", help="Export the fine-tuned model to ONNX Runtime format")
+    onnx.add_argument("--output", default=local_inference.ONNX_MODEL_DIR)
+
+    parity = sub.add_parser("parity", help="Check generated SQL of optimized backends against fp32")
+    parity.add_argument("--backends", nargs="+", default=["int8", "onnx"], choices=["int8", "onnx"])
+
+    args = parser.parse_args()
+    model_path = local_inference.find_model_path()
+    if not model_path:
+        print("❌ Local model folder not found (fine_tuned_sql_model). Train it first with train.py.")
+        sys.exit(1)
+
+    if args.command == "onnx":
+        export_onnx(model_path, args.output)
+    else:
+        sys.exit(0 if check_parity(model_path, args.backends) else 1)
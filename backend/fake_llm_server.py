@@ -0,0 +1,107 @@
+"""
+Local stand-in for the Gemini REST API, for exercising llm_gateway offline.
+Answers generateContent / streamGenerateContent (JSON mode included) with the
+canned agent replies from benchmark.py, with configurable latency and injected failures.
+
+Usage:
+    python fake_llm_server.py --port 8765 --latency 0.2 --fail-rate 0.3 --fail-status 429
+    GEMINI_BASE_URL=http://127.0.0.1:8765 GEMINI_API_KEY=fake uvicorn main:app
+"""
+import json
+import time
+import random
+import argparse
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from benchmark import fake_llm_reply
+
+_STATUS_NAMES = {429: "RESOURCE_EXHAUSTED", 500: "INTERNAL", 503: "UNAVAILABLE", 400: "INVALID_ARGUMENT"}
+
+def _response(text):
+    return {
+        "candidates": [{"content": {"role": "model", "parts": [{"text": text}]}, "finishReason": "STOP", "index": 0}],
+        "usageMetadata": {"promptTokenCount": 0, "candidatesTokenCount": len(text.split())},
+    }
+
+class FakeGeminiHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+
+    def log_message(self, format, *args):
+        pass
+
+    def _send_json(self, status, payload):
+        body = json.dumps(payload).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_POST(self):
+        server = self.server
+        body = self.rfile.read(int(self.headers.get("Content-Length", 0)))
+        with server.lock:
+            server.requests += 1
+        time.sleep(server.latency)
+
+        if random.random() < server.fail_rate:
+            with server.lock:
+                server.failures += 1
+            status = server.fail_status
+            self._send_json(status, {"error": {"code": status, "message": "Injected failure",
+                                               "status": _STATUS_NAMES.get(status, "UNKNOWN")}})
+            return
+
+        try:
+            request = json.loads(body or b"{}")
+            prompt = "".join(p.get("text", "") for c in request.get("contents", []) for p in c.get("parts", []))
+            json_output = request.get("generationConfig", {}).get("responseMimeType") == "application/json"
+        except ValueError:
+            self._send_json(400, {"error": {"code": 400, "message": "Invalid JSON", "status": "INVALID_ARGUMENT"}})
+            return
+        reply = fake_llm_reply(prompt, json_output)
+
+        if ":streamGenerateContent" in self.path:
+            self.send_response(200)
+            self.send_header("Content-Type", "text/event-stream")
+            self.send_header("Connection", "close")
+            self.end_headers()
+            words = reply.split(" ")
+            step = max(1, len(words) // 3)
+            for i in range(0, len(words), step):
+                piece = " ".join(words[i:i + step]) + (" " if i + step < len(words) else "")
+                self.wfile.write(f"data: {json.dumps(_response(piece))}\r\n\r\n".encode("utf-8"))
+                self.wfile.flush()
+            self.close_connection = True
+        else:
+            self._send_json(200, _response(reply))
+
+def start(port=0, latency=0.0, fail_rate=0.0, fail_status=429):
+    """Starts the server on a daemon thread. Returns (server, base_url); stop with server.shutdown()."""
+    server = ThreadingHTTPServer(("127.0.0.1", port), FakeGeminiHandler)
+    server.daemon_threads = True
+    server.latency = latency
+    server.fail_rate = fail_rate
+    server.fail_status = fail_status
+    server.lock = threading.Lock()
+    server.requests = 0
+    server.failures = 0
+    threading.Thread(target=server.serve_forever, name="fake-llm", daemon=True).start()
+    return server, f"http://127.0.0.1:{server.server_address[1]}"
+
+def main():
+    parser = argparse.ArgumentParser(description="Fake Gemini API for local testing")
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--latency", type=float, default=0.2, help="Seconds before each reply")
+    parser.add_argument("--fail-rate", type=float, default=0.0, help="Share of requests answered with --fail-status")
+    parser.add_argument("--fail-status", type=int, default=429)
+    args = parser.parse_args()
+    server, url = start(args.port, args.latency, args.fail_rate, args.fail_status)
+    print(f"🧪 Fake Gemini API on {url} (latency {args.latency}s, fail rate {args.fail_rate:.0%} -> {args.fail_status})")
+    try:
+        threading.Event().wait()
+    except KeyboardInterrupt:
+        server.shutdown()
+
+if __name__ == "__main__":
+    main()
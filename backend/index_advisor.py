@@ -0,0 +1,242 @@
+"""
+Index and statistics advisor for user-uploaded tables.
+After a load (on the staging table, before it becomes visible) it runs ANALYZE,
+reads column cardinality from pg_stats and indexes likely filter/join keys.
+At query time it counts which columns the executed SQL filters, joins and
+groups on, and recommends (or builds, CONCURRENTLY) indexes for the hot ones.
+Everything it does is recorded in DynamicTable.index_info.
+"""
+import os
+import re
+import json
+import uuid
+import threading
+from datetime import datetime
+import database
+import sql_analyzer
+from models import DynamicTable
+
+# Tables smaller than this are cheaper to scan than to index
+INDEX_MIN_ROWS = int(os.getenv("INDEX_MIN_ROWS", "10000"))
+INDEX_MAX_PER_TABLE = int(os.getenv("INDEX_MAX_PER_TABLE", "6"))
+INDEX_CATEGORY_MAX_DISTINCT = int(os.getenv("INDEX_CATEGORY_MAX_DISTINCT", "500"))
+# Filter/join/group uses of an unindexed column before the advisor acts on it
+INDEX_LEARN_THRESHOLD = int(os.getenv("INDEX_LEARN_THRESHOLD", "25"))
+# false: only record a recommendation | true: CREATE INDEX CONCURRENTLY on the live table
+INDEX_ADVISOR_AUTO_CREATE = os.getenv("INDEX_ADVISOR_AUTO_CREATE", "false").lower() == "true"
+
+_ID_NAME = re.compile(r"(^|_)(id|key|code|uuid)$|[a-z]Id$", re.IGNORECASE)
+_DATE_NAME = re.compile(r"date|time|(^|_)(at|on|day|month|year)$", re.IGNORECASE)
+_DATE_TYPES = ("date", "timestamp without time zone", "timestamp with time zone")
+_CATEGORY_TYPES = ("text", "character varying", "boolean")
+
+def _index_name():
+    # Index names are schema-wide and survive the staging->live rename, so they must not derive from the table name
+    return f"ix_{uuid.uuid4().hex[:20]}"
+
+def load_index_info(raw):
+    try:
+        return json.loads(raw) if raw else {}
+    except ValueError:
+        return {}
+
+# ============================================================================
+# POST-INGEST: ANALYZE + PROFILE + INDEX
+# ============================================================================
+def profile_columns(cur, table_name, row_count):
+    """Returns {column: {"type", "distinct", "null_frac"}} from pg_stats (the table must be ANALYZEd)."""
+    cur.execute("""
+        SELECT c.column_name, c.data_type, s.n_distinct, s.null_frac
+        FROM information_schema.columns c
+        LEFT JOIN pg_stats s
+          ON s.schemaname = c.table_schema AND s.tablename = c.table_name AND s.attname = c.column_name
+        WHERE c.table_schema = 'public' AND c.table_name = %s
+        ORDER BY c.ordinal_position
+    """, (table_name,))
+    profile = {}
+    for column, data_type, n_distinct, null_frac in cur.fetchall():
+        # Negative n_distinct is a fraction of the row count
+        distinct = None if n_distinct is None else int(n_distinct if n_distinct >= 0 else -n_distinct * row_count)
+        profile[column] = {"type": data_type, "distinct": distinct, "null_frac": round(null_frac or 0.0, 4)}
+    return profile
+
+def choose_indexes(profile, row_count):
+    """Picks (column, reason) pairs worth indexing, id-like keys first, then dates, then categories."""
+    if row_count < INDEX_MIN_ROWS:
+        return []
+    ids, dates, categories = [], [], []
+    for column, info in profile.items():
+        distinct = info["distinct"] or 0
+        if distinct < 2 or info["null_frac"] > 0.9:
+            continue
+        if _ID_NAME.search(column):
+            ids.append((column, f"id-like key ({distinct} distinct)"))
+        elif info["type"] in _DATE_TYPES or (_DATE_NAME.search(column) and info["type"] in _CATEGORY_TYPES):
+            dates.append((column, "date/time column"))
+        elif info["type"] in _CATEGORY_TYPES and distinct <= INDEX_CATEGORY_MAX_DISTINCT:
+            categories.append((column, f"low-cardinality category ({distinct} distinct)"))
+    return (ids + dates + categories)[:INDEX_MAX_PER_TABLE]
+
+def prepare_table(table_name, row_count, carry_columns=()):
+    """
+    ANALYZEs a freshly loaded table and builds its initial indexes. Meant for the staging
+    table, where plain CREATE INDEX blocks nobody. `carry_columns` are indexes learned on
+    the previous version of the table that should survive a re-upload.
+    Returns the index_info dict to store in dynamic_tables.
+    """
+    info = {"analyzed_at": datetime.utcnow().isoformat(), "indexes": [], "recommendations": []}
+    conn = database.get_db_connection()
+    if not conn:
+        info["error"] = "Database connection failed."
+        return info
+    try:
+        with conn.cursor() as cur:
+            cur.execute(f"ANALYZE {database.quote_ident(table_name)}")
+            profile = profile_columns(cur, table_name, row_count)
+            info["cardinality"] = {c: p["distinct"] for c, p in profile.items()}
+
+            chosen = choose_indexes(profile, row_count)
+            chosen_columns = {c for c, _ in chosen}
+            chosen += [(c, "learned from executed queries") for c in carry_columns
+                       if c in profile and c not in chosen_columns]
+            for column, reason in chosen:
+                name = _index_name()
+                cur.execute(f"CREATE INDEX {database.quote_ident(name)} ON {database.quote_ident(table_name)} "
+                            f"({database.quote_ident(column)})")
+                info["indexes"].append({"name": name, "column": column, "reason": reason,
+                                        "created_at": datetime.utcnow().isoformat()})
+        conn.commit()
+        print(f"📇 {table_name}: analyzed {row_count} rows, created {len(info['indexes'])} indexes.")
+    except Exception as e:
+        conn.rollback()
+        info["indexes"] = []
+        info["error"] = str(e)
+        print(f"⚠️ Index advisor skipped {table_name}: {e}")
+    finally:
+        conn.close()
+    return info
+
+# ============================================================================
+# QUERY-TIME LEARNING
+# ============================================================================
+_CLAUSES = [
+    re.compile(r"\bWHERE\b(.*?)(?=\bGROUP\s+BY\b|\bORDER\s+BY\b|\bHAVING\b|\bLIMIT\b|\bUNION\b|\)|$)", re.IGNORECASE | re.DOTALL),
+    re.compile(r"\bON\b(.*?)(?=\bJOIN\b|\bWHERE\b|\bGROUP\s+BY\b|\bORDER\s+BY\b|\bLIMIT\b|$)", re.IGNORECASE | re.DOTALL),
+    re.compile(r"\bGROUP\s+BY\b(.*?)(?=\bHAVING\b|\bORDER\s+BY\b|\bLIMIT\b|\)|$)", re.IGNORECASE | re.DOTALL),
+]
+_IDENTIFIER = re.compile(r'"((?:[^"]|"")+)"|\b([A-Za-z_]\w*)\b')
+_STRING_LITERAL = re.compile(r"'(?:[^']|'')*'")
+
+_usage_lock = threading.Lock()
+# (table, column) -> number of executed queries that filtered/joined/grouped on it
+_usage = {}
+_considered = set()
+
+def predicate_columns(sql):
+    """Identifiers appearing in WHERE / JOIN ... ON / GROUP BY clauses of `sql`."""
+    analysis = sql_analyzer.analyze(sql)
+    if analysis.parsed:
+        # Same memoized parse the access check used
+        return sql_analyzer.predicate_columns(analysis)
+    names = set()
+    # Words inside literals ('Coronary Artery Disease') are values, not columns
+    sql = _STRING_LITERAL.sub("''", sql)
+    for clause in _CLAUSES:
+        for match in clause.finditer(sql):
+            for quoted, bare in _IDENTIFIER.findall(match.group(1)):
+                names.add(quoted.replace('""', '"') if quoted else bare)
+    return names
+
+def observe(sql, tables):
+    """
+    Records which columns of `tables` ({table: [column, ...]}) an executed query used.
+    Cheap enough for the query path; index work happens on a background thread.
+    """
+    names = predicate_columns(sql)
+    lowered = {n.lower() for n in names}
+    ready = []
+    with _usage_lock:
+        for table, columns in tables.items():
+            for column in columns:
+                if column in names or column.lower() in lowered:
+                    key = (table, column)
+                    _usage[key] = _usage.get(key, 0) + 1
+                    if _usage[key] >= INDEX_LEARN_THRESHOLD and key not in _considered:
+                        _considered.add(key)
+                        ready.append((key, _usage[key]))
+    for (table, column), uses in ready:
+        threading.Thread(target=_consider, args=(table, column, uses), name="index-advisor", daemon=True).start()
+
+def reset_usage(table_name):
+    """Forgets usage counts for a table whose data was just replaced."""
+    with _usage_lock:
+        for key in [k for k in _usage if k[0] == table_name]:
+            _usage.pop(key, None)
+            _considered.discard(key)
+
+def _has_index(cur, table_name, column):
+    cur.execute("""
+        SELECT 1 FROM pg_index i
+        JOIN pg_attribute a ON a.attrelid = i.indrelid AND a.attnum = i.indkey[0]
+        WHERE i.indrelid = to_regclass(%s) AND a.attname = %s
+        LIMIT 1
+    """, (database.quote_ident(table_name), column))
+    return cur.fetchone() is not None
+
+def _consider(table_name, column, uses):
+    session = database.get_db_session()
+    conn = database.get_db_connection()
+    if not conn:
+        session.close()
+        return
+    try:
+        meta = session.query(DynamicTable).filter(DynamicTable.table_name == table_name).first()
+        if meta is None or (meta.row_count or 0) < INDEX_MIN_ROWS:
+            return
+        with conn.cursor() as cur:
+            if _has_index(cur, table_name, column):
+                return
+        conn.rollback()
+
+        reason = f"learned: {uses} filter/join/group uses"
+        entry = {"column": column, "reason": reason, "at": datetime.utcnow().isoformat()}
+        if INDEX_ADVISOR_AUTO_CREATE:
+            entry["name"] = _index_name()
+            # CONCURRENTLY cannot run inside a transaction block. `conn` is the pool's proxy: the
+            # flag has to be set on the psycopg2 connection itself, and reset before it goes back
+            dbapi_conn = getattr(conn, "dbapi_connection", None) or conn.connection
+            dbapi_conn.autocommit = True
+            try:
+                with dbapi_conn.cursor() as cur:
+                    cur.execute(f"CREATE INDEX CONCURRENTLY {database.quote_ident(entry['name'])} "
+                                f"ON {database.quote_ident(table_name)} ({database.quote_ident(column)})")
+            finally:
+                dbapi_conn.autocommit = False
+            entry["created_at"] = entry.pop("at")
+            print(f"📇 {table_name}.{column}: created index after {uses} uses.")
+        else:
+            print(f"💡 {table_name}.{column}: index recommended after {uses} uses.")
+
+        # Re-read under a row lock: the table may have been re-uploaded meanwhile
+        meta = session.query(DynamicTable).filter(DynamicTable.table_name == table_name).with_for_update().first()
+        if meta is None:
+            return
+        info = load_index_info(meta.index_info)
+        info.setdefault("indexes", [])
+        info.setdefault("recommendations", [])
+        if INDEX_ADVISOR_AUTO_CREATE:
+            info["indexes"].append(entry)
+        else:
+            info["recommendations"] = [r for r in info["recommendations"] if r.get("column") != column] + [entry]
+        meta.index_info = json.dumps(info)
+        session.commit()
+    except Exception as e:
+        session.rollback()
+        print(f"⚠️ Index advisor could not index {table_name}.{column}: {e}")
+    finally:
+        session.close()
+        conn.close()
+
+def learned_columns(index_info):
+    """Columns whose indexes were created from query usage (carried over on re-upload)."""
+    return [i["column"] for i in index_info.get("indexes", []) if i.get("reason", "").startswith("learned")]
@@ -0,0 +1,152 @@
+"""
+Background ingestion jobs.
+/upload spools the file to disk and hands it to a small worker pool, so the
+request returns immediately with a job id that clients poll (or stream) for
+progress. Job state lives in this process; run the API as a single worker
+or route /jobs requests to the worker that accepted the upload.
+"""
+import os
+import time
+import uuid
+import threading
+from concurrent.futures import ThreadPoolExecutor
+import database
+
+# How many files are parsed/loaded at once, and how many may wait behind them
+INGEST_MAX_CONCURRENCY = int(os.getenv("INGEST_MAX_CONCURRENCY", "2"))
+INGEST_MAX_PENDING = int(os.getenv("INGEST_MAX_PENDING", "16"))
+# Finished jobs stay queryable for this long
+INGEST_JOB_RETENTION = float(os.getenv("INGEST_JOB_RETENTION", "3600"))
+
+TERMINAL_STATUSES = ("succeeded", "failed", "cancelled")
+
+class TooManyJobs(Exception):
+    """Raised when INGEST_MAX_PENDING jobs are already queued or running."""
+
+class IngestJob:
+    def __init__(self, user_id, table_name, filename, path):
+        self.id = uuid.uuid4().hex
+        self.user_id = user_id
+        self.table_name = table_name
+        self.filename = filename
+        self.path = path
+        self.status = "queued"
+        self.message = ""
+        self.bytes_total = os.path.getsize(path)
+        self.bytes_parsed = 0
+        self.rows_loaded = 0
+        self.row_count = None
+        self.created_at = time.time()
+        self.started_at = None
+        self.finished_at = None
+        self.cancel_event = threading.Event()
+        self.future = None
+
+    @property
+    def done(self):
+        return self.status in TERMINAL_STATUSES
+
+    def to_dict(self):
+        return {
+            "job_id": self.id,
+            "table_name": self.table_name,
+            "filename": self.filename,
+            "status": self.status,
+            "message": self.message,
+            "bytes_total": self.bytes_total,
+            "bytes_parsed": self.bytes_parsed,
+            "rows_loaded": self.rows_loaded,
+            "row_count": self.row_count,
+            "created_at": self.created_at,
+            "started_at": self.started_at,
+            "finished_at": self.finished_at,
+        }
+
+_executor = None
+_lock = threading.Lock()
+_jobs = {}
+
+def _get_executor():
+    global _executor
+    if _executor is None:
+        with _lock:
+            if _executor is None:
+                _executor = ThreadPoolExecutor(max_workers=INGEST_MAX_CONCURRENCY, thread_name_prefix="ingest")
+    return _executor
+
+def _prune():
+    cutoff = time.time() - INGEST_JOB_RETENTION
+    for job_id in [j.id for j in _jobs.values() if j.done and j.finished_at < cutoff]:
+        del _jobs[job_id]
+
+def _finish(job, status, message):
+    job.status = status
+    job.message = message
+    job.finished_at = time.time()
+    try:
+        os.unlink(job.path)
+    except OSError:
+        pass
+    print(f"{'✅' if status == 'succeeded' else '⚠️'} Ingestion job {job.id} ({job.table_name}) {status}: {message}")
+
+def _run(job):
+    if job.cancel_event.is_set():
+        _finish(job, "cancelled", "Cancelled before it started.")
+        return
+    job.status = "running"
+    job.started_at = time.time()
+    try:
+        success, message = database.ingest_file(
+            job.path, job.table_name, job.user_id, job.filename,
+            on_bytes=lambda n: setattr(job, "bytes_parsed", n),
+            on_rows=lambda n: setattr(job, "rows_loaded", n),
+            cancel_event=job.cancel_event,
+        )
+    except Exception as e:
+        success, message = False, str(e)
+    if success:
+        job.bytes_parsed = job.bytes_total
+        job.row_count = job.rows_loaded
+        _finish(job, "succeeded", message)
+    elif job.cancel_event.is_set():
+        _finish(job, "cancelled", "Cancelled by user.")
+    else:
+        _finish(job, "failed", message)
+
+def submit(path, table_name, user_id, filename):
+    """Queues a spooled upload for ingestion. The job owns `path` and deletes it when finished."""
+    with _lock:
+        _prune()
+        pending = sum(1 for j in _jobs.values() if not j.done)
+        if pending >= INGEST_MAX_PENDING:
+            raise TooManyJobs(f"{pending} ingestion jobs are already pending. Try again shortly.")
+        job = IngestJob(user_id, table_name, filename, path)
+        _jobs[job.id] = job
+    job.future = _get_executor().submit(_run, job)
+    return job
+
+def get_job(job_id, user_id):
+    """Returns the job if it exists and belongs to `user_id`, else None."""
+    job = _jobs.get(job_id)
+    if job is None or job.user_id != user_id:
+        return None
+    return job
+
+def cancel(job):
+    """Cancels a queued job outright, or asks a running one to stop after its current chunk."""
+    if job.done:
+        return False
+    job.cancel_event.set()
+    if job.future is not None and job.future.cancel():
+        _finish(job, "cancelled", "Cancelled before it started.")
+    return True
+
+def get_stats():
+    with _lock:
+        jobs = list(_jobs.values())
+    counts = {status: 0 for status in ("queued", "running") + TERMINAL_STATUSES}
+    for job in jobs:
+        counts[job.status] += 1
+    counts["max_concurrency"] = INGEST_MAX_CONCURRENCY
+    counts["max_pending"] = INGEST_MAX_PENDING
+    return counts
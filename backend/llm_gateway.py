@@ -0,0 +1,312 @@
+"""
+Single gateway for every Gemini call.
+One shared client (connection pool), a token-bucket rate limit plus a concurrency
+cap, per-call timeouts, retries with jittered exponential backoff on retryable
+errors (429, 5xx, timeouts, transport errors), and a circuit breaker: after
+LLM_BREAKER_FAILURES consecutive failures calls fail fast with LLMUnavailable
+for LLM_BREAKER_COOLDOWN seconds, so the agents can fall back to the local model.
+Point GEMINI_BASE_URL at fake_llm_server.py to exercise all of this offline.
+"""
+import os
+import time
+import random
+import asyncio
+import threading
+import weakref
+from collections import deque
+from dotenv import load_dotenv
+
+load_dotenv()
+
+MODEL_ID = os.getenv("GEMINI_MODEL", "gemini-2.0-flash")
+GEMINI_BASE_URL = os.getenv("GEMINI_BASE_URL", "")
+
+# Token bucket: sustained calls per second, and how many may go out back to back
+LLM_RATE_PER_SECOND = float(os.getenv("LLM_RATE_PER_SECOND", "10"))
+LLM_BURST = int(os.getenv("LLM_BURST", "20"))
+LLM_MAX_CONCURRENCY = int(os.getenv("LLM_MAX_CONCURRENCY", "8"))
+LLM_TIMEOUT_SECONDS = float(os.getenv("LLM_TIMEOUT_SECONDS", "30"))
+LLM_MAX_RETRIES = int(os.getenv("LLM_MAX_RETRIES", "3"))
+LLM_BACKOFF_BASE = float(os.getenv("LLM_BACKOFF_BASE", "0.5"))
+LLM_BACKOFF_MAX = float(os.getenv("LLM_BACKOFF_MAX", "8"))
+LLM_BREAKER_FAILURES = int(os.getenv("LLM_BREAKER_FAILURES", "5"))
+LLM_BREAKER_COOLDOWN = float(os.getenv("LLM_BREAKER_COOLDOWN", "30"))
+
+RETRYABLE_CODES = (408, 429, 500, 502, 503, 504)
+LATENCY_WINDOW = 500
+
+class LLMUnavailable(Exception):
+    """Gemini is degraded (circuit open) or the call kept failing after retries."""
+
+_client = None
+_client_lock = threading.Lock()
+
+def get_client():
+    """Returns the shared Google GenAI client, creating it once."""
+    global _client
+    if _client is None:
+        with _client_lock:
+            if _client is None:
+                from google import genai
+                from google.genai import types
+                http_options = types.HttpOptions(base_url=GEMINI_BASE_URL) if GEMINI_BASE_URL else None
+                _client = genai.Client(api_key=os.getenv("GEMINI_API_KEY"), http_options=http_options)
+    return _client
+
+def is_ready():
+    return _client is not None
+
+# ============================================================================
+# RATE LIMIT + CONCURRENCY
+# ============================================================================
+class TokenBucket:
+    """Thread-safe token bucket; `reserve()` takes a token and returns how long to wait for it."""
+
+    def __init__(self, rate, burst):
+        self.rate = rate
+        self.capacity = max(1, burst)
+        self.tokens = float(self.capacity)
+        self.updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def reserve(self):
+        if self.rate <= 0:
+            return 0.0
+        with self._lock:
+            now = time.monotonic()
+            self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+            self.updated = now
+            self.tokens -= 1
+            # A negative balance is a queue: each waiter owns one slot of the refill
+            return 0.0 if self.tokens >= 0 else -self.tokens / self.rate
+
+_bucket = TokenBucket(LLM_RATE_PER_SECOND, LLM_BURST)
+# asyncio primitives belong to one event loop; scripts and benchmarks may run several in turn
+_semaphores = weakref.WeakKeyDictionary()
+
+def _semaphore():
+    loop = asyncio.get_running_loop()
+    sem = _semaphores.get(loop)
+    if sem is None:
+        sem = _semaphores[loop] = asyncio.Semaphore(LLM_MAX_CONCURRENCY)
+    return sem
+
+# ============================================================================
+# CIRCUIT BREAKER
+# ============================================================================
+class CircuitBreaker:
+    """closed -> open after `threshold` consecutive failures -> half-open (one probe) after `cooldown`."""
+
+    def __init__(self, threshold, cooldown):
+        self.threshold = threshold
+        self.cooldown = cooldown
+        self.failures = 0
+        self.opened_at = None
+        self.probing = False
+        self.trips = 0
+        self._lock = threading.Lock()
+
+    @property
+    def state(self):
+        if self.opened_at is None:
+            return "closed"
+        return "half-open" if time.monotonic() - self.opened_at >= self.cooldown else "open"
+
+    def allow(self):
+        """False when calls must fail fast; else "closed", or "probe" for the one half-open trial call."""
+        with self._lock:
+            state = self.state
+            if state == "closed":
+                return "closed"
+            if state == "half-open" and not self.probing:
+                self.probing = True
+                return "probe"
+            return False
+
+    def record_success(self):
+        with self._lock:
+            self.failures = 0
+            self.opened_at = None
+            self.probing = False
+
+    def release_probe(self):
+        """The half-open probe ended without a verdict (cancelled): let the next call probe instead."""
+        with self._lock:
+            self.probing = False
+
+    def record_failure(self):
+        with self._lock:
+            self.failures += 1
+            if self.probing or self.failures >= self.threshold:
+                if self.opened_at is None:
+                    self.trips += 1
+                self.opened_at = time.monotonic()
+            self.probing = False
+
+breaker = CircuitBreaker(LLM_BREAKER_FAILURES, LLM_BREAKER_COOLDOWN)
+
+def is_degraded():
+    """True while the breaker is open: callers should take their local fallback without trying."""
+    return breaker.state == "open"
+
+# ============================================================================
+# COUNTERS
+# ============================================================================
+_stats_lock = threading.Lock()
+_agent_stats = {}
+
+def _record(agent, outcome, latency=None, retries=0):
+    with _stats_lock:
+        entry = _agent_stats.setdefault(agent, {
+            "calls": 0, "ok": 0, "errors": 0, "timeouts": 0, "rejected": 0, "cancelled": 0, "retries": 0,
+            "latencies": deque(maxlen=LATENCY_WINDOW),
+        })
+        entry["calls"] += 1
+        entry[outcome] += 1
+        entry["retries"] += retries
+        if latency is not None:
+            entry["latencies"].append(latency)
+
+def get_stats():
+    with _stats_lock:
+        agents = {}
+        for agent, entry in _agent_stats.items():
+            latencies = sorted(entry["latencies"])
+            agents[agent] = {k: v for k, v in entry.items() if k != "latencies"}
+            if latencies:
+                agents[agent]["p50_ms"] = round(latencies[len(latencies) // 2] * 1000, 1)
+                agents[agent]["p95_ms"] = round(latencies[max(0, int(len(latencies) * 0.95) - 1)] * 1000, 1)
+    return {"breaker": breaker.state, "breaker_trips": breaker.trips, "agents": agents}
+
+# ============================================================================
+# CALLS
+# ============================================================================
+def _is_retryable(error):
+    if isinstance(error, (asyncio.TimeoutError, TimeoutError, ConnectionError)):
+        return True
+    if getattr(error, "code", None) in RETRYABLE_CODES:
+        return True
+    try:
+        import httpx
+        return isinstance(error, httpx.TransportError)
+    except ImportError:
+        return False
+
+def _backoff(attempt):
+    # Full jitter: spreads retries from many callers hit by the same 429 burst
+    return random.uniform(0, min(LLM_BACKOFF_MAX, LLM_BACKOFF_BASE * 2 ** attempt))
+
+def _admit(agent):
+    grant = breaker.allow()
+    if not grant:
+        _record(agent, "rejected")
+        raise LLMUnavailable("Gemini circuit breaker is open.")
+    return grant
+
+async def _call_with_retries(agent, attempt_fn, keep_slot=False):
+    """
+    Runs `attempt_fn()` under the rate limit, concurrency cap, timeout, retries and breaker.
+    With `keep_slot` the concurrency slot stays taken on success; the caller releases it.
+    """
+    retries = 0
+    # Latency is what the agent waits for: backoff and queueing included
+    start = time.perf_counter()
+    grant = None
+    try:
+        while True:
+            grant = _admit(agent)
+            delay = _bucket.reserve()
+            if delay:
+                await asyncio.sleep(delay)
+            slot = _semaphore()
+            await slot.acquire()
+            try:
+                result = await attempt_fn()
+            except asyncio.CancelledError:
+                slot.release()
+                raise
+            except Exception as e:
+                slot.release()
+                retryable = _is_retryable(e)
+                if retryable:
+                    breaker.record_failure()
+                else:
+                    # Gemini answered (e.g. 400 for a bad request): the service itself is healthy
+                    breaker.record_success()
+                grant = None  # the breaker has its verdict; no probe left to hand back
+                if not retryable or retries >= LLM_MAX_RETRIES:
+                    timed_out = isinstance(e, (asyncio.TimeoutError, TimeoutError))
+                    _record(agent, "timeouts" if timed_out else "errors", time.perf_counter() - start, retries)
+                    if retryable:
+                        raise LLMUnavailable(f"Gemini call failed after {retries + 1} attempts: {e!r}") from e
+                    raise
+                retries += 1
+                print(f"🔁 LLM [{agent}] attempt {retries} failed ({e!r}); backing off.")
+                await asyncio.sleep(_backoff(retries))
+                continue
+            if not keep_slot:
+                slot.release()
+            breaker.record_success()
+            _record(agent, "ok", time.perf_counter() - start, retries)
+            return result
+    except asyncio.CancelledError:
+        # Client disconnects and superseded speculative calls land here; a cancelled
+        # half-open probe must not leave the breaker waiting for a verdict forever
+        if grant == "probe":
+            breaker.release_probe()
+        _record(agent, "cancelled", time.perf_counter() - start, retries)
+        raise
+
+def _json_config(response_schema):
+    from google.genai import types
+    return types.GenerateContentConfig(response_mime_type="application/json", response_schema=response_schema)
+
+async def generate(prompt, agent="default", response_schema=None):
+    """Returns the text of one Gemini completion; with `response_schema` it is JSON constrained to that schema."""
+    config = _json_config(response_schema) if response_schema else None
+
+    async def attempt():
+        response = await asyncio.wait_for(
+            get_client().aio.models.generate_content(model=MODEL_ID, contents=prompt, config=config), LLM_TIMEOUT_SECONDS
+        )
+        return response.text
+
+    return await _call_with_retries(agent, attempt)
+
+async def stream(prompt, agent="default"):
+    """
+    Yields Gemini text chunks as they are generated. Opening the stream is retried like
+    generate(); once text has been yielded, a failure is raised to the caller. The stream
+    holds its concurrency slot until it ends.
+    """
+    async def attempt():
+        chunks = await asyncio.wait_for(
+            get_client().aio.models.generate_content_stream(model=MODEL_ID, contents=prompt), LLM_TIMEOUT_SECONDS
+        )
+        iterator = chunks.__aiter__()
+        # The first chunk proves the stream is healthy; read it inside the retried section
+        try:
+            first = await asyncio.wait_for(iterator.__anext__(), LLM_TIMEOUT_SECONDS)
+        except StopAsyncIteration:
+            first = None
+        return first, iterator
+
+    first, iterator = await _call_with_retries(agent, attempt, keep_slot=True)
+    try:
+        if first is None:
+            return
+        if first.text:
+            yield first.text
+        while True:
+            try:
+                chunk = await asyncio.wait_for(iterator.__anext__(), LLM_TIMEOUT_SECONDS)
+            except StopAsyncIteration:
+                return
+            if chunk.text:
+                yield chunk.text
+    finally:
+        _semaphore().release()
+
+def generate_sync(prompt, agent="default"):
+    """Blocking variant for scripts; must not be called from a running event loop."""
+    return asyncio.run(generate(prompt, agent))
@@ -0,0 +1,230 @@
+"""
+Local T5 SQL model: loading and batched inference.
+Concurrent requests are coalesced by a scheduler thread into padded batches so
+the CPU runs one `generate` per batch instead of one per request.
+torch/transformers are imported and the weights loaded lazily (first use or
+warm_up()), so importing this module is cheap.
+"""
+import os
+import time
+import queue
+import asyncio
+import threading
+from concurrent.futures import Future
+
+LOCAL_MAX_LENGTH = 512
+# Scheduler knobs: how many prompts share a forward pass, and how long the first one waits for company
+LOCAL_BATCH_MAX_SIZE = int(os.getenv("LOCAL_BATCH_MAX_SIZE", "8"))
+LOCAL_BATCH_MAX_WAIT_MS = float(os.getenv("LOCAL_BATCH_MAX_WAIT_MS", "15"))
+LOCAL_QUEUE_MAX_SIZE = int(os.getenv("LOCAL_QUEUE_MAX_SIZE", "64"))
+
+# ============================================================================
+# LOCAL ML MODEL INITIALIZATION (Hybrid Search)
+# ============================================================================
+BACKEND_DIR = os.path.dirname(os.path.abspath(__file__))
+# torch: fp32 PyTorch | int8: dynamic int8 quantization of Linear layers | onnx: ONNX Runtime export (see export_model.py)
+LOCAL_MODEL_BACKEND = os.getenv("LOCAL_MODEL_BACKEND", "torch").lower()
+ONNX_MODEL_DIR = os.getenv("LOCAL_MODEL_ONNX_DIR", os.path.join(BACKEND_DIR, "fine_tuned_sql_model_onnx"))
+BACKENDS = ("torch", "int8", "onnx")
+
+def find_model_path():
+    # Check for both "fine_tuned" and "fine_tune" spellings
+    path_options = [
+        os.path.join(BACKEND_DIR, "fine_tuned_sql_model"),
+        os.path.join(BACKEND_DIR, "fine_tune_sql_model")
+    ]
+    for path in path_options:
+        if os.path.exists(path) and os.path.isdir(path):
+            return path
+    return None
+
+def load_model(backend, model_path):
+    """Returns (tokenizer, model) for the requested inference backend."""
+    import torch
+    from transformers import T5Tokenizer, T5ForConditionalGeneration
+
+    tokenizer = T5Tokenizer.from_pretrained(model_path)
+    if backend == "onnx":
+        # Optional dependency: pip install optimum[onnxruntime]
+        from optimum.onnxruntime import ORTModelForSeq2SeqLM
+        if not os.path.isdir(ONNX_MODEL_DIR):
+            raise FileNotFoundError(f"{ONNX_MODEL_DIR} not found. Run `python export_model.py onnx` first.")
+        # use_cache=True loads the decoder-with-past graph so each step reuses the KV cache
+        return tokenizer, ORTModelForSeq2SeqLM.from_pretrained(ONNX_MODEL_DIR, use_cache=True)
+
+    model = T5ForConditionalGeneration.from_pretrained(model_path)
+    model.eval()
+    if backend == "int8":
+        model = torch.ao.quantization.quantize_dynamic(model, {torch.nn.Linear}, dtype=torch.qint8)
+    elif backend != "torch":
+        raise ValueError(f"Unknown LOCAL_MODEL_BACKEND '{backend}'. Expected one of {BACKENDS}.")
+    return tokenizer, model
+
+# cold -> loading -> ready | unavailable (no model folder) | failed
+_model_status = "cold"
+_model_error = ""
+_model_lock = threading.Lock()
+local_tokenizer = None
+local_model = None
+
+def ensure_loaded():
+    """Loads the tokenizer and model once (thread-safe). Returns True if the model is usable."""
+    global _model_status, _model_error, local_tokenizer, local_model
+    if _model_status == "ready":
+        return True
+    with _model_lock:
+        if _model_status != "cold":
+            return _model_status == "ready"
+        _model_status = "loading"
+        try:
+            model_path = find_model_path()
+            if model_path:
+                print(f"🤖 Loading Local ML Model from: {os.path.basename(model_path)} (backend: {LOCAL_MODEL_BACKEND})...")
+                local_tokenizer, local_model = load_model(LOCAL_MODEL_BACKEND, model_path)
+                _model_status = "ready"
+                print("✅ Local Model Loaded and Ready.")
+            else:
+                _model_status = "unavailable"
+                print("ℹ️ Local ML model folder not found (Checked: fine_tuned_sql_model / fine_tune_sql_model). Using Gemini API.")
+        except Exception as e:
+            _model_status = "failed"
+            _model_error = str(e)
+            print(f"⚠️ Local model initialization skipped: {e}")
+    return _model_status == "ready"
+
+def is_available():
+    """True unless the model is known to be missing or broken (it may still be loading)."""
+    if _model_status == "cold":
+        return find_model_path() is not None
+    return _model_status in ("loading", "ready")
+
+def model_status():
+    return {"status": _model_status, "backend": LOCAL_MODEL_BACKEND, "error": _model_error}
+
+def _generate_loaded(texts):
+    if not ensure_loaded():
+        raise RuntimeError(f"Local model is {_model_status}.")
+    return generate_batch(texts)
+
+def generate_batch(texts, tokenizer=None, model=None):
+    """Runs one padded, batched greedy generate over `texts` (defaults to the loaded backend)."""
+    import torch
+
+    tokenizer = tokenizer or local_tokenizer
+    model = model or local_model
+    inputs = tokenizer(texts, return_tensors="pt", padding=True, max_length=LOCAL_MAX_LENGTH, truncation=True)
+    with torch.no_grad():
+        outputs = model.generate(**inputs, max_length=LOCAL_MAX_LENGTH)
+    return tokenizer.batch_decode(outputs, skip_special_tokens=True)
+
+# ============================================================================
+# BATCH SCHEDULER
+# ============================================================================
+class InferenceQueueFull(Exception):
+    """Raised when the inference queue is at capacity; callers should degrade instead of waiting."""
+
+class BatchScheduler:
+    """
+    Collects prompts for up to `max_wait_ms` (or until `max_batch_size` are waiting),
+    runs them through `run_batch` together and resolves each caller's Future.
+    """
+
+    def __init__(self, run_batch, max_batch_size=LOCAL_BATCH_MAX_SIZE,
+                 max_wait_ms=LOCAL_BATCH_MAX_WAIT_MS, max_queue=LOCAL_QUEUE_MAX_SIZE):
+        self.run_batch = run_batch
+        self.max_batch_size = max_batch_size
+        self.max_wait = max_wait_ms / 1000
+        self._queue = queue.Queue(maxsize=max_queue)
+        self._thread = None
+        self._start_lock = threading.Lock()
+        self._stats_lock = threading.Lock()
+        self._stats = {
+            "requests": 0,
+            "rejected": 0,
+            "batches": 0,
+            "batch_size_max": 0,
+            "queue_wait_seconds_total": 0.0,
+            "queue_wait_seconds_max": 0.0,
+            "inference_seconds_total": 0.0,
+        }
+
+    def _ensure_started(self):
+        if self._thread is None:
+            with self._start_lock:
+                if self._thread is None:
+                    self._thread = threading.Thread(target=self._loop, name="t5-batch-scheduler", daemon=True)
+                    self._thread.start()
+
+    def submit(self, text) -> Future:
+        """Queues one prompt. Raises InferenceQueueFull instead of blocking when saturated."""
+        self._ensure_started()
+        future = Future()
+        try:
+            self._queue.put_nowait((text, future, time.perf_counter()))
+        except queue.Full:
+            with self._stats_lock:
+                self._stats["rejected"] += 1
+            raise InferenceQueueFull(f"Local inference queue is full ({self._queue.maxsize} pending).")
+        return future
+
+    def _collect(self):
+        batch = [self._queue.get()]
+        deadline = time.perf_counter() + self.max_wait
+        while len(batch) < self.max_batch_size:
+            remaining = deadline - time.perf_counter()
+            if remaining <= 0:
+                break
+            try:
+                batch.append(self._queue.get(timeout=remaining))
+            except queue.Empty:
+                break
+        # Callers that gave up (cancelled futures) don't get a slot in the forward pass
+        return [item for item in batch if item[1].set_running_or_notify_cancel()]
+
+    def _loop(self):
+        while True:
+            batch = self._collect()
+            if not batch:
+                continue
+            started = time.perf_counter()
+            waits = [started - enqueued for _, _, enqueued in batch]
+            try:
+                outputs = self.run_batch([text for text, _, _ in batch])
+                for (_, future, _), output in zip(batch, outputs):
+                    future.set_result(output)
+            except Exception as e:
+                for _, future, _ in batch:
+                    future.set_exception(e)
+            with self._stats_lock:
+                self._stats["requests"] += len(batch)
+                self._stats["batches"] += 1
+                self._stats["batch_size_max"] = max(self._stats["batch_size_max"], len(batch))
+                self._stats["queue_wait_seconds_total"] += sum(waits)
+                self._stats["queue_wait_seconds_max"] = max(self._stats["queue_wait_seconds_max"], max(waits))
+                self._stats["inference_seconds_total"] += time.perf_counter() - started
+
+    def stats(self):
+        with self._stats_lock:
+            s = dict(self._stats)
+        return {
+            "requests": s["requests"],
+            "rejected": s["rejected"],
+            "batches": s["batches"],
+            "queue_depth": self._queue.qsize(),
+            "avg_batch_size": round(s["requests"] / s["batches"], 2) if s["batches"] else 0.0,
+            "max_batch_size": s["batch_size_max"],
+            "avg_queue_wait_ms": round(s["queue_wait_seconds_total"] / s["requests"] * 1000, 2) if s["requests"] else 0.0,
+            "max_queue_wait_ms": round(s["queue_wait_seconds_max"] * 1000, 2),
+            "avg_batch_inference_ms": round(s["inference_seconds_total"] / s["batches"] * 1000, 2) if s["batches"] else 0.0,
+        }
+
+scheduler = BatchScheduler(_generate_loaded)
+
+async def generate_sql_draft(input_text: str) -> str:
+    """Awaitable wrapper: queues the prompt on the batch scheduler without blocking the event loop."""
+    return await asyncio.wrap_future(scheduler.submit(input_text))
+
+def get_stats():
+    stats = scheduler.stats()
+    stats["model"] = model_status()
+    return stats
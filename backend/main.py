@@ -2,10 +2,15 @@
 from fastapi import FastAPI, UploadFile, File, Form, HTTPException, Depends
 from fastapi.middleware.cors import CORSMiddleware
 from fastapi.security import OAuth2PasswordBearer, OAuth2PasswordRequestForm
-import pandas as pd
-import io
+from fastapi.responses import StreamingResponse
+from fastapi.encoders import jsonable_encoder
+from fastapi.responses import JSONResponse
+from contextlib import asynccontextmanager
 import os
+import json
+import asyncio
 import sys
+import tempfile
 from pathlib import Path
 from typing import List, Annotated
 
@@ -15,9 +20,35 @@ sys.path.append(str(Path(__file__).parent))
 import database
 import auth
 import multi_agent
+import query_cache
+import ingest_jobs
+import result_export
+import sql_analyzer
+import llm_gateway
+import table_retriever
+import query_router
+import local_inference
 from models import User
 
-app = FastAPI(title="NL2SQL API")
+# Load the LLM client, agent graph and local model in the background at startup
+# instead of at import, so auth routes are served immediately.
+WARMUP_ON_STARTUP = os.getenv("WARMUP_ON_STARTUP", "true").lower() == "true"
+
+UPLOAD_SPOOL_CHUNK_BYTES = 1024 * 1024
+JOB_EVENTS_POLL_SECONDS = 0.5
+
+def _report_warmup(future):
+    if not future.cancelled() and future.exception():
+        print(f"⚠️ Warm-up failed: {future.exception()}")
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    if WARMUP_ON_STARTUP:
+        warmup = asyncio.get_running_loop().run_in_executor(None, multi_agent.warm_up)
+        warmup.add_done_callback(_report_warmup)
+    yield
+
+app = FastAPI(title="NL2SQL API", lifespan=lifespan)
 
 # Enable CORS for React frontend
 app.add_middleware(
@@ -30,14 +61,19 @@ app.add_middleware(
 
 oauth2_scheme = OAuth2PasswordBearer(tokenUrl="login")
 
+def _load_user(username):
+    db = database.get_db_session()
+    try:
+        return db.query(User).filter(User.username == username).first()
+    finally:
+        db.close()
+
 async def get_current_user(token: Annotated[str, Depends(oauth2_scheme)]):
     payload = auth.decode_token(token)
     if not payload:
         raise HTTPException(status_code=401, detail="Invalid session")
     username = payload.get("sub")
-    db = database.get_db_session()
-    user = db.query(User).filter(User.username == username).first()
-    db.close()
+    user = await asyncio.to_thread(_load_user, username)
     if not user:
         raise HTTPException(status_code=401, detail="User not found")
     return user
@@ -48,128 +84,259 @@ async def upload_file(
     table_name: str = Form(...),
     user: User = Depends(get_current_user)
 ):
+    if not file.filename.lower().endswith(('.csv', '.xlsx', '.xls')):
+        raise HTTPException(status_code=400, detail="Invalid file type")
+    # Spool the upload to disk in 1MB pieces; a background job then parses and COPYs it chunk by chunk
+    suffix = os.path.splitext(file.filename)[1]
+    tmp = tempfile.NamedTemporaryFile(suffix=suffix, delete=False)
     try:
-        content = await file.read()
-        if file.filename.endswith('.csv'):
-            df = pd.read_csv(io.BytesIO(content))
-        elif file.filename.endswith(('.xlsx', '.xls')):
-            df = pd.read_excel(io.BytesIO(content))
-        else:
-            raise HTTPException(status_code=400, detail="Invalid file type")
-        
-        success, message = database.ingest_dataframe(df, table_name, user.id, file.filename)
-        if not success:
-            raise HTTPException(status_code=500, detail=message)
-            
-        return {"message": message, "table_name": table_name}
+        with tmp:
+            while chunk := await file.read(UPLOAD_SPOOL_CHUNK_BYTES):
+                tmp.write(chunk)
+        job = ingest_jobs.submit(tmp.name, table_name, user.id, file.filename)
+    except ingest_jobs.TooManyJobs as e:
+        os.unlink(tmp.name)
+        raise HTTPException(status_code=429, detail=str(e))
     except Exception as e:
+        os.unlink(tmp.name)
         raise HTTPException(status_code=500, detail=str(e))
 
+    return JSONResponse(
+        {"message": f"Ingestion of '{table_name}' queued.", "table_name": table_name, "job_id": job.id},
+        status_code=202
+    )
+
+def _get_job_or_404(job_id, user):
+    job = ingest_jobs.get_job(job_id, user.id)
+    if job is None:
+        raise HTTPException(status_code=404, detail="Job not found")
+    return job
+
+@app.get("/jobs/{job_id}")
+async def get_job(job_id: str, user: User = Depends(get_current_user)):
+    """Status and progress of an ingestion job (bytes parsed, rows loaded, final row count)."""
+    return _get_job_or_404(job_id, user).to_dict()
+
+@app.get("/jobs/{job_id}/events")
+async def job_events(job_id: str, user: User = Depends(get_current_user)):
+    """Server-sent `progress` events whenever the job advances, then a final `done` event."""
+    job = _get_job_or_404(job_id, user)
+
+    async def event_stream():
+        last = None
+        while True:
+            snapshot = job.to_dict()
+            if job.done:
+                yield _sse("done", snapshot)
+                return
+            if snapshot != last:
+                yield _sse("progress", snapshot)
+                last = snapshot
+            await asyncio.sleep(JOB_EVENTS_POLL_SECONDS)
+
+    return StreamingResponse(
+        event_stream(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    )
+
+@app.delete("/jobs/{job_id}")
+async def cancel_job(job_id: str, user: User = Depends(get_current_user)):
+    """Cancels a queued or running ingestion job; a running load is rolled back after its current chunk."""
+    job = _get_job_or_404(job_id, user)
+    if not ingest_jobs.cancel(job):
+        raise HTTPException(status_code=409, detail=f"Job already {job.status}")
+    return job.to_dict()
+
 @app.get("/schema")
 async def get_schema(user: User = Depends(get_current_user)):
-    return {"schema": database.fetch_db_schema(user.id)}
+    return {"schema": await asyncio.to_thread(database.fetch_db_schema, user.id)}
+
+@app.get("/ready")
+async def ready():
+    """Readiness probe: 200 once the agents and local model are warm, 503 before."""
+    status = multi_agent.readiness()
+    return JSONResponse(status, status_code=200 if status["ready"] else 503)
+
+@app.get("/metrics")
+async def get_metrics():
+    """Operational counters for capacity planning."""
+    return {
+        "db_pool": database.get_pool_stats(),
+        "schema_cache": database.get_schema_cache_stats(),
+        "query_cache": query_cache.get_stats(),
+        "local_inference": local_inference.get_stats(),
+        "ingest_jobs": ingest_jobs.get_stats(),
+        "sql_analysis": sql_analyzer.get_stats(),
+        "agents": multi_agent.get_stats(),
+        "llm": llm_gateway.get_stats(),
+        "table_retriever": table_retriever.get_stats(),
+        "router": query_router.get_stats(),
+    }
 
 # ============================================================================
 # AUTH ENDPOINTS
 # ============================================================================
 
-@app.post("/signup")
-async def signup(username: str = Form(...), email: str = Form(...), password: str = Form(...)):
+def _create_user(username, email, password):
     db = database.get_db_session()
-    
-    # 1. Check if username exists
-    if db.query(User).filter(User.username == username).first():
-        db.close()
-        raise HTTPException(status_code=400, detail="Username is already taken")
-    
-    # 2. Check if email exists
-    if db.query(User).filter(User.email == email).first():
-        db.close()
-        raise HTTPException(status_code=400, detail="Email is already registered")
-    
     try:
-        hashed_pass = auth.get_password_hash(password)
-        new_user = User(username=username, email=email, hashed_password=hashed_pass)
-        db.add(new_user)
-        db.commit()
-        return {"message": "User created successfully"}
-    except Exception as e:
-        db.rollback()
-        raise HTTPException(status_code=500, detail=f"Database error: {str(e)}")
+        # 1. Check if username exists
+        if db.query(User).filter(User.username == username).first():
+            raise HTTPException(status_code=400, detail="Username is already taken")
+
+        # 2. Check if email exists
+        if db.query(User).filter(User.email == email).first():
+            raise HTTPException(status_code=400, detail="Email is already registered")
+
+        try:
+            hashed_pass = auth.get_password_hash(password)
+            new_user = User(username=username, email=email, hashed_password=hashed_pass)
+            db.add(new_user)
+            db.commit()
+        except Exception as e:
+            db.rollback()
+            raise HTTPException(status_code=500, detail=f"Database error: {str(e)}")
     finally:
         db.close()
 
+def _authenticate(username, password):
+    """The user if the password matches, else None (bcrypt is deliberately slow: keep it off the event loop)."""
+    user = _load_user(username)
+    if not user or not auth.verify_password(password, user.hashed_password):
+        return None
+    return user
+
+@app.post("/signup")
+async def signup(username: str = Form(...), email: str = Form(...), password: str = Form(...)):
+    await asyncio.to_thread(_create_user, username, email, password)
+    return {"message": "User created successfully"}
+
 @app.post("/login")
 async def login(form_data: Annotated[OAuth2PasswordRequestForm, Depends()]):
-    db = database.get_db_session()
-    user = db.query(User).filter(User.username == form_data.username).first()
-    if not user or not auth.verify_password(form_data.password, user.hashed_password):
-        db.close()
+    user = await asyncio.to_thread(_authenticate, form_data.username, form_data.password)
+    if not user:
         raise HTTPException(status_code=401, detail="Invalid username or password")
     
     access_token = auth.create_access_token(data={"sub": user.username})
-    db.close()
     return {"access_token": access_token, "token_type": "bearer"}
 
+AMBIGUOUS_ANSWER = "I found multiple potential data sources that could answer your request. Please select which one(s) you'd like me to analyze:"
+
+def _to_datasets(query_results):
+    """Converts executor result sets into lists of row dicts for the frontend."""
+    datasets = []
+    for res in query_results or []:
+        cols = res.get('columns', [])
+        rows = res.get('rows', [])
+        datasets.append([dict(zip(cols, row)) for row in rows])
+    return datasets
+
+def _dataset_info(query_results):
+    """Per result set: rows returned, total rows (if counted) and whether the row cap cut it short."""
+    return [{
+        "returned": len(res.get('rows', [])),
+        "total_count": res.get('total_count'),
+        "truncated": res.get('truncated', False),
+    } for res in query_results or []]
+
+def _build_chat_response(result):
+    if result.get('is_ambiguous'):
+        return {
+            "answer": AMBIGUOUS_ANSWER,
+            "is_ambiguous": True,
+            "potential_matches": result.get('potential_matches', [])
+        }
+
+    return {
+        "answer": result['final_answer'],
+        "sql": result.get('generated_sql'),
+        "data": _to_datasets(result.get('query_results')),
+        "data_info": _dataset_info(result.get('query_results')),
+        "plan": result.get('query_plan'),
+        "reflection": result.get('reflection_notes')
+    }
+
+def _load_schema(user_id):
+    """Returns (schema_text, schema_fingerprint) for the user's uploads."""
+    catalog = database.get_schema_catalog(user_id)
+    if catalog is None:
+        return "Could not connect to database.", None
+    return catalog["text"], catalog["fingerprint"]
+
 @app.post("/chat")
 async def chat(query: str = Form(...), user: User = Depends(get_current_user)):
     try:
         # 1. Fetch Schema for THIS user
-        schema = database.fetch_db_schema(user.id)
-        
-        # 2. Run the Multi-Agent System
-        result = multi_agent.run_multi_agent_query(query, schema, user.id)
+        schema, fingerprint = await asyncio.to_thread(_load_schema, user.id)
         
-        if result.get('is_ambiguous'):
-            return {
-                "answer": "I found multiple potential data sources that could answer your request. Please select which one(s) you'd like me to analyze:",
-                "is_ambiguous": True,
-                "potential_matches": result.get('potential_matches', [])
-            }
-
-        # Prepare datasets for frontend
-        datasets = []
-        for res in result.get('query_results', []):
-            cols = res.get('columns', [])
-            rows = res.get('rows', [])
-            datasets.append([dict(zip(cols, row)) for row in rows])
-
-        return {
-            "answer": result['final_answer'],
-            "sql": result.get('generated_sql'),
-            "data": datasets,
-            "plan": result.get('query_plan'),
-            "reflection": result.get('reflection_notes')
-        }
+        # 2. Run the Multi-Agent System (async end-to-end; blocking work runs in worker threads)
+        result = await multi_agent.run_multi_agent_query_async(query, schema, user.id, fingerprint)
+        return _build_chat_response(result)
     except Exception as e:
         import traceback
         print(traceback.format_exc())
         raise HTTPException(status_code=500, detail=str(e))
 
+def _sse(event, data):
+    return f"event: {event}\ndata: {json.dumps(jsonable_encoder(data))}\n\n"
+
+@app.post("/chat/stream")
+async def chat_stream(query: str = Form(...), user: User = Depends(get_current_user)):
+    """
+    Server-sent events variant of /chat. Emits one event per finished agent
+    (supervisor.target_tables, reasoning.generated_sql, reflection.notes, executor.rows),
+    formatter.final_answer deltas while the narrative is written, and a final `done`
+    event carrying the same payload /chat returns.
+    """
+    async def event_stream():
+        try:
+            schema, fingerprint = await asyncio.to_thread(_load_schema, user.id)
+            async for event, payload in multi_agent.stream_multi_agent_query(query, schema, user.id, fingerprint):
+                if event == "executor.rows":
+                    payload = {**payload, "results": _to_datasets(payload["results"]), "data_info": _dataset_info(payload["results"])}
+                elif event == "done":
+                    payload = _build_chat_response(payload)
+                yield _sse(event, payload)
+        except Exception as e:
+            import traceback
+            print(traceback.format_exc())
+            yield _sse("error", {"detail": str(e)})
+
+    return StreamingResponse(
+        event_stream(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    )
+
 @app.post("/export")
-async def export_data(sql: str = Form(...), user: User = Depends(get_current_user)):
+async def export_data(
+    sql: str = Form(...),
+    format: str = Form("csv"),
+    compress: bool = Form(False),
+    user: User = Depends(get_current_user)
+):
+    """
+    Streams the full result of `sql` as csv (COPY TO STDOUT), ndjson or parquet,
+    optionally gzip-compressed, without holding it in memory.
+    """
     try:
-        all_res, err = database.execute_query(sql)
-        if all_res is None:
-            raise HTTPException(status_code=400, detail=err)
-            
-        stream = io.StringIO()
-        if all_res:
-            for idx, res in enumerate(all_res):
-                df = pd.DataFrame(res['rows'], columns=res['columns'])
-                if idx > 0:
-                    stream.write("\n\n" + "-"*20 + f" NEXT DATASET " + "-"*20 + "\n\n")
-                df.to_csv(stream, index=False)
-        
-        from fastapi.responses import StreamingResponse
-        return StreamingResponse(
-            iter([stream.getvalue()]),
-            media_type="text/csv",
-            headers={"Content-Disposition": "attachment; filename=multi_query_results.csv"}
-        )
+        statements = await asyncio.to_thread(result_export.prepare_export, sql, user.id, format)
+    except result_export.ExportError as e:
+        raise HTTPException(status_code=400, detail=str(e))
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
+    media_type, extension = result_export.FORMATS[format]
+    filename = f"multi_query_results.{extension}"
+    if compress:
+        media_type, filename = "application/gzip", filename + ".gz"
+    return StreamingResponse(
+        result_export.iter_export(statements, format, compress),
+        media_type=media_type,
+        headers={"Content-Disposition": f"attachment; filename={filename}"}
+    )
+
 
 if __name__ == "__main__":
     import uvicorn
@@ -87,6 +87,9 @@ class DynamicTable(Base):
     columns_info = Column(Text, comment="JSON string describing column names and types")
     row_count = Column(Integer, comment="Number of rows in the table")
     uploaded_at = Column(DateTime, default=datetime.utcnow, comment="Upload timestamp")
+    schema_version = Column(Integer, nullable=False, default=1, server_default="1", comment="Bumped on every re-upload; lets workers detect stale schema caches")
+    index_info = Column(Text, comment="JSON record of ANALYZE, cardinality, indexes created and recommended by the index advisor")
+    column_stats = Column(Text, comment="JSON per-column null ratio, min/max, distinct count and top values, computed at upload")
     
     # Relationship
     owner = relationship("User")
@@ -95,3 +98,14 @@ class DynamicTable(Base):
         Index('idx_dynamic_table_name', 'table_name'),
         Index('idx_dynamic_table_user', 'user_id'),
     )
+
+class ScratchTable(Base):
+    """
+    Registry of internal staging/retired tables created by re-uploads.
+    Cleanup drops only what is listed here, so a user upload can never be mistaken for one.
+    """
+    __tablename__ = "scratch_tables"
+
+    name = Column(String, primary_key=True, comment="Name of the staging or retired table")
+    kind = Column(String, nullable=False, comment="staging: being loaded | retired: swapped out, awaiting drop")
+    created_at = Column(DateTime, default=datetime.utcnow, nullable=False, index=True, comment="When the table was created or retired")
@@ -7,51 +7,62 @@ HYBRID APPROACH: Local T5 Model (Primary) + Gemini 2.0 Flash (Expert Architect)
 import os
 import json
 import re
+import asyncio
+import threading
 from typing import TypedDict, List, Literal, Annotated
 from dotenv import load_dotenv
-from google import genai
-from langgraph.graph import StateGraph, END
 import database
 import agent_memory
-from transformers import T5Tokenizer, T5ForConditionalGeneration
-import torch
+import query_cache
+import local_inference
+import sql_validator
+import sql_analyzer
+import llm_gateway
+import table_retriever
+import query_router
 
 load_dotenv()
 
-# Initialize the Official Google GenAI Client
-client = genai.Client(api_key=os.getenv("GEMINI_API_KEY"))
-
-# Use the model that WE CONFIRMED worked in test_models.py
-MODEL_ID = "gemini-2.0-flash" 
-
-# ============================================================================
-# LOCAL ML MODEL INITIALIZATION (Hybrid Search)
-# ============================================================================
-LOCAL_MODEL_READY = False
-try:
-    current_dir = os.path.dirname(os.path.abspath(__file__))
-    # Check for both "fine_tuned" and "fine_tune" spellings
-    path_options = [
-        os.path.join(current_dir, "fine_tuned_sql_model"),
-        os.path.join(current_dir, "fine_tune_sql_model")
-    ]
-    
-    model_path = None
-    for path in path_options:
-        if os.path.exists(path) and os.path.isdir(path):
-            model_path = path
-            break
-            
-    if model_path:
-        print(f"🤖 Loading Local ML Model from: {os.path.basename(model_path)}...")
-        local_tokenizer = T5Tokenizer.from_pretrained(model_path)
-        local_model = T5ForConditionalGeneration.from_pretrained(model_path)
-        LOCAL_MODEL_READY = True
-        print("✅ Local Model Loaded and Ready.")
-    else:
-        print("ℹ️ Local ML model folder not found (Checked: fine_tuned_sql_model / fine_tune_sql_model). Using Gemini API.")
-except Exception as e:
-    print(f"⚠️ Local model initialization skipped: {e}")
+# The GenAI client (owned by llm_gateway) and the compiled graph are created on first use
+# (or by warm_up()), so importing this module stays cheap for workers that only serve auth/upload routes.
+_graph = None
+_init_lock = threading.Lock()
+
+# local: the SQL validator alone approves or rejects | hybrid: validator first, Gemini only when
+# it passes with doubts | llm: always ask Gemini (the original behaviour)
+REFLECTION_MODE = os.getenv("REFLECTION_MODE", "hybrid").lower()
+
+# graph: reasoning replies in LOGIC_PATH/SQL text and is audited by reflection | structured: one
+# JSON-schema call returns plan, SQL and a self-check; only the local validator reviews it
+GENERATION_MODE = os.getenv("GENERATION_MODE", "graph").lower()
+
+# Validate and run the local T5 draft while Gemini refines it; if Gemini keeps the draft, its results are
+# already in hand. With SPECULATIVE_TRUST_DRAFT a draft that validates and returns rows first answers outright.
+SPECULATIVE_DRAFT = os.getenv("SPECULATIVE_DRAFT", "false").lower() == "true"
+SPECULATIVE_TRUST_DRAFT = os.getenv("SPECULATIVE_TRUST_DRAFT", "false").lower() == "true"
+
+GENERATION_SCHEMA = {
+    "type": "OBJECT",
+    "properties": {
+        "plan": {"type": "STRING", "description": "Step-by-step logic"},
+        "sql": {"type": "STRING", "description": "One PostgreSQL query, no markdown"},
+        "self_check": {
+            "type": "OBJECT",
+            "properties": {
+                "tables_and_columns_verified": {"type": "BOOLEAN"},
+                "answers_question": {"type": "BOOLEAN"},
+                "concerns": {"type": "ARRAY", "items": {"type": "STRING"}},
+            },
+            "required": ["tables_and_columns_verified", "answers_question", "concerns"],
+        },
+    },
+    "required": ["plan", "sql", "self_check"],
+}
+
+# Process-wide counters for /metrics
+_stats = {"questions": 0, "llm_calls": 0, "supervisor_local": 0, "reflection_local": 0, "reflection_llm": 0,
+          "structured_rejected": 0, "self_check_revisions": 0, "speculative_runs": 0, "speculative_hits": 0, "speculative_trusted": 0,
+          "speculative_cancelled": 0}
 
 # ============================================================================
 # STATE DEFINITION
@@ -76,26 +87,98 @@ class MultiAgentState(TypedDict):
     potential_matches: List[str]
     user_id: int
     last_failed_sql: str  # For Error-Aware Retries
+    cost_report: dict  # EXPLAIN estimate of the last SQL the cost guard rejected (see database.execute_query)
+    stream_tokens: bool  # Formatter pushes answer tokens to the stream writer as they arrive
+    cache_hit: bool  # SQL came from query_cache; supervisor/reasoning/reflection were skipped
+    cached_answer: str  # Narrative reused from the cache when QUERY_CACHE_SKIP_FORMATTER is on
+    llm_calls: int  # Gemini calls spent on this question
+    self_check: dict  # The model's own verdict on its SQL (GENERATION_MODE=structured)
+    speculation: dict  # Validation and results of the local draft, computed while Gemini refined it
+
+# ============================================================================
+# NON-BLOCKING HELPERS
+# ============================================================================
+async def _generate_content(prompt: str, agent: str = "default", response_schema: dict = None) -> str:
+    """Calls Gemini through the gateway (rate limit, retries, circuit breaker) without blocking the event loop."""
+    return await llm_gateway.generate(prompt, agent, response_schema)
+
+def _count_llm_call(state: MultiAgentState):
+    state['llm_calls'] = state.get('llm_calls', 0) + 1
+    _stats["llm_calls"] += 1
+
+def get_stats():
+    questions = _stats["questions"]
+    return {**_stats, "reflection_mode": REFLECTION_MODE, "generation_mode": GENERATION_MODE, "speculative_draft": SPECULATIVE_DRAFT,
+            "llm_calls_per_question": round(_stats["llm_calls"] / questions, 2) if questions else 0.0}
+
+async def _stream_content(prompt: str, agent: str = "default"):
+    """Yields Gemini text chunks as they are generated."""
+    async for text in llm_gateway.stream(prompt, agent):
+        yield text
 
 # ============================================================================
 # AGENT 1: SUPERVISOR
 # ============================================================================
-def supervisor_agent(state: MultiAgentState) -> MultiAgentState:
+def _schema_for(tables: List[str], db_schema: str, catalog: dict = None) -> str:
+    """Schema text restricted to `tables` (rendered from the cached catalog when available)."""
+    if catalog:
+        wanted = {t.lower() for t in tables}
+        names = [t for t in catalog["tables"] if t.lower() in wanted]
+        return database.render_schema(catalog["tables"], names=names, header="RELEVANT SCHEMA SECTIONS:", stats=catalog.get("stats"))
+    filtered_schema = "RELEVANT SCHEMA SECTIONS:\n"
+    for t in tables:
+        # Extract the table block using regex
+        match = re.search(f"Table: {t}\n( - .*\n)+", db_schema, re.IGNORECASE)
+        if match:
+            filtered_schema += match.group(0) + "\n"
+    return filtered_schema
+
+def _tables_named_in(query: str, tables: List[str]) -> List[str]:
+    for table in tables:
+        if table.lower() in query.lower():
+            return [table]
+    return []
+
+async def supervisor_agent(state: MultiAgentState) -> MultiAgentState:
     print("🎯 SUPERVISOR: Analyzing query context (Semantic Search)...")
     
     if "No user-uploaded tables found" in state['db_schema']:
         state['final_answer'] = "Protocol Interrupted: No active knowledge base detected. Please upload data so I can initialize your neural data layer."
-        state['next_agent'] = END
+        state['next_agent'] = "END"
         return state
 
     # SEMANTIC PRE-FILTER: Extract all table names and their column headers
     user_tables = re.findall(r"Table:\s*(\w+)", state['db_schema'], re.IGNORECASE)
+    catalog = await asyncio.to_thread(database.get_schema_catalog, state['user_id']) if state.get('user_id') else None
+
+    # FAST PATH: the local router is sure enough (only table, table named outright, clear BM25 winner)
+    decision = query_router.route(state['user_query'], catalog) if catalog else None
+    if decision and query_router.should_skip_llm(decision):
+        print(f"⚡ SUPERVISOR: Routed locally to {decision.tables} ({decision.reason}, confidence {decision.confidence:.2f}).")
+        query_router.record(state['user_query'], decision, skipped=True)
+        _stats["supervisor_local"] += 1
+        state['target_tables'] = decision.tables
+        state['query_type'] = decision.query_type
+        state['is_ambiguous'] = False
+        state['db_schema'] = _schema_for(decision.tables, state['db_schema'], catalog)
+        state['next_agent'] = "reasoning"
+        return state
+
+    # LOCAL RETRIEVAL: with many uploads, only the best-matching tables go into the prompt
+    schema_details, available = state['db_schema'], user_tables
+    if catalog:
+        candidates = table_retriever.select_tables(catalog, state['user_query'])
+        if candidates and len(candidates) < len(catalog["tables"]):
+            print(f"🔎 SUPERVISOR: {len(candidates)} of {len(catalog['tables'])} tables retrieved locally.")
+            available = candidates
+            schema_details = database.render_schema(catalog["tables"], names=candidates,
+                                                    header="MOST RELEVANT TABLES (ranked locally):", stats=catalog.get("stats"))
     
     prompt = f"""You are a SQL Architect Supervisor.
 Analyze this request: "{state['user_query']}"
-AVAILABLE TABLES: {user_tables}
+AVAILABLE TABLES: {available}
 SCHEMA DETAILS:
-{state['db_schema']}
+{schema_details}
 
 TASK:
 1. Identify target tables.
@@ -113,41 +196,46 @@ Return JSON ONLY:
 """
     
     try:
-        response = client.models.generate_content(model=MODEL_ID, contents=prompt)
-        text = response.text
+        _count_llm_call(state)
+        text = await _generate_content(prompt, "supervisor")
         json_match = re.search(r'\{.*\}', text, re.DOTALL)
         data = json.loads(json_match.group(0)) if json_match else {"target_tables": [], "is_ambiguous": True}
         
         state['target_tables'] = data.get("target_tables", [])
         state['query_type'] = data.get("query_type", "single")
         state['is_ambiguous'] = data.get("is_ambiguous", False)
+        if decision:
+            query_router.record(state['user_query'], decision, skipped=False, llm_tables=state['target_tables'])
 
         # FALLBACK: If AI missed it but keywords match, force it
         if not state['target_tables']:
-            for table in user_tables:
-                if table.lower() in state['user_query'].lower():
-                    state['target_tables'] = [table]
-                    state['is_ambiguous'] = False
-                    break
-
-        if state['is_ambiguous'] and len(user_tables) > 1:
-            state['potential_matches'] = user_tables
+            state['target_tables'] = _tables_named_in(state['user_query'], user_tables)
+            if state['target_tables']:
+                state['is_ambiguous'] = False
+
+        if state['is_ambiguous'] and len(available) > 1:
+            state['potential_matches'] = available
             state['next_agent'] = "END"
             return state
 
         # ENHANCE SCHEMA: Strip irrelevant tables from schema to reduce noise (Semantic Schema Search)
         if state['target_tables']:
-            filtered_schema = "RELEVANT SCHEMA SECTIONS:\n"
-            for t in state['target_tables']:
-                # Extract the table block using regex
-                match = re.search(f"Table: {t}\n( - .*\n)+", state['db_schema'], re.IGNORECASE)
-                if match:
-                    filtered_schema += match.group(0) + "\n"
-            state['db_schema'] = filtered_schema
+            state['db_schema'] = _schema_for(state['target_tables'], state['db_schema'], catalog)
 
         state['next_agent'] = "reasoning"
     except Exception as e:
         print(f"⚠️ Supervisor Error: {e}")
+        # Gemini unavailable (or an unparseable reply): keep tables the question names outright,
+        # then the local router's best guess, else the locally retrieved ones
+        if decision and not state.get('target_tables'):
+            query_router.record(state['user_query'], decision, skipped=False)
+            state['target_tables'] = decision.tables
+            state['query_type'] = decision.query_type
+        state['target_tables'] = state.get('target_tables') or _tables_named_in(state['user_query'], user_tables)
+        if state['target_tables']:
+            state['db_schema'] = _schema_for(state['target_tables'], state['db_schema'], catalog)
+        elif available is not user_tables:
+            state['db_schema'] = schema_details
         state['next_agent'] = "reasoning"
     
     return state
@@ -155,23 +243,108 @@ Return JSON ONLY:
 # ============================================================================
 # AGENT 2: REASONING (Hybrid: Local + Gemini)
 # ============================================================================
-def reasoning_agent(state: MultiAgentState) -> MultiAgentState:
+def _cost_feedback(report: dict) -> str:
+    """Renders the cost guard's EXPLAIN estimate so the next draft can target the expensive plan nodes."""
+    hotspots = "\n".join(
+        f"- {n['node']}: ~{n['rows']:,} rows, cost {n['total_cost']:,.0f}" + (f" ⚠️ {n['warning']}" if n.get('warning') else "")
+        for n in report.get('hotspots', [])
+    )
+    return f"""
+COST GUARD ESTIMATE (EXPLAIN, not executed):
+Estimated cost: {report['estimated_cost']:,.0f} (limit {report['max_cost']:,.0f}), estimated rows: {report['estimated_rows']:,}
+Most expensive plan nodes:
+{hotspots}
+GUIDANCE: Produce a cheaper query that still answers the request: add the missing join condition, filter before joining, aggregate instead of returning raw rows, or add a LIMIT."""
+
+def _parse_generation(text: str) -> dict:
+    """Strictly parses a GENERATION_SCHEMA reply; raises ValueError on anything else."""
+    data = json.loads(text)
+    if not isinstance(data, dict) or not isinstance(data.get("plan"), str) or not isinstance(data.get("sql"), str):
+        raise ValueError("expected an object with string 'plan' and 'sql'")
+    check = data.get("self_check")
+    if (not isinstance(check, dict) or not isinstance(check.get("tables_and_columns_verified"), bool)
+            or not isinstance(check.get("answers_question"), bool) or not isinstance(check.get("concerns"), list)):
+        raise ValueError("malformed 'self_check'")
+    if not data["sql"].strip():
+        raise ValueError("empty 'sql'")
+    return data
+
+def _speculate(sql: str, user_id: int, cancel: database.QueryCancel) -> dict:
+    """
+    Validates the local draft (static checks + EXPLAIN) and, if it passes, runs it. Blocking; run in a thread.
+    `cancel` stops the run once Gemini has produced different SQL.
+    """
+    spec = {"sql": sql, "errors": [], "doubts": [], "results": None, "error": ""}
+    try:
+        report = sql_validator.validate(sql, user_id)
+        spec["errors"], spec["doubts"] = report.errors, report.doubts
+        if report.ok and not cancel.cancelled:
+            spec["results"], spec["error"] = database.execute_query(sql, user_id=user_id, cancel=cancel)
+    except Exception as e:
+        spec["error"] = str(e)
+    return spec
+
+def _trusted(spec: dict) -> bool:
+    # No doubts and at least one row: an empty result is too often a wrong filter to skip Gemini for
+    return (not spec["errors"] and not spec["doubts"] and spec["results"] is not None
+            and any(r.get("rows") for r in spec["results"]))
+
+def _matches(spec: dict, sql: str) -> bool:
+    """True when `sql` is the speculated draft, up to formatting and redundant quoting."""
+    return bool(spec) and sql_analyzer.equivalent(spec["sql"], sql)
+
+async def _await_refinement(call, speculation, state: MultiAgentState):
+    """
+    Awaits the Gemini reply. With SPECULATIVE_TRUST_DRAFT, a draft that validates and returns rows
+    before Gemini answers wins: the call is cancelled and None is returned. Only calls that
+    completed count towards the question's Gemini calls.
+    """
+    gemini = asyncio.ensure_future(call)
+    try:
+        if speculation is not None and SPECULATIVE_TRUST_DRAFT:
+            done, _ = await asyncio.wait({gemini, speculation}, return_when=asyncio.FIRST_COMPLETED)
+            if gemini not in done and _trusted(speculation.result()):
+                return None
+        return await gemini
+    finally:
+        if gemini.done():
+            if not gemini.cancelled():
+                _count_llm_call(state)
+        else:
+            gemini.cancel()
+
+def _use_local_draft(state: MultiAgentState, draft: str) -> MultiAgentState:
+    print("🛟 Gemini unavailable: continuing with the local model draft.")
+    state['generated_sql'] = draft
+    state['query_plan'] = "Local model draft (Gemini unavailable)."
+    state['self_check'] = None
+    state['next_agent'] = "reflection"
+    return state
+
+async def reasoning_agent(state: MultiAgentState) -> MultiAgentState:
     print("🧠 REASONING: Building query plan (Hybrid: Local ML + Gemini Expert)...")
     
     # --- PHASE 1: Invoke Local ML Model (The Specialist) ---
     local_draft_sql = ""
-    if LOCAL_MODEL_READY:
+    if local_inference.is_available():
         try:
             print("🤖 LOCAL ML: Generating initial SQL draft...")
             input_text = f"translate English to SQL: {state['user_query']} \n Context: {state['db_schema']}"
-            inputs = local_tokenizer(input_text, return_tensors="pt", max_length=512, truncation=True)
-            with torch.no_grad():
-                outputs = local_model.generate(**inputs, max_length=512)
-            local_draft_sql = local_tokenizer.decode(outputs[0], skip_special_tokens=True)
+            local_draft_sql = await local_inference.generate_sql_draft(input_text)
             print(f"🤖 LOCAL ML DRAFT: {local_draft_sql[:100]}...")
         except Exception as e:
             print(f"⚠️ Local Model Inference Error: {e}")
     
+    if local_draft_sql and llm_gateway.is_degraded():
+        # Circuit open: don't queue behind a failing Gemini, the local draft goes to validation as is
+        return _use_local_draft(state, local_draft_sql)
+
+    # SPECULATION: check and run the first draft while Gemini works on it (later rounds are fixing a failure)
+    speculation, speculation_cancel = None, database.QueryCancel()
+    if SPECULATIVE_DRAFT and local_draft_sql and state['iteration_count'] == 0 and state.get('user_id'):
+        _stats["speculative_runs"] += 1
+        speculation = asyncio.ensure_future(asyncio.to_thread(_speculate, local_draft_sql, state['user_id'], speculation_cancel))
+
     # --- PHASE 2: Gemini Refinement (The Expert Architect) ---
     error_feedback = ""
     if state['error_message']:
@@ -180,13 +353,25 @@ def reasoning_agent(state: MultiAgentState) -> MultiAgentState:
 SQL: {state.get('last_failed_sql', 'Unknown')}
 ERROR: {state['error_message']}
 GUIDANCE: Analyze why the previous SQL failed. Was it a missing column? A syntax error? Correct it now."""
+        if state.get('cost_report'):
+            error_feedback += _cost_feedback(state['cost_report'])
 
     local_model_context = f"\nLOCAL MODEL DRAFT: {local_draft_sql}" if local_draft_sql else ""
 
+    # Few-shot grounding: similar past questions and the SQL that fixed them
+    memory_examples = ""
+    try:
+        past = await asyncio.to_thread(agent_memory.get_relevant_memory, state['user_query'], state.get('user_id'))
+        if past:
+            examples = "\n".join(f"Q: {p['query']}\nSQL: {p['corrected_sql']}" for p in past)
+            memory_examples = f"\nPAST CORRECTIONS (similar questions and the SQL that worked):\n{examples}\n"
+    except Exception as e:
+        print(f"⚠️ Memory Lookup Error: {e}")
+
     prompt = f"""You are a Senior SQL Architect. 
 TASK: finalize the SQL query for this user request. 
 {local_model_context}
-
+{memory_examples}
 USER REQUEST: {state['user_query']}
 TARGET TABLES: {state.get('target_tables', [])}
 SCHEMA CONTEXT:
@@ -198,25 +383,74 @@ INSTRUCTIONS:
 2. If the draft is correct, finalize it. If it has errors (missing quotes, hallucinated columns), FIX IT.
 3. If no draft exists, generate the PostgreSQL query from scratch.
 4. Always use double quotes for identifiers (e.g. "Table"."Column").
+"""
+    if GENERATION_MODE == "structured":
+        prompt += """5. Before answering, check your SQL: every table and column exists in the SCHEMA CONTEXT and the query answers the request.
 
+Return JSON: plan (step-by-step logic), sql (the PostgreSQL query), self_check (tables_and_columns_verified, answers_question, concerns).
+"""
+    else:
+        prompt += """
 Format:
 LOGIC_PATH: [Step-by-step logic]
 SQL: [Your PostgreSQL Query]
 """
 
     try:
-        response = client.models.generate_content(model=MODEL_ID, contents=prompt)
-        content = response.text
-        
-        if "SQL:" in content:
-            state['query_plan'] = content.split("SQL:")[0].replace("LOGIC_PATH:", "").strip()
-            sql_block = content.split("SQL:")[1].strip()
-            state['generated_sql'] = re.sub(r'```sql\n?|```', '', sql_block).strip()
+        structured = GENERATION_MODE == "structured"
+        content = await _await_refinement(
+            _generate_content(prompt, "reasoning", GENERATION_SCHEMA if structured else None), speculation, state)
+        if content is None:
+            print("🏁 SPECULATION: Local draft validated and returned rows before Gemini answered; using it.")
+            _stats["speculative_trusted"] += 1
+            state['generated_sql'] = local_draft_sql
+            state['query_plan'] = "Local model draft (validated and run before Gemini answered)."
+            state['self_check'] = None
+            state['speculation'] = speculation.result()
+            state['next_agent'] = "reflection"
+            return state
+        if structured:
+            try:
+                data = _parse_generation(content)
+            except ValueError as e:
+                # No lenient fallback: a malformed reply is a failed attempt
+                _stats["structured_rejected"] += 1
+                speculation_cancel.cancel()
+                print(f"⚠️ Structured Output Rejected: {e}")
+                state['generated_sql'] = ""
+                state['error_message'] = f"Structured output rejected ({e}). Return exactly one JSON object matching the schema."
+                state['next_agent'] = "reflection"
+                return state
+            state['query_plan'] = data["plan"].strip()
+            state['generated_sql'] = data["sql"].strip()
+            state['self_check'] = data["self_check"]
         else:
-            state['generated_sql'] = content.strip()
+            if "SQL:" in content:
+                state['query_plan'] = content.split("SQL:")[0].replace("LOGIC_PATH:", "").strip()
+                sql_block = content.split("SQL:")[1].strip()
+                state['generated_sql'] = re.sub(r'```sql\n?|```', '', sql_block).strip()
+            else:
+                state['generated_sql'] = content.strip()
+
+        if speculation is not None and sql_analyzer.equivalent(state['generated_sql'], local_draft_sql):
+            # Gemini kept the draft: its validation and results are (nearly) in hand
+            state['speculation'] = await speculation
+        elif speculation is not None and not speculation.done():
+            # Gemini rewrote the draft: stop the draft's query rather than let it run for nothing
+            _stats["speculative_cancelled"] += 1
+            speculation_cancel.cancel()
             
+    except llm_gateway.LLMUnavailable as e:
+        print(f"⚠️ Reasoning Error: {e}")
+        if local_draft_sql:
+            state = _use_local_draft(state, local_draft_sql)
+            if speculation is not None:
+                state['speculation'] = await speculation
+            return state
+        state['error_message'] = f"Reasoning Error: {str(e)}"
     except Exception as e:
         print(f"⚠️ Reasoning Error: {e}")
+        speculation_cancel.cancel()
         state['error_message'] = f"Reasoning Error: {str(e)}"
     
     state['next_agent'] = "reflection"
@@ -225,12 +459,65 @@ SQL: [Your PostgreSQL Query]
 # ============================================================================
 # AGENT 3: REFLECTION
 # ============================================================================
-def reflection_agent(state: MultiAgentState) -> MultiAgentState:
+def _request_revision(state: MultiAgentState, critique: str):
+    if state['iteration_count'] < 3:
+        print("🔄 Reflection caught an error. Recycling to reasoning...")
+        state['iteration_count'] += 1
+        state['error_message'] = f"Reflection Critique: {critique}"
+        state['last_failed_sql'] = state['generated_sql']
+        state['next_agent'] = "reasoning"
+    else:
+        state['next_agent'] = "executor"
+
+def _speculative_report(state: MultiAgentState):
+    """The validation already done on the speculated draft, when the SQL under review is that draft."""
+    spec = state.get('speculation')
+    if not _matches(spec, state.get('generated_sql')):
+        return None
+    report = sql_validator.ValidationReport()
+    report.errors, report.doubts = list(spec["errors"]), list(spec["doubts"])
+    return report
+
+async def reflection_agent(state: MultiAgentState) -> MultiAgentState:
     print("🔍 REFLECTION: Schema-Obsessed Validation...")
     
     if not state.get('generated_sql'):
-        state['next_agent'] = "reasoning"
+        # Reasoning produced nothing (e.g. Gemini down, no local draft): retry a bounded number of times
+        if state['iteration_count'] < 3:
+            state['iteration_count'] += 1
+            state['next_agent'] = "reasoning"
+        else:
+            state['next_agent'] = "executor"
         return state
+
+    # Structured generation already carries the model's self-check: only the local validator reviews it
+    mode = "local" if GENERATION_MODE == "structured" else REFLECTION_MODE
+
+    # Local pass: identifiers, types and EXPLAIN are checked deterministically, no LLM needed
+    doubts = ""
+    if mode != "llm":
+        report = _speculative_report(state)
+        if report is None:
+            report = await asyncio.to_thread(sql_validator.validate, state['generated_sql'], state.get('user_id'))
+        if not report.ok or mode == "local" or not report.doubts:
+            _stats["reflection_local"] += 1
+            state['reflection_notes'] = report.critique()
+            check = state.get('self_check') or {}
+            concerns = check.get('concerns')
+            if concerns:
+                state['reflection_notes'] += "\nSELF-CHECK CONCERNS (model):\n" + "\n".join(f"- {c}" for c in concerns)
+            # The model's own "false" outweighs a clean local pass: names can check out and still miss the question
+            failed = [flag for flag in ("tables_and_columns_verified", "answers_question") if check.get(flag) is False]
+            if failed:
+                state['reflection_notes'] += "\nSELF-CHECK FAILED (model): " + ", ".join(failed)
+            if report.ok and not failed:
+                state['next_agent'] = "executor"
+            else:
+                if report.ok:
+                    _stats["self_check_revisions"] += 1
+                _request_revision(state, state['reflection_notes'])
+            return state
+        doubts = "\nLOCAL VALIDATOR DOUBTS (names and types already verified; judge these):\n" + "\n".join(f"- {d}" for d in report.doubts)
         
     prompt = f"""You are a Senior Database Auditor.
 TASK: Perform a strict validation of the generated SQL against the actual schema.
@@ -239,6 +526,7 @@ USER INTENT: {state['user_query']}
 SQL TO VERIFY: {state['generated_sql']}
 LEGAL SCHEMA:
 {state['db_schema']}
+{doubts}
 
 CRITICAL CHECKS:
 1. HALLUCINATION CHECK: Are ALL column names present in the LEGAl SCHEMA?
@@ -250,19 +538,17 @@ STATUS: APPROVED | NEEDS_REVISION
 CRITIQUE: If rejected, explain EXACTLY which column or table name is hallucinated or missing."""
 
     try:
-        response = client.models.generate_content(model=MODEL_ID, contents=prompt)
-        feedback = response.text
+        _stats["reflection_llm"] += 1
+        _count_llm_call(state)
+        feedback = await _generate_content(prompt, "reflection")
         state['reflection_notes'] = feedback
         
-        if "NEEDS_REVISION" in feedback and state['iteration_count'] < 3:
-            print("🔄 Reflection caught an error. Recycling to reasoning...")
-            state['iteration_count'] += 1
-            state['error_message'] = f"Reflection Critique: {feedback}"
-            state['last_failed_sql'] = state['generated_sql']
-            state['next_agent'] = "reasoning"
+        if "NEEDS_REVISION" in feedback:
+            _request_revision(state, feedback)
         else:
             state['next_agent'] = "executor"
     except Exception as e:
+        print(f"⚠️ Reflection Error: {e}")
         state['next_agent'] = "executor"
         
     return state
@@ -270,7 +556,7 @@ CRITIQUE: If rejected, explain EXACTLY which column or table name is hallucinate
 # ============================================================================
 # AGENT 4: EXECUTOR
 # ============================================================================
-def executor_agent(state: MultiAgentState) -> MultiAgentState:
+async def executor_agent(state: MultiAgentState) -> MultiAgentState:
     print(f"⚡ EXECUTOR: Running SQL [Attempt {state['iteration_count']+1}]...")
     
     sql = state.get('generated_sql', "").strip()
@@ -280,16 +566,33 @@ def executor_agent(state: MultiAgentState) -> MultiAgentState:
         return state
 
     try:
-        all_res, err = database.execute_query(sql, user_id=state.get('user_id'))
+        spec = state.get('speculation')
+        if _matches(spec, sql) and spec["results"] is not None:
+            print("⚡ EXECUTOR: Using results prefetched while Gemini refined the draft.")
+            _stats["speculative_hits"] += 1
+            all_res, err = spec["results"], ""
+        else:
+            all_res, err = await asyncio.to_thread(database.execute_query, sql, user_id=state.get('user_id'))
         if all_res is not None:
             # all_res is now a list of {"columns": [], "rows": []}
+            if state.get('last_failed_sql') and state['iteration_count'] > 0:
+                # Self-healed: remember the fix so similar questions get it as a few-shot example
+                try:
+                    await asyncio.to_thread(agent_memory.add_correction, state['user_query'], state['last_failed_sql'], state['error_message'], sql, state.get('user_id'))
+                except Exception as e:
+                    print(f"⚠️ Memory Write Error: {e}")
             state['query_results'] = all_res
             state['error_message'] = ""
+            state['cost_report'] = None
             state['next_agent'] = "formatter"
+            if state.get('cached_answer'):
+                state['final_answer'] = state['cached_answer']
+                state['next_agent'] = "END"
         else:
             # Error feedback loop
             state['error_message'] = err
             state['last_failed_sql'] = sql
+            state['cost_report'] = getattr(err, 'report', None)
             if state['iteration_count'] < 3:
                 print(f"❌ Execution failed. Providing feedback for retry.")
                 state['iteration_count'] += 1
@@ -305,7 +608,7 @@ def executor_agent(state: MultiAgentState) -> MultiAgentState:
 # ============================================================================
 # AGENT 5: FORMATTER
 # ============================================================================
-def formatter_agent(state: MultiAgentState) -> MultiAgentState:
+async def formatter_agent(state: MultiAgentState) -> MultiAgentState:
     print("📝 FORMATTER: Analytical Storytelling...")
     
     if state['error_message'] and not state['query_results']:
@@ -321,6 +624,10 @@ def formatter_agent(state: MultiAgentState) -> MultiAgentState:
         rows = res.get('rows', [])[:50] # Limit sample per set
         data_sample = [dict(zip(cols, r)) for r in rows]
         full_context += f"\nDATASET {idx+1} (Raw Context):\n{str(data_sample)}\n"
+        if res.get('truncated'):
+            # Only the first QUERY_ROW_CAP rows were fetched; don't let the narrative present them as the whole result
+            total = res.get('total_count')
+            full_context += f"(Partial result: {len(res.get('rows', []))} of {total if total is not None else 'more'} rows were retrieved.)\n"
 
     prompt = f"""You are a Pro Data Analyst. 
 The user asked: {state['user_query']}
@@ -340,8 +647,17 @@ I have cross-referenced the selected tables to find current trends. The data rev
 - Additionally, the correlation between..."""
 
     try:
-        response = client.models.generate_content(model=MODEL_ID, contents=prompt)
-        state['final_answer'] = response.text
+        _count_llm_call(state)
+        if state.get('stream_tokens'):
+            from langgraph.config import get_stream_writer
+            writer = get_stream_writer()
+            parts = []
+            async for delta in _stream_content(prompt, "formatter"):
+                parts.append(delta)
+                writer({"event": "formatter.final_answer", "delta": delta})
+            state['final_answer'] = "".join(parts)
+        else:
+            state['final_answer'] = await _generate_content(prompt, "formatter")
     except Exception as e:
         state['final_answer'] = f"Reasoning: {state['query_plan']}\n\nNote: Data formatting failed but datasets are available below."
     
@@ -355,6 +671,8 @@ def route_next(state: MultiAgentState):
     return state.get('next_agent', 'END')
 
 def create_multi_agent_graph():
+    from langgraph.graph import StateGraph, END
+
     workflow = StateGraph(MultiAgentState)
     
     workflow.add_node("supervisor", supervisor_agent)
@@ -363,7 +681,8 @@ def create_multi_agent_graph():
     workflow.add_node("executor", executor_agent)
     workflow.add_node("formatter", formatter_agent)
     
-    workflow.set_entry_point("supervisor")
+    # Cache hits enter directly at the executor
+    workflow.set_conditional_entry_point(route_next, {"supervisor": "supervisor", "executor": "executor"})
     
     workflow.add_conditional_edges("supervisor", route_next, {"reasoning": "reasoning", "END": END})
     workflow.add_conditional_edges("reasoning", route_next, {"reflection": "reflection", "END": END})
@@ -373,11 +692,33 @@ def create_multi_agent_graph():
     
     return workflow.compile()
 
-app = create_multi_agent_graph()
+def get_app():
+    """Returns the compiled LangGraph app, compiling it once."""
+    global _graph
+    if _graph is None:
+        with _init_lock:
+            if _graph is None:
+                _graph = create_multi_agent_graph()
+    return _graph
+
+def warm_up():
+    """Creates the LLM client, compiles the graph and loads the local model. Safe to call repeatedly."""
+    llm_gateway.get_client()
+    get_app()
+    local_inference.ensure_loaded()
+
+def readiness():
+    model = local_inference.model_status()
+    return {
+        "llm_client": llm_gateway.is_ready(),
+        "graph": _graph is not None,
+        "local_model": model,
+        # A missing/broken local model is not fatal: the agents fall back to Gemini alone
+        "ready": llm_gateway.is_ready() and _graph is not None and model["status"] in ("ready", "unavailable", "failed"),
+    }
 
-def run_multi_agent_query(query: str, schema: str, user_id: int = None) -> dict:
-    """Entry point to run the langgraph agent system"""
-    initial_state: MultiAgentState = {
+def _initial_state(query: str, schema: str, user_id: int = None) -> MultiAgentState:
+    return {
         "user_query": query,
         "db_schema": schema,
         "available_tables": [],
@@ -395,6 +736,114 @@ def run_multi_agent_query(query: str, schema: str, user_id: int = None) -> dict:
         "is_ambiguous": False,
         "potential_matches": [],
         "user_id": user_id,
-        "last_failed_sql": ""
+        "last_failed_sql": "",
+        "cost_report": None,
+        "stream_tokens": False,
+        "cache_hit": False,
+        "cached_answer": "",
+        "llm_calls": 0,
+        "self_check": None,
+        "speculation": None
     }
-    return app.invoke(initial_state)
+
+def _prepare_state(query: str, schema: str, user_id: int = None, schema_fingerprint: str = None):
+    """Builds the initial state, short-circuiting to the executor on a query cache hit."""
+    state = _initial_state(query, schema, user_id)
+    _stats["questions"] += 1
+    if not query_cache.QUERY_CACHE_ENABLED or user_id is None:
+        return state, None
+
+    cache_key = query_cache.make_key(user_id, query, schema_fingerprint or query_cache.schema_fingerprint(schema))
+    cached = query_cache.lookup(cache_key)
+    if cached:
+        print("💾 QUERY CACHE: Hit, skipping straight to executor.")
+        state.update({
+            "generated_sql": cached["generated_sql"],
+            "query_plan": cached["query_plan"],
+            "target_tables": cached["target_tables"],
+            "query_type": cached["query_type"],
+            "cache_hit": True,
+            "next_agent": "executor",
+        })
+        if query_cache.QUERY_CACHE_SKIP_FORMATTER:
+            state["cached_answer"] = cached["final_answer"]
+    return state, cache_key
+
+def _remember(cache_key, result: dict):
+    """Stores successful runs in the query cache and drops entries whose SQL stopped working."""
+    if cache_key is None:
+        return
+    succeeded = (
+        not result.get('error_message')
+        and not result.get('is_ambiguous')
+        and result.get('generated_sql')
+        and result.get('query_results') is not None
+    )
+    if result.get('cache_hit'):
+        if not succeeded or result.get('iteration_count', 0) > 0:
+            query_cache.evict(cache_key)
+    if succeeded and (not result.get('cache_hit') or result.get('iteration_count', 0) > 0):
+        query_cache.store(cache_key, result)
+
+async def run_multi_agent_query_async(query: str, schema: str, user_id: int = None, schema_fingerprint: str = None) -> dict:
+    """Entry point to run the langgraph agent system without blocking the event loop"""
+    initial_state, cache_key = _prepare_state(query, schema, user_id, schema_fingerprint)
+    result = await get_app().ainvoke(initial_state)
+    _remember(cache_key, result)
+    return result
+
+def _node_event(node: str, state: dict):
+    """Maps a finished LangGraph node to the progress event the UI cares about."""
+    if node == "supervisor":
+        return "supervisor.target_tables", {
+            "target_tables": state.get('target_tables', []),
+            "query_type": state.get('query_type'),
+            "is_ambiguous": state.get('is_ambiguous', False),
+            "potential_matches": state.get('potential_matches', []),
+        }
+    if node == "reasoning":
+        return "reasoning.generated_sql", {
+            "sql": state.get('generated_sql'),
+            "plan": state.get('query_plan'),
+            "iteration": state.get('iteration_count', 0),
+        }
+    if node == "reflection":
+        return "reflection.notes", {
+            "approved": state.get('next_agent') == "executor",
+            "notes": state.get('reflection_notes'),
+        }
+    if node == "executor":
+        return "executor.rows", {
+            "results": state.get('query_results', []),
+            "error": state.get('error_message', ""),
+            "retrying": state.get('next_agent') == "reasoning",
+        }
+    if node == "formatter":
+        return "formatter.done", {"final_answer": state.get('final_answer')}
+    return f"{node}.done", {}
+
+async def stream_multi_agent_query(query: str, schema: str, user_id: int = None, schema_fingerprint: str = None):
+    """
+    Runs the agent graph and yields (event_name, payload) as each node finishes,
+    followed by the formatter's answer tokens and a final ("done", final_state).
+    """
+    initial_state, cache_key = _prepare_state(query, schema, user_id, schema_fingerprint)
+    initial_state["stream_tokens"] = True
+    final_state = dict(initial_state)
+
+    async for mode, chunk in get_app().astream(initial_state, stream_mode=["updates", "custom"]):
+        if mode == "custom":
+            yield chunk["event"], {"delta": chunk["delta"]}
+            continue
+        for node, update in chunk.items():
+            if not update:
+                continue
+            final_state.update(update)
+            yield _node_event(node, final_state)
+
+    _remember(cache_key, final_state)
+    yield "done", final_state
+
+def run_multi_agent_query(query: str, schema: str, user_id: int = None) -> dict:
+    """Synchronous entry point for scripts (the API uses run_multi_agent_query_async)"""
+    return asyncio.run(run_multi_agent_query_async(query, schema, user_id))
@@ -0,0 +1,125 @@
+"""
+NL->SQL result cache.
+Keyed by (user_id, normalized question, schema fingerprint). A hit hands the
+validated SQL and plan straight to the executor, skipping supervisor, reasoning
+and reflection (and optionally the formatter).
+"""
+import os
+import re
+import hashlib
+import threading
+from cache import LRUCache
+from vector_index import VectorIndex
+
+QUERY_CACHE_ENABLED = os.getenv("QUERY_CACHE_ENABLED", "true").lower() == "true"
+QUERY_CACHE_MAX_ENTRIES = int(os.getenv("QUERY_CACHE_MAX_ENTRIES", "2048"))
+QUERY_CACHE_TTL = float(os.getenv("QUERY_CACHE_TTL", "86400"))
+# Reuse the previous narrative too. Only safe because uploads invalidate the cache.
+QUERY_CACHE_SKIP_FORMATTER = os.getenv("QUERY_CACHE_SKIP_FORMATTER", "false").lower() == "true"
+# Cosine similarity above which a rephrased question reuses a cached answer. 0 (the default) keeps
+# exact matching only; near matches must also agree on every number and negation.
+QUERY_CACHE_SIMILARITY = float(os.getenv("QUERY_CACHE_SIMILARITY", "0"))
+
+# (user_id, fingerprint) -> {"index": VectorIndex, "keys": {id: cache key}, "next_id": int}
+_question_indexes = LRUCache(max_entries=QUERY_CACHE_MAX_ENTRIES)
+_index_lock = threading.Lock()
+_approximate_hits = 0
+
+_PUNCTUATION = re.compile(r"[^\w\s]")
+# Words that change the answer while barely moving the similarity: "2023" vs "2024", "5" vs "50", "not"
+_LITERAL_TOKENS = re.compile(r"\d+(?:\s\d+)?|\b(?:not|no|never|none|nor|without|except|excluding)\b|\b\w+n t\b")
+_WHITESPACE = re.compile(r"\s+")
+
+def normalize_question(question: str) -> str:
+    """'Total revenue, by month?' and 'total  revenue by month' map to the same key."""
+    text = _PUNCTUATION.sub(" ", question.lower())
+    return _WHITESPACE.sub(" ", text).strip()
+
+def schema_fingerprint(schema_text: str) -> str:
+    return hashlib.sha1(schema_text.encode("utf-8")).hexdigest()
+
+def make_key(user_id, question: str, fingerprint: str):
+    return (user_id, normalize_question(question), fingerprint)
+
+def lookup(key):
+    """
+    Returns the cached entry ({generated_sql, query_plan, target_tables, query_type, final_answer}) or None.
+    Falls back to the closest previously answered question for the same user and schema.
+    """
+    global _approximate_hits
+    entry = _cache.get(key)
+    if entry is not None or QUERY_CACHE_SIMILARITY <= 0:
+        return entry
+
+    scope = _question_indexes.get(key[:1] + key[2:])
+    if scope is None:
+        return None
+    matches = scope["index"].search(key[1], k=1, min_score=QUERY_CACHE_SIMILARITY)
+    if not matches:
+        return None
+    match_key = scope["keys"].get(matches[0][0])
+    if match_key is None or _literal_tokens(match_key[1]) != _literal_tokens(key[1]):
+        return None
+    entry = _cache.get(match_key)
+    if entry is not None:
+        _approximate_hits += 1
+    return entry
+
+def _literal_tokens(question):
+    return sorted(_LITERAL_TOKENS.findall(question))
+
+def _index_question(key):
+    scope_key = key[:1] + key[2:]
+    with _index_lock:
+        scope = _question_indexes.get(scope_key)
+        if scope is None:
+            scope = {"index": VectorIndex(), "keys": {}, "next_id": 1}
+            _question_indexes.set(scope_key, scope)
+        if key in scope["keys"].values():
+            return
+        new_id = scope["next_id"]
+        scope["next_id"] += 1
+        scope["keys"][new_id] = key
+        scope["index"].add([new_id], [key[1]])
+
+def _unindex_question(key, value=None):
+    """Keeps the question index in step with the cache: evicted or expired entries stop matching."""
+    with _index_lock:
+        scope = _question_indexes.get(key[:1] + key[2:])
+        if scope is None:
+            return
+        doomed = [i for i, k in scope["keys"].items() if k == key]
+        if not doomed:
+            return
+        for i in doomed:
+            del scope["keys"][i]
+        scope["index"].keep_only(scope["keys"].keys())
+
+_cache = LRUCache(max_entries=QUERY_CACHE_MAX_ENTRIES, ttl=QUERY_CACHE_TTL, on_evict=_unindex_question)
+
+def store(key, state):
+    _cache.set(key, {
+        "generated_sql": state.get("generated_sql", ""),
+        "query_plan": state.get("query_plan", ""),
+        "target_tables": list(state.get("target_tables") or []),
+        "query_type": state.get("query_type", "single"),
+        "final_answer": state.get("final_answer", ""),
+    })
+    if QUERY_CACHE_SIMILARITY > 0:
+        _index_question(key)
+
+def evict(key):
+    _cache.pop(key)
+    _unindex_question(key)
+
+def invalidate_user(user_id):
+    """Drops every cached question for a user; called when one of their tables is (re)loaded."""
+    _question_indexes.invalidate_where(lambda scope_key: scope_key[0] == user_id)
+    return _cache.invalidate_where(lambda key: key[0] == user_id)
+
+def get_stats():
+    stats = _cache.stats()
+    stats["enabled"] = QUERY_CACHE_ENABLED
+    stats["skip_formatter"] = QUERY_CACHE_SKIP_FORMATTER
+    stats["approximate_hits"] = _approximate_hits
+    return stats
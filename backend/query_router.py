@@ -0,0 +1,125 @@
+"""
+Local routing ahead of the supervisor.
+Picks target tables and a query type from the cached schema catalog and says how
+sure it is: the user's only table, tables the question names outright, or a
+clear BM25 winner from table_retriever. When the confidence reaches
+ROUTER_CONFIDENCE_THRESHOLD the supervisor skips its Gemini call. Every decision
+is logged (with whether Gemini agreed, when it was asked) so the threshold can be tuned.
+"""
+import os
+import re
+import time
+import threading
+from collections import deque
+import table_retriever
+
+ROUTER_FAST_PATH_ENABLED = os.getenv("ROUTER_FAST_PATH_ENABLED", "true").lower() == "true"
+ROUTER_CONFIDENCE_THRESHOLD = float(os.getenv("ROUTER_CONFIDENCE_THRESHOLD", "0.9"))
+ROUTER_LOG_SIZE = int(os.getenv("ROUTER_LOG_SIZE", "200"))
+
+# Confidence per kind of evidence; a BM25 ranking scores at most RANKED_MAX, scaled by its margin
+ONLY_TABLE, NAMED_ONE, NAMED_SEVERAL, RANKED_MAX = 1.0, 0.95, 0.85, 0.9
+
+_AGGREGATION_WORDS = frozenset(
+    "average avg count sum total mean median max maximum min minimum most least top highest lowest "
+    "number many much per by group distribution share percentage".split()
+)
+
+class RouteDecision:
+    """Tables the router would target, the query type, a confidence in [0, 1] and why."""
+
+    def __init__(self, tables, query_type, confidence, reason):
+        self.tables = tables
+        self.query_type = query_type
+        self.confidence = confidence
+        self.reason = reason
+
+    def as_dict(self):
+        return {"tables": self.tables, "query_type": self.query_type,
+                "confidence": round(self.confidence, 3), "reason": self.reason}
+
+def route(question, catalog):
+    """Routes `question` against a schema catalog ({"tables": ..., "stats": ..., "fingerprint": ...})."""
+    names = list(catalog["tables"])
+    if not names:
+        return RouteDecision([], "single", 0.0, "no tables")
+    if len(names) == 1:
+        return RouteDecision(names, _query_type(question, names), ONLY_TABLE, "only table")
+
+    named = _named_tables(question, names)
+    if named:
+        confidence = NAMED_ONE if len(named) == 1 else NAMED_SEVERAL
+        return RouteDecision(named, _query_type(question, named), confidence, "named in question")
+
+    ranked = table_retriever.get_index(catalog).rank(question)
+    if not ranked:
+        return RouteDecision([], "single", 0.0, "no matching terms")
+    best = ranked[0][1]
+    runner_up = ranked[1][1] if len(ranked) > 1 else 0.0
+    confidence = RANKED_MAX * (1 - runner_up / best)
+    return RouteDecision([ranked[0][0]], _query_type(question, [ranked[0][0]]), confidence,
+                         f"BM25 margin {best:.2f} vs {runner_up:.2f}")
+
+def should_skip_llm(decision):
+    return ROUTER_FAST_PATH_ENABLED and bool(decision.tables) and decision.confidence >= ROUTER_CONFIDENCE_THRESHOLD
+
+def _named_tables(question, names):
+    """Tables whose name words all occur in the question, dropping names contained in a more specific match."""
+    words = set(table_retriever.tokenize(question))
+    lowered = question.lower()
+    named = {}
+    for name in names:
+        tokens = set(table_retriever.tokenize(name))
+        if re.search(rf"\b{re.escape(name.lower())}\b", lowered) or (tokens and tokens <= words):
+            named[name] = tokens
+    return [n for n, tokens in named.items() if not any(tokens < other for other in named.values())]
+
+def _query_type(question, tables):
+    if len(tables) > 1:
+        return "join"
+    return "aggregation" if set(re.findall(r"[a-z]+", question.lower())) & _AGGREGATION_WORDS else "single"
+
+# ============================================================================
+# DECISION LOG
+# ============================================================================
+_lock = threading.Lock()
+_log = deque(maxlen=ROUTER_LOG_SIZE)
+_counts = {"decisions": 0, "skipped": 0, "llm_compared": 0, "llm_agreed": 0}
+
+def record(question, decision, skipped, llm_tables=None):
+    """Logs one routing decision; `llm_tables` is what Gemini picked when it was asked anyway."""
+    entry = {"at": time.time(), "question": question[:200], **decision.as_dict(), "skipped_llm": skipped}
+    with _lock:
+        _counts["decisions"] += 1
+        _counts["skipped"] += skipped
+        if llm_tables is not None and decision.tables:
+            agreed = {t.lower() for t in llm_tables} == {t.lower() for t in decision.tables}
+            entry["llm_tables"] = list(llm_tables)
+            entry["llm_agreed"] = agreed
+            _counts["llm_compared"] += 1
+            _counts["llm_agreed"] += agreed
+        _log.append(entry)
+
+def get_stats():
+    """Counters plus, per confidence band of the recent decisions, how often Gemini agreed (no question text)."""
+    with _lock:
+        counts = dict(_counts)
+        recent = list(_log)
+    bands = {}
+    for entry in recent:
+        low = min(int(entry["confidence"] * 10), 9) / 10
+        band = bands.setdefault(f"{low:.1f}-{low + 0.1:.1f}", {"decisions": 0, "skipped": 0, "llm_compared": 0, "llm_agreed": 0})
+        band["decisions"] += 1
+        band["skipped"] += entry["skipped_llm"]
+        if "llm_agreed" in entry:
+            band["llm_compared"] += 1
+            band["llm_agreed"] += entry["llm_agreed"]
+    return {
+        **counts,
+        "enabled": ROUTER_FAST_PATH_ENABLED,
+        "threshold": ROUTER_CONFIDENCE_THRESHOLD,
+        "skip_rate": round(counts["skipped"] / counts["decisions"], 3) if counts["decisions"] else 0.0,
+        # How often Gemini picked the same tables when the router was not confident enough to skip it
+        "llm_agreement": round(counts["llm_agreed"] / counts["llm_compared"], 3) if counts["llm_compared"] else None,
+        "recent_by_confidence": dict(sorted(bands.items())),
+    }
@@ -0,0 +1,261 @@
+"""
+Streaming export of query results.
+CSV goes through `COPY (query) TO STDOUT`, NDJSON and Parquet through a named
+(server-side) cursor read in batches; either way rows are yielded as they
+arrive, so memory stays constant whatever the result size. Output can be
+gzip-compressed on the fly. Exports run read-only under EXPORT_STATEMENT_TIMEOUT_MS.
+"""
+import os
+import json
+import uuid
+import zlib
+import queue
+import threading
+import database
+import sql_analyzer
+
+EXPORT_FETCH_BATCH = int(os.getenv("EXPORT_FETCH_BATCH", "5000"))
+# COPY output is handed over in pieces of about this size
+EXPORT_CHUNK_BYTES = 64 * 1024
+FORMATS = {
+    "csv": ("text/csv", "csv"),
+    "ndjson": ("application/x-ndjson", "ndjson"),
+    "parquet": ("application/vnd.apache.parquet", "parquet"),
+}
+CSV_DATASET_SEPARATOR = "\n\n" + "-" * 20 + " NEXT DATASET " + "-" * 20 + "\n\n"
+
+class ExportError(Exception):
+    """The export cannot be produced (bad format, non-SELECT statement, missing optional dependency)."""
+
+def prepare_export(sql_query, user_id, fmt):
+    """
+    Validates the request before any bytes are sent. Returns the statements to export, re-rendered
+    from their parsed ASTs: the raw text is never spliced into COPY (...), so a stray ")" cannot
+    escape the wrapper.
+    """
+    if fmt not in FORMATS:
+        raise ExportError(f"Unsupported format '{fmt}'. Expected one of: {', '.join(FORMATS)}.")
+    _, err = database.check_table_access(sql_query, user_id)
+    if err:
+        raise ExportError(err)
+    analysis = sql_analyzer.analyze(sql_query)
+    if not analysis.statements:
+        raise ExportError("Nothing to export.")
+    if not analysis.parsed:
+        raise ExportError(f"Only queries that parse as plain SELECTs can be exported ({analysis.error or 'parser unavailable'}).")
+    statements = []
+    for expression in analysis.expressions:
+        if not sql_analyzer.is_plain_select(expression):
+            raise ExportError("Only SELECT queries can be exported.")
+        statements.append(expression.sql(dialect=sql_analyzer.DIALECT))
+    if fmt == "parquet":
+        if len(statements) > 1:
+            raise ExportError("Parquet export supports a single SELECT statement.")
+        try:
+            import pyarrow  # noqa: F401
+        except ImportError:
+            raise ExportError("Parquet export needs pyarrow (pip install pyarrow).")
+    return statements
+
+def iter_export(statements, fmt, compress=False):
+    """Yields the encoded export chunk by chunk (optionally gzip-compressed)."""
+    chunks = {"csv": _iter_csv, "ndjson": _iter_ndjson, "parquet": _iter_parquet}[fmt](statements)
+    return _gzip(chunks) if compress else chunks
+
+def _gzip(chunks):
+    compressor = zlib.compressobj(6, zlib.DEFLATED, 31)  # wbits=31: gzip container
+    for chunk in chunks:
+        data = compressor.compress(chunk)
+        if data:
+            yield data
+    yield compressor.flush()
+
+# ============================================================================
+# CSV: COPY TO STDOUT
+# ============================================================================
+class _QueueWriter:
+    """File-like target for copy_expert that hands buffered output to the consuming generator."""
+
+    def __init__(self, out, stop):
+        self.out = out
+        self.stop = stop
+        self.buffer = bytearray()
+
+    def write(self, data):
+        if self.stop.is_set():
+            raise InterruptedError("Export cancelled by client.")
+        self.buffer += data.encode("utf-8") if isinstance(data, str) else data
+        if len(self.buffer) >= EXPORT_CHUNK_BYTES:
+            self.flush()
+
+    def flush(self):
+        if self.buffer:
+            _put(self.out, bytes(self.buffer), self.stop)
+            self.buffer = bytearray()
+
+def _put(out, item, stop):
+    # Bounded queue = backpressure: COPY pauses while the client is slow; gives up once it disconnects
+    while not stop.is_set():
+        try:
+            out.put(item, timeout=0.5)
+            return
+        except queue.Full:
+            continue
+    raise InterruptedError("Export cancelled by client.")
+
+def _copy_worker(statements, out, stop):
+    conn = database.get_db_connection()
+    try:
+        if not conn:
+            raise ConnectionError("Database connection failed.")
+        writer = _QueueWriter(out, stop)
+        with conn.cursor() as cur:
+            database.begin_read_only(cur, database.EXPORT_STATEMENT_TIMEOUT_MS)
+            for idx, statement in enumerate(statements):
+                if idx > 0:
+                    writer.write(CSV_DATASET_SEPARATOR)
+                cur.copy_expert(f"COPY ({statement}) TO STDOUT WITH (FORMAT csv, HEADER)", writer)
+        writer.flush()
+        _put(out, None, stop)
+    except Exception as e:
+        if not stop.is_set():
+            _put(out, e, stop)
+    finally:
+        if conn:
+            conn.close()
+
+def _iter_csv(statements):
+    out = queue.Queue(maxsize=16)
+    stop = threading.Event()
+    worker = threading.Thread(target=_copy_worker, args=(statements, out, stop), name="export-copy", daemon=True)
+    worker.start()
+    try:
+        while True:
+            item = out.get()
+            if item is None:
+                return
+            if isinstance(item, Exception):
+                raise item
+            yield item
+    finally:
+        # Runs on normal completion and when the client goes away (generator closed)
+        stop.set()
+
+# ============================================================================
+# NDJSON / PARQUET: SERVER-SIDE CURSOR
+# ============================================================================
+def _iter_batches(statement):
+    """Yields (column descriptions, rows) per fetchmany batch from a named cursor."""
+    conn = database.get_db_connection()
+    if not conn:
+        raise ConnectionError("Database connection failed.")
+    try:
+        with conn.cursor() as cur:
+            database.begin_read_only(cur, database.EXPORT_STATEMENT_TIMEOUT_MS)
+        with conn.cursor(name=f"export_{uuid.uuid4().hex}") as cur:
+            cur.itersize = EXPORT_FETCH_BATCH
+            cur.execute(statement)
+            while True:
+                rows = cur.fetchmany(EXPORT_FETCH_BATCH)
+                if not rows:
+                    if cur.description is not None:
+                        yield cur.description, []
+                    return
+                yield cur.description, rows
+    finally:
+        conn.close()
+
+def _iter_ndjson(statements):
+    for idx, statement in enumerate(statements):
+        for description, rows in _iter_batches(statement):
+            columns = [d[0] for d in description]
+            lines = []
+            for row in rows:
+                record = dict(zip(columns, row))
+                if len(statements) > 1:
+                    record = {"dataset": idx + 1, **record}
+                lines.append(json.dumps(record, default=str))
+            if lines:
+                yield ("\n".join(lines) + "\n").encode("utf-8")
+
+# Postgres type OIDs -> Arrow types; anything else is exported as text
+_ARROW_TYPES = {
+    16: "bool_", 20: "int64", 21: "int64", 23: "int64",
+    700: "float64", 701: "float64", 1700: "float64",
+    1082: "date32", 1114: "timestamp", 1184: "timestamptz",
+}
+
+def _arrow_schema(description):
+    import pyarrow as pa
+
+    fields = []
+    for desc in description:
+        kind = _ARROW_TYPES.get(desc[1], "string")
+        if kind == "timestamp":
+            arrow_type = pa.timestamp("us")
+        elif kind == "timestamptz":
+            arrow_type = pa.timestamp("us", tz="UTC")
+        else:
+            arrow_type = getattr(pa, kind)()
+        fields.append(pa.field(desc[0], arrow_type))
+    return pa.schema(fields)
+
+class _ByteSink:
+    """Write-only file for ParquetWriter that lets us drain what it wrote after every row group."""
+
+    def __init__(self):
+        self.parts = []
+        self.position = 0
+        self.closed = False
+
+    def write(self, data):
+        self.parts.append(bytes(data))
+        self.position += len(data)
+        return len(data)
+
+    def tell(self):
+        return self.position
+
+    def flush(self):
+        pass
+
+    def close(self):
+        self.closed = True
+
+    def drain(self):
+        data = b"".join(self.parts)
+        self.parts = []
+        return data
+
+def _iter_parquet(statements):
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+
+    sink = _ByteSink()
+    writer = None
+    schema = None
+    try:
+        for description, rows in _iter_batches(statements[0]):
+            if writer is None:
+                schema = _arrow_schema(description)
+                writer = pq.ParquetWriter(sink, schema, compression="snappy")
+            if rows:
+                columns = list(zip(*rows))
+                arrays = []
+                for field, values in zip(schema, columns):
+                    if pa.types.is_string(field.type):
+                        values = [None if v is None else str(v) for v in values]
+                    elif field.type == pa.float64():
+                        values = [None if v is None else float(v) for v in values]
+                    arrays.append(pa.array(values, type=field.type))
+                # One row group per fetched batch
+                writer.write_table(pa.Table.from_arrays(arrays, schema=schema))
+            data = sink.drain()
+            if data:
+                yield data
+    finally:
+        if writer is not None:
+            writer.close()
+    data = sink.drain()
+    if data:
+        yield data
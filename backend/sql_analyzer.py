@@ -0,0 +1,199 @@
+"""
+Parser-based analysis of generated SQL (sqlglot, Postgres dialect).
+One parse per distinct SQL string, memoized: statement splitting that respects
+string literals and comments, the real relations a query reads (CTE names,
+subqueries, comma joins and schema-qualified names resolved through sqlglot's
+scopes), and a normalized form usable as a cache key. The parsed ASTs are
+shared with the validator and the index advisor.
+"""
+import os
+import re
+import hashlib
+from cache import LRUCache
+
+# Optional dependency: pip install sqlglot
+try:
+    import sqlglot
+    from sqlglot import exp
+    from sqlglot.errors import SqlglotError
+    from sqlglot.tokens import TokenType
+    from sqlglot.optimizer.scope import traverse_scope
+except ImportError:
+    sqlglot = None
+
+SQL_ANALYSIS_CACHE_SIZE = int(os.getenv("SQL_ANALYSIS_CACHE_SIZE", "2048"))
+DIALECT = "postgres"
+
+# Used only when sqlglot is missing or cannot parse the statement
+_FALLBACK_TABLES = re.compile(r'FROM\s+"?(\w+)"?|JOIN\s+"?(\w+)"?', re.IGNORECASE)
+
+_analysis_cache = LRUCache(max_entries=SQL_ANALYSIS_CACHE_SIZE)
+
+class SQLAnalysis:
+    """
+    Result of analyze(). `expressions` holds one AST per statement (None where parsing failed);
+    they are shared through the cache, so call .copy() before transforming one.
+    `tables` lists (schema, table) pairs, schema "" when unqualified.
+    """
+
+    def __init__(self, sql, statements, expressions, tables, error=""):
+        self.sql = sql
+        self.statements = statements
+        self.expressions = expressions
+        self.tables = tables
+        self.error = error
+        self.normalized = _normalize(statements, expressions)
+        self.fingerprint = hashlib.sha1(self.normalized.encode("utf-8")).hexdigest()
+        self._canonical = None
+
+    @property
+    def parsed(self):
+        """True when every statement has an AST."""
+        return bool(self.expressions) and all(e is not None for e in self.expressions)
+
+    @property
+    def canonical(self):
+        """Normalized form with identifier folding applied: "region" and region compare equal, "Region" does not."""
+        if self._canonical is None:
+            self._canonical = _canonicalize(self) if self.parsed else self.normalized
+        return self._canonical
+
+def analyze(sql):
+    """Returns the (memoized) SQLAnalysis for `sql`."""
+    cached = _analysis_cache.get(sql)
+    if cached is None:
+        cached = _analyze(sql)
+        _analysis_cache.set(sql, cached)
+    return cached
+
+def get_stats():
+    return _analysis_cache.stats()
+
+# ============================================================================
+# SPLITTING + PARSING
+# ============================================================================
+def split(sql):
+    """Splits on top-level semicolons only (not those inside literals, quoted names or comments)."""
+    if sqlglot is None:
+        return _naive_split(sql)
+    try:
+        tokens = sqlglot.Dialect.get_or_raise(DIALECT).tokenize(sql)
+    except SqlglotError:
+        return _naive_split(sql)
+    statements, start, has_tokens = [], 0, False
+    for token in tokens:
+        if token.token_type == TokenType.SEMICOLON:
+            if has_tokens:
+                statements.append(sql[start:token.start].strip())
+            start, has_tokens = token.end + 1, False
+        else:
+            has_tokens = True
+    if has_tokens:
+        statements.append(sql[start:].strip())
+    return statements
+
+def _naive_split(sql):
+    return [s.strip() for s in sql.split(';') if s.strip()]
+
+def _analyze(sql):
+    statements = split(sql)
+    if sqlglot is None:
+        return SQLAnalysis(sql, statements, [None] * len(statements), _fallback_tables(statements),
+                           "sqlglot is not installed")
+    expressions, tables, errors = [], [], []
+    for statement in statements:
+        try:
+            expression = sqlglot.parse_one(statement, read=DIALECT)
+        except SqlglotError as e:
+            expression = None
+            errors.append(str(e).splitlines()[0])
+        expressions.append(expression)
+        found = _relations(expression) if expression is not None else _fallback_tables([statement])
+        tables.extend(t for t in found if t not in tables)
+    return SQLAnalysis(sql, statements, expressions, tables, "; ".join(errors))
+
+def _relations(expression):
+    """(schema, table) pairs the statement really reads or writes; CTE references are resolved away."""
+    found = []
+    try:
+        # Scopes know which FROM items are CTEs or derived tables, even when a CTE shadows a table name
+        for scope in traverse_scope(expression):
+            for source in scope.sources.values():
+                if isinstance(source, exp.Table) and source.name:
+                    found.append((source.db, source.name))
+    except SqlglotError:
+        pass
+    # Tables outside any SELECT scope (INSERT/UPDATE targets, DDL) are caught here; being additive
+    # this can only make the access check stricter
+    cte_names = {cte.alias_or_name for cte in expression.find_all(exp.CTE)}
+    for table in expression.find_all(exp.Table):
+        if table.name and not (table.name in cte_names and not table.db):
+            found.append((table.db, table.name))
+    unique = []
+    for pair in found:
+        if pair not in unique:
+            unique.append(pair)
+    return unique
+
+def _fallback_tables(statements):
+    found = []
+    for statement in statements:
+        for tup in _FALLBACK_TABLES.findall(statement):
+            found.extend(("", t) for t in tup if t and ("", t) not in found)
+    return found
+
+def _normalize(statements, expressions):
+    parts = []
+    for statement, expression in zip(statements, expressions):
+        if expression is None:
+            parts.append(" ".join(statement.split()))
+        else:
+            parts.append(expression.sql(dialect=DIALECT, normalize=True, comments=False))
+    return ";\n".join(parts)
+
+def _canonicalize(analysis):
+    parts = []
+    for expression in analysis.expressions:
+        expression = expression.copy()
+        for identifier in expression.find_all(exp.Identifier):
+            if not identifier.quoted:
+                identifier.set("this", identifier.this.lower())
+                identifier.set("quoted", True)
+        parts.append(expression.sql(dialect=DIALECT, comments=False))
+    return ";\n".join(parts)
+
+def equivalent(a, b):
+    """True when two SQL strings differ only in formatting, keyword case or redundant quoting."""
+    return bool(a) and bool(b) and analyze(a).canonical == analyze(b).canonical
+
+# ============================================================================
+# AST HELPERS
+# ============================================================================
+def is_plain_select(expression):
+    """
+    True for a statement that only reads: SELECT, a set operation or VALUES (optionally parenthesized),
+    with no SELECT ... INTO and no data-modifying CTE. Transaction control, SET/RESET, DO, DDL, DML
+    and EXPLAIN are all refused.
+    """
+    while isinstance(expression, exp.Subquery):
+        expression = expression.this
+    if not isinstance(expression, (exp.Select, exp.Union, exp.Except, exp.Intersect, exp.Values)):
+        return False
+    if any(select.args.get("into") for select in expression.find_all(exp.Select)):
+        return False
+    return next(expression.find_all(exp.Insert, exp.Update, exp.Delete, exp.Merge), None) is None
+
+def predicate_columns(analysis):
+    """Column names used in WHERE, JOIN ... ON/USING and GROUP BY of the parsed statements."""
+    names = set()
+    for expression in analysis.expressions:
+        if expression is None:
+            continue
+        for node in expression.find_all(exp.Where, exp.Group, exp.Join):
+            if isinstance(node, exp.Join):
+                names.update(i.name for i in node.args.get("using") or [])
+                node = node.args.get("on")
+                if node is None:
+                    continue
+            names.update(c.name for c in node.find_all(exp.Column) if c.name)
+    return names
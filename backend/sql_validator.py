@@ -0,0 +1,255 @@
+"""
+Deterministic validation of generated SQL against the user's schema catalog.
+Resolves every table and column reference (with Postgres identifier folding),
+catches obvious type mismatches, and optionally EXPLAINs the query so Postgres
+reports anything the static checks missed. Runs in milliseconds; the LLM
+reflection call is only needed when these checks pass but leave doubts.
+"""
+import os
+import difflib
+import database
+import column_stats
+import sql_analyzer
+
+# Also EXPLAIN the query (planning only, nothing is executed) when the static checks pass
+SQL_VALIDATOR_EXPLAIN = os.getenv("SQL_VALIDATOR_EXPLAIN", "true").lower() == "true"
+
+_NUMERIC_TYPES = ("smallint", "integer", "bigint", "numeric", "decimal", "real", "double precision")
+_TEXT_TYPES = ("text", "character varying", "character")
+_MISSING = object()
+
+class ValidationReport:
+    """`errors` are certain (the query cannot run as written); `doubts` are worth a second opinion."""
+
+    def __init__(self):
+        self.errors = []
+        self.doubts = []
+
+    def error(self, message):
+        if message not in self.errors:
+            self.errors.append(message)
+
+    def doubt(self, message):
+        if message not in self.doubts:
+            self.doubts.append(message)
+
+    @property
+    def ok(self):
+        return not self.errors
+
+    def critique(self):
+        """Renders the findings in the reflection agent's STATUS/CRITIQUE format."""
+        status = "NEEDS_REVISION" if self.errors else "APPROVED"
+        lines = [f"- {e}" for e in self.errors] + [f"- (doubt) {d}" for d in self.doubts]
+        return f"STATUS: {status}\nCRITIQUE (local validator):\n" + ("\n".join(lines) if lines else "- none")
+
+def validate(sql, user_id, explain=SQL_VALIDATOR_EXPLAIN):
+    """Static checks against the cached catalog, then (if they pass) an EXPLAIN on Postgres."""
+    report = ValidationReport()
+    catalog = database.get_schema_catalog(user_id)
+    if catalog is None:
+        report.doubt("Schema catalog unavailable; identifiers were not checked.")
+        return report
+    check(sql, catalog, report)
+    if explain and report.ok:
+        err = database.check_plan(sql, user_id)
+        if err:
+            report.error(f"EXPLAIN failed: {err}")
+    return report
+
+# ============================================================================
+# STATIC CHECKS
+# ============================================================================
+def check(sql, catalog, report=None):
+    """Validates `sql` against a schema catalog ({"tables": {table: [(column, type)]}, "stats": ...})."""
+    report = report if report is not None else ValidationReport()
+    analysis = sql_analyzer.analyze(sql)
+    if not analysis.statements:
+        report.error("The SQL is empty.")
+        return report
+    if not analysis.parsed:
+        report.doubt(f"Could not parse the SQL locally ({analysis.error or 'parser unavailable'}).")
+        return report
+
+    tables = {name: dict(columns) for name, columns in catalog["tables"].items()}
+    stats = catalog.get("stats") or {}
+    for expression in analysis.expressions:
+        resolved = _resolve_references(expression, tables, report)
+        _check_types(expression, resolved, stats, report)
+        _check_joins(expression, report)
+    return report
+
+def _fold(identifier):
+    """Postgres folds unquoted identifiers to lower case; quoted ones are taken verbatim."""
+    return identifier.this if identifier.quoted else identifier.this.lower()
+
+def _suggest(identifier, names):
+    same = [n for n in names if n.lower() == identifier.this.lower()]
+    if same and not identifier.quoted:
+        return f' Unquoted names are folded to lower case; write "{same[0]}".'
+    close = same or difflib.get_close_matches(identifier.this, list(names), n=1)
+    return f' Did you mean "{close[0]}"?' if close else ""
+
+def _source_columns(source, tables, report):
+    """Known columns of a FROM item ({column: type}), or None when they cannot be known statically."""
+    exp = sql_analyzer.exp
+    if isinstance(source, exp.Table):
+        if not isinstance(source.this, exp.Identifier):
+            return None  # table function
+        if source.db and source.db.lower() != "public":
+            report.error(f"Table '{source.db}.{source.name}' is outside the uploaded tables.")
+            return None
+        if source.name.lower() in database.SHARED_TABLES:
+            return None
+        name = _fold(source.this)
+        if name not in tables:
+            report.error(f"Unknown table '{source.name}'.{_suggest(source.this, tables)}")
+            return None
+        return {"__table__": name, **tables[name]}
+    # Derived table or CTE: its output column names, folded like any other identifier
+    return _output_columns(source.expression)
+
+def _output_columns(query):
+    exp = sql_analyzer.exp
+    selects = getattr(query, "named_selects", None)
+    if not selects or "*" in selects:
+        return None
+    # WITH t(a, b) AS (...) / (...) AS s(a, b) rename the outputs
+    alias = query.parent.args.get("alias") if isinstance(query.parent, (exp.CTE, exp.Subquery)) else None
+    if alias is not None and alias.columns:
+        return {_fold(column): None for column in alias.columns}
+    columns = {}
+    for select in query.selects:
+        if isinstance(select, exp.Alias):
+            identifier = select.args.get("alias")
+        elif isinstance(select, exp.Column):
+            identifier = select.this
+        else:
+            identifier = None
+        # Unnamed expressions get Postgres's lower-case default name (count, sum, ?column?)
+        name = _fold(identifier) if isinstance(identifier, exp.Identifier) else select.alias_or_name.lower()
+        columns[name] = None
+    return columns
+
+def _resolve_references(expression, tables, report):
+    """Checks every column reference; returns {id(column node): (table, column, type)} for typed ones."""
+    exp = sql_analyzer.exp
+    resolved = {}
+    try:
+        scopes = list(sql_analyzer.traverse_scope(expression))
+    except sql_analyzer.SqlglotError as e:
+        report.doubt(f"Could not resolve scopes ({e}).")
+        return resolved
+    known = {}
+    for scope in scopes:
+        known[id(scope)] = {alias.lower(): _source_columns(source, tables, report)
+                            for alias, source in scope.sources.items()}
+
+    for scope in scopes:
+        aliases = {a.lower() for a in getattr(scope.expression, "named_selects", [])}
+        for column in scope.columns:
+            if not isinstance(column.this, exp.Identifier):
+                continue  # t.*
+            if column.table:
+                columns = _visible_source(scope, known, column.table.lower())
+                if columns is _MISSING:
+                    report.error(f"Missing FROM entry for '{column.table}' (in {column.sql(dialect='postgres')}).")
+                    continue
+                candidates = [columns]
+            else:
+                candidates = _visible_sources(scope, known)
+            if any(c is None for c in candidates):
+                continue  # an opaque source might provide it
+
+            name = _fold(column.this)
+            matches = [(c.get("__table__"), name, c[name]) for c in candidates if name in c and name != "__table__"]
+            if not matches:
+                if not column.table and column.name.lower() in aliases and column.find_ancestor(exp.Group, exp.Order, exp.Having):
+                    continue  # GROUP BY / ORDER BY an output alias
+                pool = {n for c in candidates for n in c if n != "__table__"}
+                owner = f" in '{column.table}'" if column.table else ""
+                report.error(f"Unknown column '{column.name}'{owner}.{_suggest(column.this, pool)}")
+            elif len(matches) > 1:
+                report.error(f"Column '{column.name}' is ambiguous; qualify it with a table alias.")
+            elif matches[0][0]:
+                resolved[id(column)] = matches[0]
+    return resolved
+
+def _visible_source(scope, known, alias):
+    while scope is not None:
+        if alias in known.get(id(scope), {}):
+            return known[id(scope)][alias]
+        scope = scope.parent
+    return _MISSING
+
+def _visible_sources(scope, known):
+    # Unqualified names resolve in the innermost scope that has FROM items (correlated subqueries see outer ones)
+    while scope is not None:
+        sources = known.get(id(scope), {})
+        if sources:
+            return list(sources.values())
+        scope = scope.parent
+    return []
+
+def _check_types(expression, resolved, stats, report):
+    exp = sql_analyzer.exp
+
+    def typed(node):
+        return resolved.get(id(node)) if isinstance(node, exp.Column) else None
+
+    for agg in expression.find_all(exp.Sum, exp.Avg):
+        ref = typed(agg.this)
+        if ref and ref[2] in _TEXT_TYPES:
+            report.error(f"{agg.key.upper()}() over text column '{ref[1]}'; pick a numeric column or cast it.")
+
+    for like in expression.find_all(exp.Like, exp.ILike):
+        ref = typed(like.this)
+        if ref and ref[2] not in _TEXT_TYPES:
+            report.error(f"LIKE on {ref[2]} column '{ref[1]}'; cast it with ::text.")
+
+    for cmp in expression.find_all(exp.EQ, exp.NEQ, exp.GT, exp.GTE, exp.LT, exp.LTE, exp.In):
+        values = cmp.expressions if isinstance(cmp, exp.In) else [cmp.expression]
+        ref = typed(cmp.this)
+        if ref is None and not isinstance(cmp, exp.In):
+            ref, values = typed(cmp.expression), [cmp.this]
+        if ref is None:
+            continue
+        literals = [v.this for v in values if isinstance(v, exp.Literal) and v.is_string]
+        if ref[2] in _NUMERIC_TYPES:
+            for value in literals:
+                if not _is_number(value):
+                    report.error(f"Numeric column '{ref[1]}' compared with text '{value}'.")
+        elif ref[2] in _TEXT_TYPES and isinstance(cmp, (exp.EQ, exp.NEQ, exp.In)):
+            _check_dictionary(ref, literals, stats, report)
+
+def _check_dictionary(ref, literals, stats, report):
+    """Doubts equality filters on values the column never holds (when its full value list is known)."""
+    entry = stats.get(ref[0], {}).get(ref[1])
+    top = (entry or {}).get("top") or []
+    if not top or entry.get("distinct_is_lower_bound") or len(top) < entry.get("distinct", 0):
+        return
+    known = [str(v) for v, _ in top]
+    if any(v.endswith("…") for v in known):
+        return
+    for value in literals:
+        if value not in known:
+            close = [k for k in known if k.lower() == value.lower()]
+            hint = f" Did you mean '{close[0]}'?" if close else f" Known values: {', '.join(map(repr, known[:column_stats.COLUMN_STATS_DICT_MAX_DISTINCT]))}."
+            report.doubt(f"'{value}' never occurs in '{ref[1]}'.{hint}")
+
+def _check_joins(expression, report):
+    exp = sql_analyzer.exp
+    for select in expression.find_all(exp.Select):
+        for join in select.args.get("joins") or []:
+            if join.args.get("on") or join.args.get("using") or select.args.get("where"):
+                continue
+            if (join.args.get("kind") or "").upper() == "CROSS" or not isinstance(join.this, exp.Table):
+                continue
+            report.doubt(f"No join condition for '{join.this.name}': this is a cartesian product.")
+
+def _is_number(value):
+    try:
+        float(value)
+        return True
+    except ValueError:
+        return False
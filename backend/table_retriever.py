@@ -0,0 +1,107 @@
+"""
+Local table retrieval ahead of the supervisor.
+Scores a user's tables against the question with BM25 over table names, column
+names and their most frequent values (from DynamicTable.column_stats), so only
+the top TABLE_RETRIEVER_TOP_K table schemas go into the LLM prompt instead of
+every upload. Indexes are built once per schema fingerprint.
+"""
+import os
+import re
+import math
+from collections import Counter
+from cache import LRUCache
+
+TABLE_RETRIEVER_ENABLED = os.getenv("TABLE_RETRIEVER_ENABLED", "true").lower() == "true"
+# Users with at most this many tables get the full schema; beyond it only the top-k are sent
+TABLE_RETRIEVER_TOP_K = int(os.getenv("TABLE_RETRIEVER_TOP_K", "8"))
+
+# Field weights: a hit on the table name says more than a hit on one of its values
+NAME_WEIGHT, COLUMN_WEIGHT, VALUE_WEIGHT = 3, 2, 1
+# Top values per column fed to the index
+VALUES_PER_COLUMN = 10
+BM25_K1, BM25_B = 1.2, 0.75
+
+_WORD = re.compile(r"[A-Z]?[a-z]+|[A-Z]+(?![a-z])|\d+")
+_STOPWORDS = frozenset(
+    "a an and are as at be by can do does for from give how i in is it list me my of on or per "
+    "please show tell than that the their there these this to was what when where which who with".split()
+)
+
+_indexes = LRUCache(max_entries=256)
+
+def tokenize(text):
+    """Words of identifiers and prose alike: `orderDate`, `order_date` and 'order dates' -> order, date."""
+    tokens = []
+    for word in _WORD.findall(str(text)):
+        word = word.lower()
+        if word in _STOPWORDS:
+            continue
+        if len(word) > 3 and word.endswith("ies"):
+            word = word[:-3] + "y"
+        elif len(word) > 3 and word.endswith("s") and not word.endswith("ss"):
+            word = word[:-1]
+        tokens.append(word)
+    return tokens
+
+class TableIndex:
+    """BM25 over one document per table."""
+
+    def __init__(self, tables, stats=None):
+        stats = stats or {}
+        self.docs = {}
+        for table, columns in tables.items():
+            doc = Counter()
+            for token in tokenize(table):
+                doc[token] += NAME_WEIGHT
+            table_stats = stats.get(table, {})
+            for column, _ in columns:
+                for token in tokenize(column):
+                    doc[token] += COLUMN_WEIGHT
+                for value, _ in (table_stats.get(column) or {}).get("top", [])[:VALUES_PER_COLUMN]:
+                    if isinstance(value, str):
+                        for token in tokenize(value):
+                            doc[token] += VALUE_WEIGHT
+            self.docs[table] = doc
+        self.lengths = {t: sum(d.values()) for t, d in self.docs.items()}
+        self.avg_length = (sum(self.lengths.values()) / len(self.docs)) if self.docs else 0.0
+        df = Counter(token for doc in self.docs.values() for token in doc)
+        n = len(self.docs)
+        self.idf = {token: math.log(1 + (n - f + 0.5) / (f + 0.5)) for token, f in df.items()}
+
+    def rank(self, question):
+        """[(table, score)] for tables sharing at least one term with the question, best first."""
+        terms = set(tokenize(question))
+        scores = []
+        for table, doc in self.docs.items():
+            norm = BM25_K1 * (1 - BM25_B + BM25_B * self.lengths[table] / (self.avg_length or 1))
+            score = 0.0
+            for term in terms:
+                tf = doc.get(term)
+                if tf:
+                    score += self.idf[term] * tf * (BM25_K1 + 1) / (tf + norm)
+            if score > 0:
+                scores.append((table, score))
+        scores.sort(key=lambda item: -item[1])
+        return scores
+
+def get_index(catalog):
+    """The TableIndex for a schema catalog, built once per fingerprint."""
+    index = _indexes.get(catalog["fingerprint"])
+    if index is None:
+        index = TableIndex(catalog["tables"], catalog.get("stats"))
+        _indexes.set(catalog["fingerprint"], index)
+    return index
+
+def get_stats():
+    return _indexes.stats()
+
+def select_tables(catalog, question, k=None):
+    """
+    Tables whose schema should go into the prompt: all of them when there are at most k,
+    else the k best-ranked. An empty list means nothing matched and the caller keeps the full schema.
+    """
+    k = k or TABLE_RETRIEVER_TOP_K
+    names = list(catalog["tables"])
+    if not TABLE_RETRIEVER_ENABLED or len(names) <= k:
+        return names
+    return [table for table, _ in get_index(catalog).rank(question)[:k]]
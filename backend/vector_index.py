@@ -0,0 +1,225 @@
+"""
+Local vector index for approximate question matching.
+Embeds text with a CPU sentence-transformers model when EMBEDDING_MODEL is set,
+otherwise with a hashed TF-IDF vectorizer (no extra dependencies). Vectors live
+in one NumPy matrix so lookup is a single matrix-vector product, and the matrix
+is persisted as .npy and memory-mapped on load so workers start instantly.
+"""
+import os
+import re
+import glob
+import json
+import uuid
+import zlib
+import tempfile
+import threading
+import numpy as np
+
+# Optional: serializes saves across worker processes (POSIX only)
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
+
+EMBEDDING_MODEL = os.getenv("EMBEDDING_MODEL", "")
+EMBEDDING_HASH_DIM = int(os.getenv("EMBEDDING_HASH_DIM", "512"))
+
+_TOKEN = re.compile(r"\w+")
+
+class HashingEmbedder:
+    """
+    Hashed bag of word unigrams, bigrams and character trigrams with sublinear TF.
+    IDF weights are applied by the index, which knows the corpus.
+    """
+    name = "hashing"
+    uses_idf = True
+
+    def __init__(self, dim=EMBEDDING_HASH_DIM):
+        self.dim = dim
+
+    def _features(self, text):
+        words = _TOKEN.findall(text.lower())
+        feats = list(words)
+        feats.extend(f"{a} {b}" for a, b in zip(words, words[1:]))
+        for w in words:
+            padded = f"#{w}#"
+            feats.extend(f"~{padded[i:i + 3]}" for i in range(len(padded) - 2))
+        return feats
+
+    def embed(self, texts):
+        matrix = np.zeros((len(texts), self.dim), dtype=np.float32)
+        for row, text in enumerate(texts):
+            # crc32 is stable across processes, unlike hash()
+            buckets = [zlib.crc32(f.encode("utf-8")) % self.dim for f in self._features(text)]
+            if buckets:
+                idx, counts = np.unique(buckets, return_counts=True)
+                matrix[row, idx] = 1.0 + np.log(counts)
+        return matrix
+
+class SentenceEmbedder:
+    """Dense CPU embeddings from sentence-transformers (optional dependency)."""
+    uses_idf = False
+
+    def __init__(self, model_name):
+        from sentence_transformers import SentenceTransformer
+        self.name = model_name
+        self._model = SentenceTransformer(model_name, device="cpu")
+        self.dim = self._model.get_sentence_embedding_dimension()
+
+    def embed(self, texts):
+        return np.asarray(self._model.encode(list(texts), normalize_embeddings=True), dtype=np.float32)
+
+_default_embedder = None
+_embedder_lock = threading.Lock()
+
+def get_default_embedder():
+    global _default_embedder
+    if _default_embedder is None:
+        with _embedder_lock:
+            if _default_embedder is None:
+                embedder = None
+                if EMBEDDING_MODEL:
+                    try:
+                        embedder = SentenceEmbedder(EMBEDDING_MODEL)
+                    except Exception as e:
+                        print(f"⚠️ Embedding model unavailable ({e}). Falling back to hashed TF-IDF.")
+                _default_embedder = embedder or HashingEmbedder()
+    return _default_embedder
+
+def _normalize_rows(matrix):
+    norms = np.linalg.norm(matrix, axis=1, keepdims=True)
+    norms[norms == 0] = 1.0
+    return matrix / norms
+
+class VectorIndex:
+    """
+    Append-mostly cosine-similarity index mapping integer ids to vectors.
+    With `path`, ids/metadata are stored at <path>.json and name the vector file
+    (<path>.<version>.npy, memory-mapped on load). Each save writes a new vector
+    file and then swaps the metadata in one os.replace, so readers never pair
+    vectors and ids from different writers.
+    """
+
+    def __init__(self, path=None, embedder=None):
+        self.path = path
+        self.embedder = embedder or get_default_embedder()
+        self._lock = threading.RLock()
+        self._vectors = np.zeros((0, self.embedder.dim), dtype=np.float32)
+        self._ids = np.zeros(0, dtype=np.int64)
+        self._search_matrix = None  # IDF-weighted, row-normalized copy; rebuilt lazily after writes
+        self._idf = None
+        if path:
+            self._load()
+
+    def __len__(self):
+        return len(self._ids)
+
+    @property
+    def ids(self):
+        return self._ids.tolist()
+
+    def _load(self):
+        meta_path = f"{self.path}.json"
+        if not os.path.exists(meta_path):
+            return
+        try:
+            # A concurrent save may delete the vector file we were pointed at: re-read the metadata once
+            for _ in range(2):
+                with open(meta_path, "r") as f:
+                    meta = json.load(f)
+                vec_path = self._vector_path(meta)
+                if os.path.exists(vec_path):
+                    break
+            else:
+                return
+            if meta.get("embedder") != self.embedder.name or meta.get("dim") != self.embedder.dim:
+                return  # Built with a different embedder; caller will rebuild
+            vectors = np.load(vec_path, mmap_mode="r")
+            if len(vectors) != len(meta["ids"]):
+                return
+            self._vectors = vectors
+            self._ids = np.asarray(meta["ids"], dtype=np.int64)
+        except Exception as e:
+            print(f"⚠️ Vector index at {self.path} unreadable, rebuilding: {e}")
+
+    def _vector_path(self, meta):
+        # Indexes saved before versioned vector files stored them at <path>.npy
+        name = meta.get("vectors")
+        return os.path.join(os.path.dirname(self.path), name) if name else f"{self.path}.npy"
+
+    def save(self):
+        if not self.path:
+            return
+        directory = os.path.dirname(os.path.abspath(self.path))
+        with self._lock, open(f"{self.path}.lock", "a") as lock_file:
+            if fcntl is not None:
+                fcntl.flock(lock_file, fcntl.LOCK_EX)
+            vec_name = f"{os.path.basename(self.path)}.{os.getpid()}-{uuid.uuid4().hex[:12]}.npy"
+            np.save(os.path.join(directory, vec_name), np.ascontiguousarray(self._vectors))
+            fd, tmp_meta = tempfile.mkstemp(dir=directory, prefix=f"{os.path.basename(self.path)}.", suffix=".json.tmp")
+            with os.fdopen(fd, "w") as f:
+                json.dump({"embedder": self.embedder.name, "dim": self.embedder.dim, "ids": self.ids,
+                           "vectors": vec_name}, f)
+            os.replace(tmp_meta, f"{self.path}.json")
+            # Under the lock no other writer is between writing its vectors and swapping the metadata,
+            # so every other vector file is superseded (readers that mapped one keep their mapping)
+            for old in glob.glob(f"{glob.escape(self.path)}.*.npy") + [f"{self.path}.npy"]:
+                if os.path.basename(old) != vec_name and os.path.exists(old):
+                    try:
+                        os.remove(old)
+                    except OSError:
+                        pass
+
+    def add(self, ids, texts):
+        if not len(ids):
+            return
+        vectors = self.embedder.embed(texts)
+        with self._lock:
+            self._vectors = np.vstack([np.asarray(self._vectors), vectors])
+            self._ids = np.concatenate([self._ids, np.asarray(ids, dtype=np.int64)])
+            self._search_matrix = None
+
+    def keep_only(self, ids):
+        """Drops every vector whose id is not in `ids`."""
+        with self._lock:
+            mask = np.isin(self._ids, np.asarray(list(ids), dtype=np.int64))
+            if mask.all():
+                return
+            self._vectors = np.asarray(self._vectors)[mask]
+            self._ids = self._ids[mask]
+            self._search_matrix = None
+
+    def rebuild(self, ids, texts):
+        with self._lock:
+            self._vectors = np.zeros((0, self.embedder.dim), dtype=np.float32)
+            self._ids = np.zeros(0, dtype=np.int64)
+            self._search_matrix = None
+            self.add(ids, texts)
+
+    def _prepare(self):
+        if self._search_matrix is None:
+            vectors = np.asarray(self._vectors, dtype=np.float32)
+            if self.embedder.uses_idf and len(vectors):
+                df = np.count_nonzero(vectors, axis=0)
+                self._idf = (np.log((1 + len(vectors)) / (1 + df)) + 1.0).astype(np.float32)
+                vectors = vectors * self._idf
+            self._search_matrix = _normalize_rows(vectors)
+        return self._search_matrix
+
+    def search(self, text, k=3, min_score=0.0):
+        """Returns up to k (id, cosine_score) pairs, best first."""
+        with self._lock:
+            if not len(self._ids):
+                return []
+            matrix = self._prepare()
+            query = self.embedder.embed([text])[0]
+            if self.embedder.uses_idf:
+                query = query * self._idf
+            norm = np.linalg.norm(query)
+            if norm == 0:
+                return []
+            scores = matrix @ (query / norm)
+            k = min(k, len(scores))
+            top = np.argpartition(-scores, k - 1)[:k]
+            top = top[np.argsort(-scores[top])]
+            return [(int(self._ids[i]), float(scores[i])) for i in top if scores[i] >= min_score]
@@ -62,6 +62,7 @@ function HomePage() {
     const [file, setFile] = useState(null);
     const [tableName, setTableName] = useState('');
     const [isUploading, setIsUploading] = useState(false);
+    const [uploadProgress, setUploadProgress] = useState(null);
     const [isProcessing, setIsProcessing] = useState(false);
     const [schema, setSchema] = useState('');
     const [showTechDetails, setShowTechDetails] = useState({});
@@ -124,12 +125,16 @@ function HomePage() {
         formData.append('table_name', tableName);
 
         try {
-            await axios.post(`${API_BASE_URL}/upload`, formData, {
+            const { data } = await axios.post(`${API_BASE_URL}/upload`, formData, {
                 headers: { Authorization: `Bearer ${token}` }
             });
+            const job = await waitForIngestJob(data.job_id);
+            if (job.status !== 'succeeded') {
+                throw new Error(job.message || `Ingestion ${job.status}`);
+            }
             setMessages(prev => [...prev, {
                 role: 'assistant',
-                content: `Node Synchronized. Target "${tableName}" has been successfully ingested into the persistent knowledge layer. I have analyzed its structure and am ready for queries.`
+                content: `Node Synchronized. Target "${tableName}" has been successfully ingested into the persistent knowledge layer (${job.row_count.toLocaleString()} rows). I have analyzed its structure and am ready for queries.`
             }]);
             fetchSchema();
             setFile(null);
@@ -140,6 +145,21 @@ function HomePage() {
             }]);
         } finally {
             setIsUploading(false);
+            setUploadProgress(null);
+        }
+    };
+
+    // Uploads are ingested in the background; poll the job until it finishes
+    const waitForIngestJob = async (jobId) => {
+        while (true) {
+            const { data: job } = await axios.get(`${API_BASE_URL}/jobs/${jobId}`, {
+                headers: { Authorization: `Bearer ${token}` }
+            });
+            if (['succeeded', 'failed', 'cancelled'].includes(job.status)) {
+                return job;
+            }
+            setUploadProgress(job);
+            await new Promise(resolve => setTimeout(resolve, 1000));
         }
     };
 
@@ -317,7 +337,7 @@ function HomePage() {
                                             className="btn-primary w-full h-12 text-xs uppercase tracking-[0.2em]"
                                         >
                                             {isUploading ? <Loader2 size={18} className="animate-spin" /> : <Plus size={18} />}
-                                            Sync Knowledge
+                                            {uploadProgress ? `Syncing ${uploadProgress.rows_loaded.toLocaleString()} rows` : 'Sync Knowledge'}
                                         </button>
                                     </motion.div>
                                 )}